@@ -0,0 +1,145 @@
+"""
+Measures the throughput of game moves sent through websockets
+with the server running on each of the available event loops.
+
+The server runs in a separate process, each move is a round-trip:
+the move is sent by one player and the benchmark waits until
+both players receive the game state diff.
+
+Usage: python benchmarks/bench_event_loop.py [moves] [persistence]
+"""
+import asyncio
+import multiprocessing
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import aiohttp
+
+from quadradiusr_server.auth import User
+from quadradiusr_server.config import ServerConfig
+from quadradiusr_server.constants import QrwsOpcode
+from quadradiusr_server.db.base import Game
+from quadradiusr_server.db.transactions import transaction_context
+from quadradiusr_server.game_state import GameState
+from quadradiusr_server.server import QuadradiusRServer, create_event_loop
+
+
+async def _setup(server: QuadradiusRServer):
+    await server.start()
+    game_id = str(uuid.uuid4())
+    async with transaction_context(server.database):
+        users = [User(
+            id_=str(uuid.uuid4()),
+            username_=f'player_{i}',
+            password_=server.auth.hash_password(b'password'),
+        ) for i in range(2)]
+        for user in users:
+            await server.repository.user_repository.add(user)
+        game = Game(
+            id_=game_id,
+            player_a_id_=users[0].id_,
+            player_b_id_=users[1].id_,
+            expires_at_=datetime.now(timezone.utc) + timedelta(hours=1),
+            game_state_=GameState.initial(users[0].id_, users[1].id_),
+        )
+        await server.repository.game_repository.add(game)
+        tokens = [await server.auth.issue_token(user) for user in users]
+    return server.get_url('ws'), game_id, tokens
+
+
+def _run_server(event_loop: str, persistence: str, conn):
+    config = ServerConfig(host='127.0.0.1', port=0, event_loop=event_loop)
+    config.game.persistence = persistence
+    config.database.create_metadata = True
+    config.cluster.primary = False
+    server = QuadradiusRServer(config)
+    loop = create_event_loop(event_loop)
+    conn.send(loop.run_until_complete(_setup(server)))
+    # serve until the benchmark finishes
+    loop.run_until_complete(loop.run_in_executor(None, conn.recv))
+    loop.run_until_complete(server.shutdown())
+    loop.close()
+
+
+def _tile_id_at(game_state, x, y):
+    for tile_id, tile in game_state['board']['tiles'].items():
+        if tile['position'] == {'x': x, 'y': y}:
+            return tile_id
+
+
+def _piece_id_at(game_state, x, y):
+    tile_id = _tile_id_at(game_state, x, y)
+    for piece_id, piece in game_state['board']['pieces'].items():
+        if piece['tile_id'] == tile_id:
+            return piece_id
+
+
+async def _receive(ws, op):
+    while True:
+        msg = await ws.receive_json()
+        if msg['op'] == op:
+            return msg
+
+
+async def _play(url: str, game_id: str, tokens, moves: int) -> float:
+    async with aiohttp.ClientSession() as session:
+        game_ws = f'{url}/game/{game_id}/connect'
+        async with session.ws_connect(game_ws) as ws0, \
+                session.ws_connect(game_ws) as ws1:
+            wss = [ws0, ws1]
+            for ws, token in zip(wss, tokens):
+                await ws.send_json({'op': QrwsOpcode.IDENTIFY, 'd': {'token': token}})
+                await _receive(ws, QrwsOpcode.SERVER_READY)
+            game_state = (await _receive(ws0, QrwsOpcode.GAME_STATE))['d']['game_state']
+            await _receive(ws1, QrwsOpcode.GAME_STATE)
+
+            # both players move a piece back and forth
+            paths = [
+                [(_piece_id_at(game_state, 0, 1), _tile_id_at(game_state, 0, 2)),
+                 (_piece_id_at(game_state, 0, 1), _tile_id_at(game_state, 0, 1))],
+                [(_piece_id_at(game_state, 1, 6), _tile_id_at(game_state, 1, 5)),
+                 (_piece_id_at(game_state, 1, 6), _tile_id_at(game_state, 1, 6))],
+            ]
+
+            start = time.perf_counter()
+            for i in range(moves):
+                player = i % 2
+                piece_id, tile_id = paths[player][(i // 2) % 2]
+                await wss[player].send_json({
+                    'op': QrwsOpcode.MOVE,
+                    'd': {'piece_id': piece_id, 'tile_id': tile_id},
+                })
+                result = await _receive(wss[player], QrwsOpcode.ACTION_RESULT)
+                assert result['d']['is_legal'], result
+                await asyncio.gather(
+                    _receive(ws0, QrwsOpcode.GAME_STATE_DIFF),
+                    _receive(ws1, QrwsOpcode.GAME_STATE_DIFF))
+            return time.perf_counter() - start
+
+
+def main():
+    moves = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    persistence = sys.argv[2] if len(sys.argv) > 2 else 'sync'
+    context = multiprocessing.get_context('spawn')
+    for event_loop in ['asyncio', 'uvloop']:
+        conn, child_conn = context.Pipe()
+        process = context.Process(target=_run_server, args=(event_loop, persistence, child_conn))
+        process.start()
+        while not conn.poll(0.1):
+            if not process.is_alive():
+                raise RuntimeError(f'Server with {event_loop} failed to start')
+        url, game_id, tokens = conn.recv()
+        try:
+            elapsed = asyncio.run(_play(url, game_id, tokens, moves))
+        finally:
+            conn.send(None)
+            process.join()
+        print(f'{event_loop:>8}: '
+              f'{moves / elapsed:8.0f} moves/s, '
+              f'{elapsed / moves * 1e6:8.1f} us per move')
+
+
+if __name__ == '__main__':
+    main()
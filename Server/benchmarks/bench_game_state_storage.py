@@ -0,0 +1,56 @@
+"""
+Measures the time of storing and loading a game state and the changes
+made by a move, and their stored size, for pickle (used by older versions
+of the server) and the game state codec.
+
+Usage: python benchmarks/bench_game_state_storage.py [iterations]
+"""
+import pickle
+import sys
+import timeit
+
+from quadradiusr_server.game_journal import ActionJournal
+from quadradiusr_server.game_state import GameState
+from quadradiusr_server.game_state_codec import encode_game_state, decode_game_state, \
+    encode_changes, decode_changes
+
+
+def _measure(label: str, name: str, value, dumps, loads, iterations: int):
+    stored = dumps(value)
+    store_time = timeit.timeit(lambda: dumps(value), number=iterations)
+    load_time = timeit.timeit(lambda: loads(stored), number=iterations)
+    print(f'{label:>16} {name:>6}: '
+          f'store {store_time / iterations * 1e6:8.2f} us, '
+          f'load {load_time / iterations * 1e6:8.2f} us, '
+          f'{len(stored)} bytes')
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    formats = {
+        'pickle': (pickle.dumps, pickle.loads),
+        'codec': (encode_game_state, decode_game_state),
+    }
+
+    for compact in [False, True]:
+        game_state = GameState.initial('player_a', 'player_b', compact=compact)
+        board = type(game_state.board).__name__
+        for name, (dumps, loads) in formats.items():
+            _measure(board, name, game_state, dumps, loads, iterations)
+
+    game_state = GameState.initial('player_a', 'player_b')
+    journal = ActionJournal()
+    with game_state.journaled(journal):
+        game_state.move_piece(
+            game_state.board.get_piece_at(0, 1).id,
+            game_state.board.get_tile_at(0, 2).id)
+    change_formats = {
+        'pickle': (pickle.dumps, pickle.loads),
+        'codec': (encode_changes, decode_changes),
+    }
+    for name, (dumps, loads) in change_formats.items():
+        _measure('move changes', name, journal.changes, dumps, loads, iterations * 10)
+
+
+if __name__ == '__main__':
+    main()
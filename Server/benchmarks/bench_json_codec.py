@@ -0,0 +1,36 @@
+"""
+Measures the time of encoding and decoding a typical game state message
+with each of the available JSON codecs.
+
+Usage: python benchmarks/bench_json_codec.py [iterations]
+"""
+import sys
+import timeit
+
+from quadradiusr_server.game_state import GameState
+from quadradiusr_server.json_codec import create_codec
+from quadradiusr_server.qrws_messages import GameStateMessage
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    game_state = GameState.initial('player_a', 'player_b')
+    message = GameStateMessage(
+        recipient_id='player_a',
+        game_state=game_state.serialize_for('player_a'),
+        etag='etag',
+    ).to_json()
+
+    for name in ['json', 'orjson']:
+        codec = create_codec(name)
+        encoded = codec.dumps(message)
+        encode_time = timeit.timeit(lambda: codec.dumps(message), number=iterations)
+        decode_time = timeit.timeit(lambda: codec.loads(encoded), number=iterations)
+        print(f'{type(codec).__name__:>16}: '
+              f'encode {encode_time / iterations * 1e6:8.2f} us, '
+              f'decode {decode_time / iterations * 1e6:8.2f} us, '
+              f'{len(encoded)} bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Measures the time of dispatching a notification
+with many subscribers registered in the notification service.
+
+Usage: python benchmarks/bench_notification.py [subscribers] [iterations]
+"""
+import asyncio
+import sys
+import time
+
+from quadradiusr_server.notification import NotificationService, Handler, Notification
+
+
+class NoopHandler(Handler):
+    async def handle(self, notification: Notification):
+        pass
+
+
+async def main():
+    subscribers = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    ns = NotificationService()
+    for i in range(subscribers):
+        # a typical gateway connection subscribes to every topic
+        ns.register_handler(f'user{i}', '*', NoopHandler())
+        ns.register_handler(f'user{i}', 'lobby.*', NoopHandler())
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        await ns.notify_now(Notification(
+            topic='lobby.message.received',
+            subject_id=f'user{i % subscribers}',
+            data={},
+        ))
+    elapsed = time.perf_counter() - start
+    print(f'{subscribers} subscribers: {elapsed / iterations * 1e6:.2f} us per notification')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
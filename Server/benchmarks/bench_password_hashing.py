@@ -0,0 +1,69 @@
+"""
+Measures the event loop lag during concurrent logins,
+with passwords verified on the event loop
+and in each of the available executors.
+
+The lag is the delay of a task which wakes up every millisecond,
+like a game or lobby connection would.
+
+Usage: python benchmarks/bench_password_hashing.py [logins] [hash_workers]
+"""
+import asyncio
+import sys
+import time
+from unittest.mock import Mock
+
+from quadradiusr_server.auth import Auth
+from quadradiusr_server.config import AuthConfig
+
+
+async def _measure_lag(stopped: asyncio.Event, lags: list):
+    interval = 0.001
+    while not stopped.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def _run(auth: Auth, executor: str, logins: int, password_hash: str):
+    async def login():
+        if executor == 'none':
+            return auth.is_password_valid(b'password', password_hash)
+        return await auth.is_password_valid_async(b'password', password_hash)
+
+    # start the executor before measuring
+    await auth.is_password_valid_async(b'password', password_hash)
+
+    stopped = asyncio.Event()
+    lags = []
+    lag_task = asyncio.create_task(_measure_lag(stopped, lags))
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stopped.set()
+    await lag_task
+    assert all(results)
+
+    lags.sort()
+    print(f'{executor:>8}: '
+          f'{elapsed:6.2f} s total, '
+          f'lag p50 {lags[len(lags) // 2] * 1e3:8.2f} ms, '
+          f'max {lags[-1] * 1e3:8.2f} ms')
+
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    hash_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    for executor in ['none', 'thread', 'process']:
+        auth = Auth(AuthConfig(
+            hash_executor=executor if executor != 'none' else 'thread',
+            hash_workers=hash_workers,
+        ), Mock())
+        password_hash = auth.hash_password(b'password')
+        asyncio.run(_run(auth, executor, logins, password_hash))
+        auth.shutdown()
+
+
+if __name__ == '__main__':
+    main()
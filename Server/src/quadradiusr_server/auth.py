@@ -1,19 +1,106 @@
+import asyncio
 import base64
 import hashlib
+import multiprocessing
 import os
+import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
-from typing import Optional
+from typing import Optional, Dict, Iterable, Tuple
+
+from sqlalchemy.orm import make_transient_to_detached
 
 from quadradiusr_server.config import AuthConfig
 from quadradiusr_server.db.base import User, AccessToken
 from quadradiusr_server.db.repository import Repository
+from quadradiusr_server.db.transactions import transaction_context
+from quadradiusr_server.notification import NotificationService, Handler, Notification
+from quadradiusr_server.signed_tokens import TokenSigner, TokenClaims
+
+# invalidated tokens are broadcast to other processes using this subject and topic
+INVALIDATED_TOKENS_SUBJECT_ID = '@auth'
+INVALIDATED_TOKENS_TOPIC = 'auth.tokens.invalidated'
+
+
+def _scrypt(password: bytes, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p)
+
+
+def _get_cache_key(token: str) -> str:
+    # raw tokens are neither kept in the cache, nor sent to other processes
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+@dataclass
+class PasswordHashingStats:
+    # passwords waiting to be hashed or being hashed
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    hashed_passwords: int = 0
+
+
+@dataclass
+class _CachedToken:
+    token_id: str
+    user_id: str
+    username: str
+    expires_at: datetime
+    access_expires_at: datetime
+    cached_at: float
+
+    def is_valid(self, now: datetime) -> bool:
+        return self.expires_at > now and self.access_expires_at > now
+
+    def create_user(self) -> User:
+        # the password is never needed by authorized endpoints
+        user = User(
+            id_=self.user_id,
+            username_=self.username,
+        )
+        make_transient_to_detached(user)
+        return user
+
+
+class _InvalidatedTokensHandler(Handler):
+    def __init__(self, auth: 'Auth') -> None:
+        self._auth = auth
+
+    async def handle(self, notification: Notification):
+        self._auth._invalidate_cache_keys(notification.data['keys'])
 
 
 class Auth:
-    def __init__(self, config: AuthConfig, repository: Repository) -> None:
+    def __init__(
+            self, config: AuthConfig, repository: Repository,
+            notification_service: NotificationService = None) -> None:
         self.config = config
         self.repository = repository
+        self.notification_service = notification_service
+        # SHA-256 of the token -> cached token
+        self._token_cache: 'OrderedDict[str, _CachedToken]' = OrderedDict()
+        if notification_service is not None:
+            notification_service.register_handler(
+                INVALIDATED_TOKENS_SUBJECT_ID, INVALIDATED_TOKENS_TOPIC,
+                _InvalidatedTokensHandler(self))
+        # token ID -> last access time, not saved to the database yet
+        self._token_accesses: Dict[str, datetime] = dict()
+        if config.hash_executor not in ('thread', 'process'):
+            raise ValueError(f'Unknown hash executor: {config.hash_executor}')
+        self._hash_executor: Optional[Executor] = None
+        self.hashing_stats = PasswordHashingStats()
+
+        if config.token_format not in ('random', 'signed'):
+            raise ValueError(f'Unknown token format: {config.token_format}')
+        self._signer: Optional[TokenSigner] = None
+        if config.token_secret:
+            self._signer = TokenSigner(config.token_secret.encode())
+        elif config.token_format == 'signed':
+            raise ValueError('Signed tokens require auth.token_secret')
+        # token ID -> expiration, for signed tokens
+        self._revoked_tokens: Dict[str, datetime] = dict()
 
     async def login(self, username: str, password: bytes) -> Optional[User]:
         user_repository = self.repository.user_repository
@@ -21,7 +108,7 @@ class Auth:
         if not user:
             return None
 
-        if self.is_password_valid(password, user.password_):
+        if await self.is_password_valid_async(password, user.password_):
             return user
         else:
             return None
@@ -33,10 +120,14 @@ class Auth:
             timedelta(seconds=self.config.token_exp)
             if self.config.token_exp > 0
             else timedelta(days=500))
-        access_expires_at = now + (
-            timedelta(seconds=self.config.token_access_exp)
-            if self.config.token_access_exp > 0
-            else timedelta(days=500))
+        if self.config.token_format == 'signed':
+            return self._signer.sign(TokenClaims(
+                token_id=str(uuid.uuid4()),
+                user_id=user.id_,
+                username=user.username_,
+                expires_at=min(expires_at, self._get_access_expires_at(now)),
+            ))
+
         token = AccessToken(
             id_=str(uuid.uuid4()),
             user_=user,
@@ -44,22 +135,197 @@ class Auth:
             created_at_=now,
             accessed_at_=now,
             expires_at_=expires_at,
-            access_expires_at_=access_expires_at,
+            access_expires_at_=self._get_access_expires_at(now),
         )
         await repo.add(token)
+        self._cache_token(token)
         return token.token_
 
     def _random_token(self):
         return str(uuid.uuid4())
 
+    def _get_access_expires_at(self, accessed_at: datetime) -> datetime:
+        return accessed_at + (
+            timedelta(seconds=self.config.token_access_exp)
+            if self.config.token_access_exp > 0
+            else timedelta(days=500))
+
+    def _cache_token(self, access_token: AccessToken) -> _CachedToken:
+        user = access_token.user_
+        cached = _CachedToken(
+            token_id=access_token.id_,
+            user_id=user.id_,
+            username=user.username_,
+            expires_at=access_token.expires_at_,
+            access_expires_at=access_token.access_expires_at_,
+            cached_at=time.monotonic(),
+        )
+        accessed_at = self._token_accesses.get(cached.token_id)
+        if accessed_at is not None:
+            # the database does not know about this access yet
+            cached.access_expires_at = max(
+                cached.access_expires_at,
+                self._get_access_expires_at(accessed_at))
+
+        key = _get_cache_key(access_token.token_)
+        self._token_cache[key] = cached
+        self._token_cache.move_to_end(key)
+        while len(self._token_cache) > self.config.token_cache_size:
+            self._token_cache.popitem(last=False)
+        return cached
+
+    def _get_cached_token(self, token: str) -> Optional[_CachedToken]:
+        key = _get_cache_key(token)
+        cached = self._token_cache.get(key)
+        if cached is None:
+            return None
+        if time.monotonic() - cached.cached_at >= self.config.token_cache_ttl:
+            # the token might have been removed by another process
+            # without the invalidation reaching this one
+            del self._token_cache[key]
+            return None
+        self._token_cache.move_to_end(key)
+        return cached
+
+    def invalidate_tokens(self, tokens: Iterable[str]):
+        """
+        Removes the tokens from the cache of this process,
+        and of other processes using the notification service.
+
+        Invalidations published while the notification backend
+        is disconnected are lost, so other processes may still
+        accept such tokens for up to ``token_cache_ttl`` seconds.
+        """
+        keys = [_get_cache_key(token) for token in tokens]
+        self._invalidate_cache_keys(keys)
+        if keys and self.notification_service is not None:
+            self.notification_service.notify(Notification(
+                topic=INVALIDATED_TOKENS_TOPIC,
+                subject_id=INVALIDATED_TOKENS_SUBJECT_ID,
+                data={'keys': keys},
+            ))
+
+    def _invalidate_cache_keys(self, keys: Iterable[str]):
+        for key in keys:
+            self._token_cache.pop(key, None)
+
     async def authenticate(self, token: str) -> Optional[User]:
+        """
+        Returns the user the token belongs to, if it is valid.
+
+        Signed tokens are verified without accessing the database.
+        Random tokens are cached, and their access times are saved
+        in batches by :meth:`flush_token_accesses`,
+        so that authentication usually does not touch the database.
+        """
+        if not token:
+            return None
+        if not isinstance(token, str):
+            return None
+
         now = datetime.now(tz=timezone.utc)
+        if self._signer is not None and TokenSigner.is_signed_token(token):
+            return await self._authenticate_signed(token, now)
+
+        cached = self._get_cached_token(token)
+        if cached is None:
+            repo = self.repository.access_token_repository
+            access_token: AccessToken = await repo.get(token)
+            if not access_token:
+                return None
+            cached = self._cache_token(access_token)
+            user = access_token.user_
+        elif cached.is_valid(now):
+            user = await self.repository.user_repository.attach(cached.create_user())
+        else:
+            # expired, so other processes do not accept it either
+            self._invalidate_cache_keys([_get_cache_key(token)])
+            return None
+
+        cached.access_expires_at = self._get_access_expires_at(now)
+        self._token_accesses[cached.token_id] = now
+        return user
+
+    async def _authenticate_signed(self, token: str, now: datetime) -> Optional[User]:
+        claims = self._signer.verify(token)
+        if claims is None or claims.expires_at <= now or \
+                claims.token_id in self._revoked_tokens:
+            return None
+
+        # the password is never needed by authorized endpoints
+        user = User(
+            id_=claims.user_id,
+            username_=claims.username,
+        )
+        make_transient_to_detached(user)
+        return await self.repository.user_repository.attach(user)
+
+    async def revoke_token(self, token: str) -> bool:
+        """
+        Revokes the token, so that it cannot be used anymore.
+
+        Returns:
+            whether the token was valid
+        """
         repo = self.repository.access_token_repository
-        access_token: AccessToken = await repo.get(token)
-        if access_token:
-            access_token.accessed_at_ = now
-            access_token.access_expires_at_ = now + timedelta(seconds=self.config.token_access_exp)
-            return access_token.user_
+        if self._signer is not None and TokenSigner.is_signed_token(token):
+            claims = self._signer.verify(token)
+            if claims is None or claims.expires_at <= datetime.now(tz=timezone.utc) or \
+                    claims.token_id in self._revoked_tokens:
+                return False
+            await repo.revoke(claims.token_id, claims.expires_at)
+            self._revoked_tokens[claims.token_id] = claims.expires_at
+            return True
+
+        removed = await repo.remove(token)
+        # other processes could load the token again before the removal is committed
+        await self.repository.synchronize_transaction_on_commit(
+            self._invalidate_tokens_on_commit([token]))
+        return removed
+
+    async def _invalidate_tokens_on_commit(self, tokens: Iterable[str]):
+        self.invalidate_tokens(tokens)
+
+    async def sync_revoked_tokens(self):
+        """
+        Loads signed tokens revoked by other processes.
+        """
+        if self._signer is None:
+            return
+
+        async with transaction_context(self.repository.database):
+            revoked = await self.repository.access_token_repository.get_revoked()
+        # tokens are never unrevoked, so only expired ones are forgotten
+        now = datetime.now(tz=timezone.utc)
+        for token_id, expires_at in self._revoked_tokens.items():
+            if expires_at > now:
+                revoked[token_id] = expires_at
+        self._revoked_tokens = revoked
+
+    async def flush_token_accesses(self) -> int:
+        """
+        Saves access times of tokens used since the last flush.
+
+        Returns:
+            the number of updated tokens
+        """
+        accesses, self._token_accesses = self._token_accesses, dict()
+        if not accesses:
+            return 0
+
+        try:
+            async with transaction_context(self.repository.database):
+                await self.repository.access_token_repository.update_accesses({
+                    token_id: (accessed_at, self._get_access_expires_at(accessed_at))
+                    for token_id, accessed_at in accesses.items()
+                })
+        except BaseException:
+            # keep the accesses for the next flush
+            for token_id, accessed_at in accesses.items():
+                self._token_accesses[token_id] = max(
+                    accessed_at, self._token_accesses.get(token_id, accessed_at))
+            raise
+        return len(accesses)
 
     def _get_token_created_later_than(self):
         if self.config.token_exp <= 0:
@@ -74,23 +340,75 @@ class Auth:
         return datetime.now(tz=timezone.utc) - access_exp_delta
 
     def __scrypt(self, password, salt):
-        return hashlib.scrypt(
-            password, salt=salt,
-            n=self.config.scrypt_n,
-            r=self.config.scrypt_r,
-            p=self.config.scrypt_p)
+        return _scrypt(
+            password, salt,
+            self.config.scrypt_n,
+            self.config.scrypt_r,
+            self.config.scrypt_p)
 
-    def hash_password(self, password: bytes) -> str:
-        salt = os.urandom(16)
-        hashed = self.__scrypt(password, salt)
+    def _get_hash_executor(self) -> Executor:
+        if self._hash_executor is None:
+            if self.config.hash_executor == 'process':
+                self._hash_executor = ProcessPoolExecutor(
+                    max_workers=self.config.hash_workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+            else:
+                # hashlib releases the GIL while hashing
+                self._hash_executor = ThreadPoolExecutor(
+                    max_workers=self.config.hash_workers,
+                    thread_name_prefix='password-hashing')
+        return self._hash_executor
+
+    async def __scrypt_async(self, password, salt):
+        stats = self.hashing_stats
+        stats.queue_depth += 1
+        stats.max_queue_depth = max(stats.max_queue_depth, stats.queue_depth)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_hash_executor(), _scrypt,
+                password, salt,
+                self.config.scrypt_n,
+                self.config.scrypt_r,
+                self.config.scrypt_p)
+        finally:
+            stats.queue_depth -= 1
+            stats.hashed_passwords += 1
 
+    @staticmethod
+    def _format_hash(salt: bytes, hashed: bytes) -> str:
         salt_b64 = base64.b64encode(salt).decode()
         hashed_b64 = base64.b64encode(hashed).decode()
 
         return f'{salt_b64}!{hashed_b64}'
 
-    def is_password_valid(self, password: bytes, hash_: str) -> bool:
+    @staticmethod
+    def _parse_hash(hash_: str) -> Tuple[bytes, bytes]:
         [salt_b64, hashed_b64] = hash_.split('!', 2)
-        salt = base64.b64decode(salt_b64)
-        hashed = base64.b64decode(hashed_b64)
+        return base64.b64decode(salt_b64), base64.b64decode(hashed_b64)
+
+    def hash_password(self, password: bytes) -> str:
+        salt = os.urandom(16)
+        return self._format_hash(salt, self.__scrypt(password, salt))
+
+    def is_password_valid(self, password: bytes, hash_: str) -> bool:
+        salt, hashed = self._parse_hash(hash_)
         return self.__scrypt(password, salt) == hashed
+
+    async def hash_password_async(self, password: bytes) -> str:
+        """
+        Same as :meth:`hash_password`, but does not block the event loop.
+        """
+        salt = os.urandom(16)
+        return self._format_hash(salt, await self.__scrypt_async(password, salt))
+
+    async def is_password_valid_async(self, password: bytes, hash_: str) -> bool:
+        """
+        Same as :meth:`is_password_valid`, but does not block the event loop.
+        """
+        salt, hashed = self._parse_hash(hash_)
+        return await self.__scrypt_async(password, salt) == hashed
+
+    def shutdown(self):
+        if self._hash_executor is not None:
+            self._hash_executor.shutdown(wait=False)
+            self._hash_executor = None
@@ -1,10 +1,13 @@
 import argparse
+import asyncio
 import logging.config
 import os.path
 
 from quadradiusr_server import config, logger
 from quadradiusr_server.config import ConfigGenerator, ServerConfig
+from quadradiusr_server.notification_relay import NotificationRelay
 from quadradiusr_server.server import QuadradiusRServer
+from quadradiusr_server.supervisor import WorkerSupervisor
 
 
 class ServerCli:
@@ -39,6 +42,18 @@ class ServerCli:
             action='append',
             help='set config values, e.g. --set server.database.create_metadata=true')
 
+        parser.add_argument(
+            '--workers',
+            type=int,
+            metavar='N',
+            help='run N server processes sharing the port')
+
+        parser.add_argument(
+            '--notification-relay',
+            metavar='SOCKET_PATH',
+            help='run only the notification relay for server processes '
+                 'configured with server.notification.backend=relay')
+
         parser.add_argument(
             '--embedded-mode',
             action='store_true',
@@ -55,6 +70,13 @@ class ServerCli:
             gen.generate(args.generate_config)
             return 0
 
+        if args.notification_relay:
+            try:
+                asyncio.run(NotificationRelay(args.notification_relay).run())
+            except KeyboardInterrupt:
+                logging.info('Interrupted')
+            return 0
+
         if args.config:
             if not os.path.isfile(args.config):
                 logging.error(f'Config file {args.config} not found')
@@ -82,5 +104,14 @@ class ServerCli:
         if args.embedded_mode:
             server_config.set('server.database.create_metadata', 'true')
 
+        if args.workers:
+            try:
+                supervisor = WorkerSupervisor(
+                    server_config, args.workers, verbosity=args.verbose)
+            except ValueError as e:
+                logging.error(e)
+                return 1
+            return supervisor.run()
+
         server = QuadradiusRServer(server_config)
         return server.run()
@@ -15,15 +15,37 @@ from quadradiusr_server.utils import import_class
 class AuthConfig:
     token_exp: int = 0
     token_access_exp: int = 7 * 24 * 60 * 60
+    # authenticated tokens are cached for this many seconds,
+    # after which they are looked up in the database again;
+    # revoked and purged tokens are removed from the caches of all processes
+    # through the notification backend, this bounds how long other processes
+    # may accept them when the notification does not arrive
+    token_cache_ttl: float = 60
+    # maximum number of cached tokens
+    token_cache_size: int = 4096
     scrypt_n: int = 16 * 1024
     scrypt_r: int = 8
     scrypt_p: int = 1
+    # where passwords are hashed: 'thread' or 'process' pool
+    hash_executor: str = 'thread'
+    # maximum number of passwords hashed at once,
+    # each one takes about 128 * scrypt_r * scrypt_n bytes of memory
+    hash_workers: int = 2
+    # format of issued tokens:
+    #   'random' -- stored in the database,
+    #   'signed' -- verified using token_secret, they do not slide
+    #      and expire token_access_exp seconds after they are issued
+    token_format: str = 'random'
+    # secret used to sign tokens, signed tokens are accepted only when it is set
+    token_secret: Optional[str] = None
 
 
 @dataclass
 class DatabaseConfig:
     url: str = 'sqlite+aiosqlite://'
     create_metadata: bool = False
+    # upgrade the schema of an existing database on startup
+    migrate: bool = True
     log_statements: bool = False
     log_connections: bool = False
     hide_parameters: bool = True
@@ -34,6 +56,49 @@ class DatabaseConfig:
 class CronConfig:
     purge_game_invites_delay: float = 60
     purge_tokens_delay: float = 60
+    # should be much shorter than auth.token_access_exp
+    flush_token_accesses_delay: float = 10
+    sync_revoked_tokens_delay: float = 5
+
+
+@dataclass
+class QrwsConfig:
+    # maximum number of messages waiting to be sent to a client
+    outbound_queue_size: int = 256
+    # what happens when the queue is full:
+    #   'drop_oldest' -- the oldest message is dropped,
+    #   'coalesce' -- a superseded message is replaced, otherwise the oldest one is dropped,
+    #   'disconnect' -- the client is disconnected
+    # a skipped game state diff is replaced by the current game state
+    outbound_queue_policy: str = 'disconnect'
+
+
+@dataclass
+class LobbyConfig:
+    # presence changes are batched for this many seconds
+    # for clients which opt in to coalesced presence
+    presence_window: float = 0.25
+
+
+@dataclass
+class NotificationConfig:
+    # 'local' (a single server process) or 'relay'
+    backend: str = 'local'
+    # path of the Unix socket of the notification relay
+    relay_path: Optional[str] = None
+
+
+@dataclass
+class ClusterConfig:
+    # hrefs of all workers which serve games and lobbies,
+    # including this one (server.href); empty for a single server
+    workers: List[str] = field(default_factory=list)
+    # href of this worker, server.href when not set
+    worker_href: Optional[str] = None
+    # additional port accepting connections routed to this worker
+    worker_port: Optional[int] = None
+    # setup and cron jobs run only on the primary worker
+    primary: bool = True
 
 
 @dataclass
@@ -48,6 +113,34 @@ class GameConfig:
     power_definition_classes: List[str] = field(default_factory=lambda: [
         'quadradiusr_server.powers.power_raise_tile.RaiseTilePowerDefinition',
     ])
+    # 'default' or 'compact' (array-backed tiles, lower memory usage)
+    board_backend: str = 'default'
+    # 'sync' -- the state is saved before an action is acknowledged,
+    # 'write_behind' -- actions are acknowledged once applied in memory,
+    #   the state is saved in the background at checkpoints
+    persistence: str = 'sync'
+    # with write-behind persistence, a checkpoint is made after this many actions,
+    checkpoint_actions: int = 16
+    # ...or this many milliseconds after the first unsaved action
+    checkpoint_interval_ms: int = 1000
+    # failed checkpoints are retried after checkpoint_interval_ms,
+    # doubled after each consecutive failure up to this many milliseconds
+    checkpoint_max_retry_interval_ms: int = 60 * 1000
+    # a snapshot of the whole state is saved every this many revisions,
+    # otherwise only the changes made by actions are saved
+    snapshot_interval: int = 32
+
+    @property
+    def compact_board(self) -> bool:
+        if self.board_backend not in ('default', 'compact'):
+            raise ValueError(f'Unknown board backend: {self.board_backend}')
+        return self.board_backend == 'compact'
+
+    @property
+    def write_behind(self) -> bool:
+        if self.persistence not in ('sync', 'write_behind'):
+            raise ValueError(f'Unknown persistence mode: {self.persistence}')
+        return self.persistence == 'write_behind'
 
     def get_power_randomizer(self) -> PowerRandomizer:
         if not hasattr(self, '_power_randomizer'):
@@ -80,8 +173,16 @@ class ServerConfig:
     database: DatabaseConfig = field(default_factory=DatabaseConfig)
     cron: CronConfig = field(default_factory=CronConfig)
     static: StaticServerConfig = field(default_factory=StaticServerConfig)
+    qrws: QrwsConfig = field(default_factory=QrwsConfig)
+    lobby: LobbyConfig = field(default_factory=LobbyConfig)
+    notification: NotificationConfig = field(default_factory=NotificationConfig)
+    cluster: ClusterConfig = field(default_factory=ClusterConfig)
     game: GameConfig = field(default_factory=GameConfig)
     embedded_mode: bool = False
+    # 'json' or 'orjson' (falls back to 'json' when not installed)
+    json_codec: str = 'json'
+    # 'asyncio' or 'uvloop' (falls back to 'asyncio' when not installed)
+    event_loop: str = 'asyncio'
 
     def set(self, option: str, value: str):
         option_parts = option.split('.')
@@ -20,8 +20,14 @@ class QrwsOpcode(IntEnum):
     APPLY_POWER = 13
 
 
+class QrwsEncoding:
+    JSON = 'json'
+    MSGPACK = 'msgpack'
+
+
 class QrwsCloseCode(IntEnum):
     OK = WSCloseCode.OK
     MALFORMED_MESSAGE = 4000
     UNAUTHORIZED = 4001
     CONFLICT = 4002
+    SLOW_CONSUMER = 4003
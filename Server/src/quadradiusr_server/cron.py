@@ -1,6 +1,9 @@
 import asyncio
 import logging
 
+from typing import List
+
+from quadradiusr_server.auth import Auth
 from quadradiusr_server.config import CronConfig
 from quadradiusr_server.db.base import Lobby
 from quadradiusr_server.db.repository import Repository
@@ -11,17 +14,33 @@ from quadradiusr_server.notification import NotificationService, Notification
 class Cron:
     def __init__(
             self, config: CronConfig, repository: Repository,
-            notification_service: NotificationService) -> None:
+            notification_service: NotificationService, auth: Auth) -> None:
         self.config = config
         self.repository = repository
         self.ns = notification_service
+        self.auth = auth
+        self._tasks: List[asyncio.Task] = []
 
-    async def register(self):
+    async def register(self, primary: bool = True):
+        """
+        Args:
+            primary: whether to register jobs which affect
+                the whole cluster, and not only this process
+        """
         logging.info('Registering cron jobs')
-        asyncio.create_task(self._cron_purge_game_invites())
-        asyncio.create_task(self._cron_purge_tokens())
+        self._tasks.append(asyncio.create_task(self._cron_flush_token_accesses()))
+        self._tasks.append(asyncio.create_task(self._cron_sync_revoked_tokens()))
+        if primary:
+            self._tasks.append(asyncio.create_task(self._cron_purge_game_invites()))
+            self._tasks.append(asyncio.create_task(self._cron_purge_tokens()))
         logging.info('Cron jobs registered')
 
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
     async def _cron_purge_game_invites(self):
         logging.debug('Purging game invites')
         while True:
@@ -52,11 +71,32 @@ class Cron:
             await self._purge_tokens()
 
     async def _purge_tokens(self):
+        # recent accesses extend expiration of tokens
+        await self.auth.flush_token_accesses()
         async with transaction_context(self.repository.database):
             at_repo = self.repository.access_token_repository
-            await at_repo.remove_old_tokens()
+            removed = await at_repo.remove_old_tokens()
+        self.auth.invalidate_tokens(removed)
         logging.debug('Tokens purged')
 
+    async def _cron_flush_token_accesses(self):
+        logging.debug('Flushing token accesses')
+        while True:
+            await asyncio.sleep(self.config.flush_token_accesses_delay)
+            try:
+                await self.auth.flush_token_accesses()
+            except Exception:
+                logging.exception('Failed to flush token accesses')
+
+    async def _cron_sync_revoked_tokens(self):
+        logging.debug('Synchronizing revoked tokens')
+        while True:
+            await asyncio.sleep(self.config.sync_revoked_tokens_delay)
+            try:
+                await self.auth.sync_revoked_tokens()
+            except Exception:
+                logging.exception('Failed to synchronize revoked tokens')
+
 
 class SetupService:
     def __init__(
@@ -1,10 +1,10 @@
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Optional, Dict, Tuple, List
 
-from sqlalchemy import select, and_, or_, delete
+from sqlalchemy import select, and_, or_, delete, update, bindparam
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from quadradiusr_server.db.base import User, AccessToken
+from quadradiusr_server.db.base import User, AccessToken, RevokedToken
 from quadradiusr_server.db.database_engine import DatabaseEngine
 from quadradiusr_server.db.transactions import transactional
 
@@ -32,12 +32,78 @@ class AccessTokenRepository:
             )))
         return result.scalar_one_or_none()
 
+    @transactional
+    async def update_accesses(
+            self, accesses: Dict[str, Tuple[datetime, datetime]],
+            *, db_session: AsyncSession):
+        """
+        Updates access times of many tokens in a single statement.
+
+        Args:
+            accesses: maps token IDs to pairs of
+                ``(accessed_at, access_expires_at)``
+        """
+        table = AccessToken.__table__
+        await db_session.execute(
+            update(table)
+            .where(table.c.id_ == bindparam('token_id'))
+            .values(
+                accessed_at_=bindparam('accessed_at'),
+                access_expires_at_=bindparam('access_expires_at')),
+            [{
+                'token_id': token_id,
+                'accessed_at': accessed_at,
+                'access_expires_at': access_expires_at,
+            } for token_id, (accessed_at, access_expires_at) in accesses.items()])
+
     @transactional
     async def remove_old_tokens(
-            self, *, db_session: AsyncSession):
+            self, *, db_session: AsyncSession) -> List[str]:
+        """
+        Returns:
+            the removed tokens
+        """
         now = datetime.now(tz=timezone.utc)
+        condition = or_(
+            AccessToken.expires_at_ <= now,
+            AccessToken.access_expires_at_ <= now,
+        )
+        result = await db_session.execute(
+            select(AccessToken.token_).where(condition))
+        tokens = list(result.scalars())
+        await db_session.execute(delete(AccessToken).where(condition))
         await db_session.execute(
-            delete(AccessToken).where(or_(
-                AccessToken.expires_at_ <= now,
-                AccessToken.access_expires_at_ <= now,
-                )))
+            delete(RevokedToken).where(RevokedToken.expires_at_ <= now))
+        return tokens
+
+    @transactional
+    async def remove(
+            self, token: str,
+            *, db_session: AsyncSession) -> bool:
+        result = await db_session.execute(
+            delete(AccessToken).where(AccessToken.token_ == token))
+        return result.rowcount > 0
+
+    @transactional
+    async def revoke(
+            self, token_id: str, expires_at: datetime,
+            *, db_session: AsyncSession):
+        if await db_session.get(RevokedToken, token_id) is None:
+            db_session.add(RevokedToken(
+                id_=token_id,
+                expires_at_=expires_at,
+            ))
+
+    @transactional
+    async def get_revoked(
+            self, *, db_session: AsyncSession) -> Dict[str, datetime]:
+        """
+        Returns:
+            IDs of revoked tokens, which have not expired yet,
+            mapped to their expiration
+        """
+        now = datetime.now(tz=timezone.utc)
+        result = await db_session.execute(
+            select(RevokedToken.id_, RevokedToken.expires_at_)
+            .where(RevokedToken.expires_at_ > now))
+        return {row.id_: row.expires_at_ for row in result}
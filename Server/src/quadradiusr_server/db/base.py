@@ -1,8 +1,14 @@
+import pickle
 from datetime import datetime, timezone
 
-from sqlalchemy import Column, ForeignKey, DateTime, String, PickleType, TypeDecorator, Integer
+from sqlalchemy import Column, ForeignKey, DateTime, String, TypeDecorator, Integer, LargeBinary, \
+    Index
 from sqlalchemy.orm import declarative_base, relationship, class_mapper
 
+from quadradiusr_server.game_state import GameState
+from quadradiusr_server.game_state_codec import encode_game_state, decode_game_state, \
+    is_encoded_game_state
+
 Base = declarative_base()
 
 
@@ -37,6 +43,31 @@ class DateTimeUTC(TypeDecorator):
         return value.astimezone(timezone.utc)
 
 
+# noinspection PyAbstractClass
+class GameStateType(TypeDecorator):
+    """
+    Stores game states in the format of :mod:`quadradiusr_server.game_state_codec`.
+
+    States stored by older versions of the server are pickled,
+    they are converted by a migration, but still loaded for
+    databases which have not been migrated yet.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value: GameState, dialect):
+        if value is None:
+            return None
+        return encode_game_state(value)
+
+    def process_result_value(self, value: bytes, dialect):
+        if value is None:
+            return None
+        if is_encoded_game_state(value):
+            return decode_game_state(value)
+        return pickle.loads(value)
+
+
 class User(Base):
     __tablename__ = 'user'
     id_ = Column(String, nullable=False, primary_key=True)
@@ -60,7 +91,7 @@ class GameInvite(Base):
     id_ = Column(String, nullable=False, primary_key=True)
     from_id_ = Column(String, ForeignKey('user.id_'), nullable=False)
     subject_id_ = Column(String, ForeignKey('user.id_'), nullable=False)
-    expires_at_ = Column(DateTimeUTC, nullable=False)
+    expires_at_ = Column(DateTimeUTC, nullable=False, index=True)
 
     from_ = relationship(
         'User',
@@ -94,11 +125,13 @@ class GameInvite(Base):
 class Game(Base):
     __tablename__ = 'game'
     id_ = Column(String, nullable=False, primary_key=True)
+    # revision of the snapshot stored in game_state_,
+    # later revisions are stored as moves (see GameMove)
     rev_ = Column(Integer, nullable=False)
-    player_a_id_ = Column(String, ForeignKey('user.id_'), nullable=False)
-    player_b_id_ = Column(String, ForeignKey('user.id_'), nullable=False)
+    player_a_id_ = Column(String, ForeignKey('user.id_'), nullable=False, index=True)
+    player_b_id_ = Column(String, ForeignKey('user.id_'), nullable=False, index=True)
     expires_at_ = Column(DateTimeUTC, nullable=False)
-    game_state_ = Column(PickleType, nullable=False)
+    game_state_ = Column(GameStateType, nullable=False)
 
     player_a_ = relationship(
         'User',
@@ -129,6 +162,40 @@ class Game(Base):
             f')'
 
 
+class GameMove(Base):
+    """
+    An action made in a game, together with the changes
+    it has made to the game state.
+
+    Applying the changes of the moves following a snapshot
+    of the game state yields the current state.
+    """
+    __tablename__ = 'game_move'
+    game_id_ = Column(
+        String, ForeignKey('game.id_', ondelete='CASCADE'),
+        nullable=False, primary_key=True)
+    # revision of the game after the action
+    rev_ = Column(Integer, nullable=False, primary_key=True)
+    player_id_ = Column(String, ForeignKey('user.id_'), nullable=False)
+    # 'move' or 'apply_power'
+    action_ = Column(String, nullable=False)
+    piece_id_ = Column(String, nullable=True)
+    tile_id_ = Column(String, nullable=True)
+    power_id_ = Column(String, nullable=True)
+    # journal changes encoded by game_state_codec.encode_changes
+    changes_ = Column(LargeBinary, nullable=False)
+    made_at_ = Column(DateTimeUTC, nullable=False)
+
+    def __repr__(self):
+        return \
+            f'{type(self).__name__}(' \
+            f'game_id_={self.game_id_!r}, ' \
+            f'rev_={self.rev_!r}, ' \
+            f'player_id_={self.player_id_!r}, ' \
+            f'action_={self.action_!r}' \
+            f')'
+
+
 class Lobby(Base):
     __tablename__ = 'lobby'
     id_ = Column(String, nullable=False, primary_key=True)
@@ -161,6 +228,10 @@ class LobbyMessage(Base):
         cascade='expunge',
         foreign_keys=[lobby_id_])
 
+    __table_args__ = (
+        Index('ix_lobby_message_lobby_id_created_at', lobby_id_, created_at_),
+    )
+
     def __repr__(self):
         return \
             f'{type(self).__name__}(' \
@@ -176,11 +247,11 @@ class AccessToken(Base):
     __tablename__ = 'access_token'
     id_ = Column(String, nullable=False, primary_key=True)
     user_id_ = Column(String, ForeignKey('user.id_'), nullable=False)
-    token_ = Column(String, nullable=False)
+    token_ = Column(String, nullable=False, index=True)
     created_at_ = Column(DateTimeUTC, nullable=False)
     accessed_at_ = Column(DateTimeUTC, nullable=False)
-    expires_at_ = Column(DateTimeUTC, nullable=False)
-    access_expires_at_ = Column(DateTimeUTC, nullable=False)
+    expires_at_ = Column(DateTimeUTC, nullable=False, index=True)
+    access_expires_at_ = Column(DateTimeUTC, nullable=False, index=True)
 
     user_ = relationship(
         'User',
@@ -199,3 +270,19 @@ class AccessToken(Base):
             f'expires_at_={self.expires_at_!r}, ' \
             f'access_expires_at_={self.access_expires_at_!r}' \
             f')'
+
+
+class RevokedToken(Base):
+    """
+    Signed tokens, which were revoked before they expired.
+    """
+    __tablename__ = 'revoked_token'
+    id_ = Column(String, nullable=False, primary_key=True)
+    expires_at_ = Column(DateTimeUTC, nullable=False, index=True)
+
+    def __repr__(self):
+        return \
+            f'{type(self).__name__}(' \
+            f'id_={self.id_!r}, ' \
+            f'expires_at_={self.expires_at_!r}' \
+            f')'
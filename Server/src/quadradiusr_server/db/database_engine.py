@@ -19,9 +19,16 @@ class DatabaseEngine:
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
 
+    async def migrate(self) -> int:
+        from quadradiusr_server.db.migrations import migrate
+        async with self.engine.begin() as conn:
+            return await conn.run_sync(migrate)
+
     async def initialize(self):
         if self.config.create_metadata:
             await self.create_metadata()
+        if self.config.migrate:
+            await self.migrate()
 
     async def dispose(self):
         await self.engine.dispose()
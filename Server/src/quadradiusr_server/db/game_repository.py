@@ -1,10 +1,36 @@
-from typing import Optional
+from dataclasses import dataclass
+from typing import Optional, List
 
+from sqlalchemy import select, update, insert, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
+from sqlalchemy.orm.exc import StaleDataError
 
-from quadradiusr_server.db.base import Game
+from quadradiusr_server.db.base import Game, GameMove
 from quadradiusr_server.db.database_engine import DatabaseEngine
 from quadradiusr_server.db.transactions import transactional
+from quadradiusr_server.game_state import GameState
+from quadradiusr_server.game_state_codec import decode_changes
+
+
+@dataclass
+class StoredGameState:
+    game_state: GameState
+    # the current revision
+    rev: int
+    # the revision of the snapshot the state has been replayed from
+    snapshot_rev: int
+
+
+@dataclass
+class GamePlayers:
+    game_id: str
+    player_a_id: str
+    player_b_id: str
+
+    def is_player(self, user_id: str) -> bool:
+        return user_id in (self.player_a_id, self.player_b_id)
 
 
 class GameRepository:
@@ -17,6 +43,36 @@ class GameRepository:
             *, db_session: AsyncSession) -> Optional[Game]:
         return await db_session.get(Game, id_)
 
+    @transactional
+    async def get_players(
+            self, id_: str,
+            *, db_session: AsyncSession) -> Optional[GamePlayers]:
+        """
+        Loads only IDs of the players, which is enough to authorize them.
+        """
+        result = await db_session.execute(
+            select(Game.player_a_id_, Game.player_b_id_).where(Game.id_ == id_))
+        row = result.one_or_none()
+        if row is None:
+            return None
+        return GamePlayers(
+            game_id=id_,
+            player_a_id=row.player_a_id_,
+            player_b_id=row.player_b_id_,
+        )
+
+    @transactional
+    async def get_metadata(
+            self, id_: str,
+            *, db_session: AsyncSession) -> Optional[Game]:
+        """
+        Loads the game with its players, but without its state,
+        which must not be accessed on the returned game.
+        """
+        result = await db_session.execute(
+            select(Game).options(defer(Game.game_state_)).where(Game.id_ == id_))
+        return result.unique().scalar_one_or_none()
+
     @transactional
     async def add(
             self, game: Game,
@@ -28,3 +84,105 @@ class GameRepository:
             self, game: Game,
             *, db_session: AsyncSession):
         await db_session.merge(game)
+
+    @transactional
+    async def get_state(
+            self, id_: str,
+            *, db_session: AsyncSession) -> Optional[StoredGameState]:
+        """
+        Loads only the game state and its revision,
+        without attaching the game to the session.
+
+        The state is the latest snapshot with the changes
+        of subsequent moves applied.
+        """
+        result = await db_session.execute(
+            select(Game.game_state_, Game.rev_).where(Game.id_ == id_))
+        row = result.one_or_none()
+        if row is None:
+            return None
+
+        game_state: GameState = row.game_state_
+        rev = row.rev_
+        moves = await db_session.execute(
+            select(GameMove.rev_, GameMove.changes_)
+            .where((GameMove.game_id_ == id_) & (GameMove.rev_ > rev))
+            .order_by(GameMove.rev_))
+        for move in moves:
+            if move.rev_ != rev + 1:
+                raise ValueError(f'Game {id_} is missing revision {rev + 1}')
+            for change in decode_changes(move.changes_):
+                change.apply(game_state)
+            rev = move.rev_
+        return StoredGameState(game_state, rev, row.rev_)
+
+    @transactional
+    async def get_rev(
+            self, id_: str,
+            *, db_session: AsyncSession) -> Optional[int]:
+        """
+        The current revision of the game, without loading its state.
+        """
+        last_move_rev = select(func.max(GameMove.rev_)) \
+            .where(GameMove.game_id_ == id_) \
+            .scalar_subquery()
+        result = await db_session.execute(
+            select(func.coalesce(last_move_rev, Game.rev_)).where(Game.id_ == id_))
+        return result.scalar_one_or_none()
+
+    @transactional
+    async def add_moves(
+            self, moves: List[GameMove],
+            *, db_session: AsyncSession):
+        """
+        Stores moves made after the current revision.
+
+        :raises StaleDataError: when a move with the same revision is already stored
+        """
+        columns = [column.key for column in GameMove.__table__.columns]
+        try:
+            await db_session.execute(
+                insert(GameMove),
+                [{c: getattr(move, c) for c in columns} for move in moves])
+        except IntegrityError as e:
+            # a conflict of the primary key, as opposed to e.g. a missing value,
+            # means that the moves have already been stored by someone else
+            result = await db_session.execute(
+                select(func.count())
+                .select_from(GameMove)
+                .where(GameMove.game_id_ == moves[0].game_id_)
+                .where(GameMove.rev_.in_([move.rev_ for move in moves])))
+            if not result.scalar_one():
+                raise
+            raise StaleDataError(
+                f'Game {moves[0].game_id_} is past revision {moves[0].rev_ - 1}') from e
+
+    @transactional
+    async def get_moves(
+            self, id_: str,
+            *, db_session: AsyncSession) -> List[GameMove]:
+        result = await db_session.execute(
+            select(GameMove)
+            .where(GameMove.game_id_ == id_)
+            .order_by(GameMove.rev_))
+        return list(result.scalars())
+
+    @transactional
+    async def save_state(
+            self, id_: str, game_state: GameState,
+            *, expected_rev: int, rev: int,
+            db_session: AsyncSession):
+        """
+        Stores a snapshot of the game state with the given revision,
+        provided the revision of the stored snapshot is still ``expected_rev``.
+
+        :raises StaleDataError: when the stored revision differs
+        """
+        result = await db_session.execute(
+            update(Game)
+            .where((Game.id_ == id_) & (Game.rev_ == expected_rev))
+            .values(game_state_=game_state, rev_=rev)
+            .execution_options(synchronize_session=False))
+        if result.rowcount != 1:
+            raise StaleDataError(
+                f'Game {id_} is not at revision {expected_rev}')
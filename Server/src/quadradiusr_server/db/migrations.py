@@ -0,0 +1,160 @@
+"""
+Versioned migrations of the database schema.
+
+The version of the schema is stored in the ``schema_version`` table,
+databases which do not have it yet are at version 0,
+i.e. the schema of the first release.
+
+Migrations must not fail when the changes they make already exist,
+because databases created using ``create_metadata``
+have the latest schema from the start.
+"""
+import logging
+import pickle
+from dataclasses import dataclass
+from typing import Callable, List
+
+from sqlalchemy import Table, MetaData, Column, Integer, select, func, delete, insert, inspect, \
+    update, type_coerce, LargeBinary
+from sqlalchemy.engine import Connection
+
+from quadradiusr_server.db.base import Base
+from quadradiusr_server.game_state_codec import MAGIC, CHANGES_MAGIC, encode_changes
+
+_schema_version = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, nullable=False),
+)
+
+
+class MigrationError(Exception):
+    pass
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def _create_tables(*names: str) -> Callable[[Connection], None]:
+    def upgrade(conn: Connection):
+        Base.metadata.create_all(
+            conn, tables=[Base.metadata.tables[name] for name in names],
+            checkfirst=True)
+
+    return upgrade
+
+
+def _create_indexes(*names: str) -> Callable[[Connection], None]:
+    def upgrade(conn: Connection):
+        indexes = {
+            index.name: index
+            for table in Base.metadata.tables.values()
+            for index in table.indexes
+        }
+        for name in names:
+            indexes[name].create(conn, checkfirst=True)
+
+    return upgrade
+
+
+def _convert_legacy_game_data(conn: Connection):
+    """
+    Converts pickled game states and changes of moves
+    to the format of :mod:`quadradiusr_server.game_state_codec`.
+    """
+    games = Base.metadata.tables['game']
+    raw_state = type_coerce(games.c.game_state_, LargeBinary)
+    legacy_games = conn.execute(
+        select(games.c.id_, games.c.game_state_)
+        .where(func.substr(raw_state, 1, len(MAGIC)) != MAGIC)).all()
+    for game in legacy_games:
+        conn.execute(
+            update(games)
+            .where(games.c.id_ == game.id_)
+            .values(game_state_=game.game_state_))
+
+    moves = Base.metadata.tables['game_move']
+    legacy_moves = conn.execute(
+        select(moves.c.game_id_, moves.c.rev_, moves.c.changes_)
+        .where(func.substr(moves.c.changes_, 1, len(CHANGES_MAGIC)) != CHANGES_MAGIC)).all()
+    for move in legacy_moves:
+        conn.execute(
+            update(moves)
+            .where((moves.c.game_id_ == move.game_id_) & (moves.c.rev_ == move.rev_))
+            .values(changes_=encode_changes(pickle.loads(move.changes_))))
+
+    if legacy_games or legacy_moves:
+        logging.info(
+            f'Converted {len(legacy_games)} legacy game states '
+            f'and {len(legacy_moves)} legacy moves')
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(
+        version=1,
+        description='Create tables for game moves and revoked tokens',
+        upgrade=_create_tables('game_move', 'revoked_token'),
+    ),
+    Migration(
+        version=2,
+        description='Create indexes',
+        upgrade=_create_indexes(
+            'ix_access_token_token_',
+            'ix_access_token_expires_at_',
+            'ix_access_token_access_expires_at_',
+            'ix_revoked_token_expires_at_',
+            'ix_game_player_a_id_',
+            'ix_game_player_b_id_',
+            'ix_game_invite_expires_at_',
+            'ix_lobby_message_lobby_id_created_at',
+        ),
+    ),
+    Migration(
+        version=3,
+        description='Convert pickled game states and moves',
+        upgrade=_convert_legacy_game_data,
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def get_schema_version(conn: Connection) -> int:
+    if not inspect(conn).has_table(_schema_version.name):
+        return 0
+    return conn.execute(select(func.max(_schema_version.c.version))).scalar() or 0
+
+
+def _set_schema_version(conn: Connection, version: int):
+    _schema_version.create(conn, checkfirst=True)
+    conn.execute(delete(_schema_version))
+    conn.execute(insert(_schema_version).values(version=version))
+
+
+def migrate(conn: Connection) -> int:
+    """
+    Upgrades the schema to the latest version.
+
+    Returns:
+        the number of applied migrations
+
+    Raises:
+        MigrationError: when the schema is newer than the latest known version
+    """
+    version = get_schema_version(conn)
+    if version > LATEST_VERSION:
+        raise MigrationError(
+            f'Database schema version {version} is newer '
+            f'than the supported version {LATEST_VERSION}')
+
+    pending = [migration for migration in MIGRATIONS if migration.version > version]
+    for migration in pending:
+        logging.info(
+            f'Migrating database to version {migration.version}: '
+            f'{migration.description}')
+        migration.upgrade(conn)
+        _set_schema_version(conn, migration.version)
+    return len(pending)
@@ -7,7 +7,8 @@ from quadradiusr_server.db.database_engine import DatabaseEngine
 from quadradiusr_server.db.game_invite_repository import GameInviteRepository
 from quadradiusr_server.db.game_repository import GameRepository
 from quadradiusr_server.db.lobby_repository import LobbyRepository
-from quadradiusr_server.db.transactions import transactional, synchronize_transaction_on_commit
+from quadradiusr_server.db.transactions import transactional, synchronize_transaction_on_commit, \
+    synchronize_transaction_on_rollback
 from quadradiusr_server.db.user_repository import UserRepository
 
 
@@ -63,3 +64,9 @@ class Repository:
             self, sync: Coroutine[Any, Any, Any],
             *, db_session: AsyncSession):
         synchronize_transaction_on_commit(db_session, sync)
+
+    @transactional
+    async def synchronize_transaction_on_rollback(
+            self, sync: Coroutine[Any, Any, Any],
+            *, db_session: AsyncSession):
+        synchronize_transaction_on_rollback(db_session, sync)
@@ -1,6 +1,6 @@
 import inspect
 from contextvars import ContextVar
-from typing import Optional, Union, Callable, Coroutine, Any
+from typing import Optional, Union, Callable, Coroutine, Any, List
 
 from aiohttp import web
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -77,6 +77,7 @@ def transaction_context(
 
             self.session = (database() if callable(database) else database).session()
             self.session.synchronizations_on_commit = []
+            self.session.synchronizations_on_rollback = []
             self.new_tx = True
             await self.session.__aenter__()
             self.token = _session_context.set(self.session)
@@ -85,21 +86,48 @@ def transaction_context(
         async def __aexit__(self, exc_type, exc_val, exc_tb):
             if not self.new_tx:
                 return
-            if exc_type is None:
-                await self.session.commit()
-                syncs = self.session.synchronizations_on_commit
-                del self.session.synchronizations_on_commit
-                for sync in syncs:
-                    await sync
-            else:
-                await self.session.rollback()
-            _session_context.reset(self.token)
-            await self.session.__aexit__(exc_type, exc_val, exc_tb)
+            syncs = self.session.synchronizations_on_commit
+            rollback_syncs = self.session.synchronizations_on_rollback
+            del self.session.synchronizations_on_commit
+            del self.session.synchronizations_on_rollback
+            try:
+                if exc_type is None:
+                    try:
+                        await self.session.commit()
+                    except BaseException:
+                        await _run_synchronizations(rollback_syncs, syncs)
+                        raise
+                    await _run_synchronizations(syncs, rollback_syncs)
+                else:
+                    await self.session.rollback()
+                    await _run_synchronizations(rollback_syncs, syncs)
+            finally:
+                _session_context.reset(self.token)
+                await self.session.__aexit__(exc_type, exc_val, exc_tb)
 
     return TxContext()
 
 
+async def _run_synchronizations(
+        syncs: List[Coroutine[Any, Any, Any]],
+        skipped: List[Coroutine[Any, Any, Any]]):
+    for sync in skipped:
+        sync.close()
+    for sync in syncs:
+        await sync
+
+
 def synchronize_transaction_on_commit(
         db_session: AsyncSession,
         sync: Coroutine[Any, Any, Any]):
     db_session.synchronizations_on_commit.append(sync)
+
+
+def synchronize_transaction_on_rollback(
+        db_session: AsyncSession,
+        sync: Coroutine[Any, Any, Any]):
+    """
+    Runs the coroutine when the transaction is rolled back,
+    or when committing it fails.
+    """
+    db_session.synchronizations_on_rollback.append(sync)
@@ -41,3 +41,12 @@ class UserRepository:
             select(User).where(User.id_.in_(ids)))
         users = result.all()
         return [user.User for user in users]
+
+    @transactional
+    async def attach(
+            self, user: User,
+            *, db_session: AsyncSession) -> User:
+        """
+        Attaches a detached user to the current session without loading it.
+        """
+        return await db_session.merge(user, load=False)
@@ -1,15 +1,23 @@
 import asyncio
-import copy
+import contextvars
 import logging
-from dataclasses import dataclass
-from typing import Dict, Optional
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple, Set, List, Hashable
+
+from sqlalchemy.orm.exc import StaleDataError
 
 from quadradiusr_server.config import GameConfig
 from quadradiusr_server.constants import QrwsCloseCode
-from quadradiusr_server.db.base import Game
+from quadradiusr_server.db.base import GameMove
 from quadradiusr_server.db.base import User
+from quadradiusr_server.db.game_repository import GamePlayers
 from quadradiusr_server.db.repository import Repository
-from quadradiusr_server.game_state import GameState, Piece, Tile, GameBoard
+from quadradiusr_server.db.transactions import transaction_context
+from quadradiusr_server.game_journal import ActionJournal
+from quadradiusr_server.game_state import GameState, Piece, Tile, game_state_etag
+from quadradiusr_server.game_state_codec import encode_changes
+from quadradiusr_server.json_codec import get_codec
 from quadradiusr_server.notification import NotificationService
 from quadradiusr_server.powers import PowerDefinition, PowerRandomizer
 from quadradiusr_server.qrws_connection import BasicConnection, QrwsConnection
@@ -21,56 +29,340 @@ from quadradiusr_server.qrws_messages import Message, KickMessage, GameStateMess
 class ActionResult:
     is_legal: bool
     reason: Optional[str] = None
-    old_game_state: Optional[GameState] = None
-    new_game_state: Optional[GameState] = None
+    journal: Optional[ActionJournal] = None
+    # player ID -> (diff, etag from, etag to)
+    diffs: Dict[str, Tuple[dict, str, str]] = field(default_factory=dict)
+
+
+@dataclass
+class SerializedGameState:
+    """
+    A game state serialized for a single recipient at a given revision.
+    """
+    game_id: str
+    rev: int
+    etag: str
+    game_state: dict
+    _json: Optional[bytes] = field(default=None, repr=False, compare=False)
+
+    def to_json(self) -> bytes:
+        """
+        The encoded body of the game state response, computed once.
+        """
+        if self._json is None:
+            self._json = get_codec().dumps_bytes({
+                'game_id': self.game_id,
+                **self.game_state,
+            })
+        return self._json
 
 
 class ActionApplicationContext:
-    def __init__(self, game: Game) -> None:
-        self._game = game
-        self._old_game_state = copy.deepcopy(self._game.game_state_)
+    """
+    Context of an action being applied to the live game state.
 
-        # we need to make sure sqlalchemy will see the change
-        game_state: GameState = copy.deepcopy(self._game.game_state_)
-        self._game.game_state_ = game_state
-        self._new_game_state = game_state
+    Changes are applied in place and recorded in a journal,
+    which is used to revert them when the action fails,
+    and to observe the state from before the action.
+    Rejected actions do not copy anything.
+    """
 
-    @property
-    def old_game_state(self):
-        return self._old_game_state
+    def __init__(self, game_state: GameState) -> None:
+        self._game_state = game_state
+        self._journal = ActionJournal()
 
     @property
-    def new_game_state(self):
-        return self._new_game_state
+    def game_state(self) -> GameState:
+        return self._game_state
 
     @property
-    def game_state(self):
-        return self.new_game_state
+    def journal(self) -> ActionJournal:
+        return self._journal
+
+    def __enter__(self):
+        self._journaled = self._game_state.journaled(self._journal)
+        self._journaled.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._journaled.__exit__(exc_type, exc_val, exc_tb)
+        if exc_type is not None:
+            self.revert()
+
+    def revert(self):
+        self._journal.revert(self._game_state)
 
     def legal_result(self):
         return ActionResult(
             is_legal=True,
-            old_game_state=self.old_game_state,
-            new_game_state=self.game_state,
+            journal=self.journal,
         )
 
 
 class GameInProgress:
-    def __init__(self, game: Game, repository: Repository, config: GameConfig) -> None:
+    """
+    A game which is being played.
+
+    While the game is in progress, its state is held in memory
+    and serves as the source of truth. The database is only used
+    to persist the state, and to load it when the first player connects.
+
+    Actions are persisted as moves, together with the changes they have made.
+    Every few revisions, a snapshot of the whole state is persisted too.
+    Moves are persisted after each action, or with write-behind
+    persistence, at checkpoints made every few actions or milliseconds,
+    and when all players disconnect.
+    """
+
+    def __init__(
+            self, players: GamePlayers,
+            repository: Repository, config: GameConfig) -> None:
         self.config = config
-        self.game_id = game.id_
+        self.game_id = players.game_id
         self.repository = repository
 
+        self._game_state: Optional[GameState] = None
+        self._rev: Optional[int] = None
+        # the revision stored in the database
+        self._saved_rev: Optional[int] = None
+        # the revision of the last snapshot stored in the database
+        self._snapshot_rev: Optional[int] = None
+        self._unsaved_moves: List[GameMove] = []
+        self._lock = asyncio.Lock()
+        self._checkpoint_handle: Optional[asyncio.TimerHandle] = None
+        # consecutive failed checkpoints
+        self._checkpoint_failures = 0
+        self._checkpoint_tasks: Set[asyncio.Task] = set()
+        # recipient ID -> the state serialized for them at the current revision
+        self._serialized: Dict[str, SerializedGameState] = {}
+
         self.player_connections: Dict[str, Optional[GameConnection]] = {
-            game.player_a_id_: None,
-            game.player_b_id_: None,
+            players.player_a_id: None,
+            players.player_b_id: None,
         }
 
         self.power_randomizer: PowerRandomizer = config.get_power_randomizer()
         self.power_definitions: Dict[str, PowerDefinition] = config.get_power_definitions()
 
-    async def get_game(self) -> Game:
-        return await self.repository.game_repository.get_by_id(self.game_id)
+    @property
+    def game_state(self) -> Optional[GameState]:
+        """
+        The game state held in memory, ``None`` if it is not loaded.
+        """
+        return self._game_state
+
+    @property
+    def rev(self) -> Optional[int]:
+        return self._rev
+
+    async def get_game_state(self) -> GameState:
+        async with self._lock:
+            return await self._get_game_state()
+
+    async def _get_game_state(self) -> GameState:
+        if self._game_state is None:
+            stored = await self.repository.game_repository.get_state(self.game_id)
+            if stored is None:
+                raise ValueError(f'Game {self.game_id} does not exist')
+            self._game_state = stored.game_state
+            self._rev = stored.rev
+            self._saved_rev = stored.rev
+            self._snapshot_rev = stored.snapshot_rev
+        return self._game_state
+
+    def _unload_game_state(self):
+        self._cancel_checkpoint()
+        self._game_state = None
+        self._rev = None
+        self._saved_rev = None
+        self._snapshot_rev = None
+        self._unsaved_moves.clear()
+        self._serialized.clear()
+        self._checkpoint_failures = 0
+
+    @property
+    def has_unsaved_changes(self) -> bool:
+        return self._rev != self._saved_rev
+
+    async def get_serialized_state_for(self, user_id: str) -> SerializedGameState:
+        """
+        The game state serialized for the given user.
+
+        Serialized states are cached until the next action is committed,
+        so that reconnecting and polling players do not serialize it again.
+        """
+        async with self._lock:
+            game_state = await self._get_game_state()
+            serialized = self._serialized.get(user_id)
+            if serialized is None or serialized.rev != self._rev:
+                serialized = SerializedGameState(
+                    game_id=self.game_id,
+                    rev=self._rev,
+                    etag=self.etag_for(user_id),
+                    game_state=game_state.serialize_for(user_id),
+                )
+                self._serialized[user_id] = serialized
+            return serialized
+
+    async def _commit(self, ctx: ActionApplicationContext, move: GameMove) -> ActionResult:
+        game_state = ctx.game_state
+        move.game_id_ = self.game_id
+        move.rev_ = self._rev + 1
+        # encoded right away, as the recorded objects may change later
+        move.changes_ = encode_changes(ctx.journal.changes)
+        move.made_at_ = datetime.now(timezone.utc)
+        if self.config.write_behind:
+            self._rev += 1
+            self._unsaved_moves.append(move)
+            self._schedule_checkpoint()
+        else:
+            try:
+                snapshot_rev = await self._save([move], move.rev_)
+            except StaleDataError:
+                # someone else has modified the game, reload it next time
+                self._unload_game_state()
+                raise
+            except Exception:
+                ctx.revert()
+                raise
+
+            self._rev += 1
+            self._snapshot_rev = snapshot_rev
+            # the move is saved by the transaction of the action
+            await self.repository.synchronize_transaction_on_commit(
+                self._on_saved(self._rev))
+            await self.repository.synchronize_transaction_on_rollback(
+                self._on_not_saved(self._rev))
+
+        self._serialized.clear()
+        result = ctx.legal_result()
+        # diffs are prepared eagerly, as the state may change before they are sent
+        for player_id in self.player_connections.keys():
+            result.diffs[player_id] = (
+                game_state.serialize_diff_for(result.journal, player_id),
+                self.etag_for(player_id, self._rev - 1),
+                self.etag_for(player_id, self._rev),
+            )
+        return result
+
+    async def _on_saved(self, rev: int):
+        if self._saved_rev is not None and rev > self._saved_rev:
+            self._saved_rev = rev
+
+    async def _on_not_saved(self, rev: int):
+        async with self._lock:
+            if self._saved_rev is not None and rev > self._saved_rev:
+                logging.error(
+                    f'Failed to save revision {rev} of game {self.game_id}, '
+                    f'reloading the game')
+                self._unload_game_state()
+
+    def _schedule_checkpoint(self):
+        if self._checkpoint_failures:
+            # a retry is scheduled, or a checkpoint is in progress
+            return
+        if self._rev - self._saved_rev >= self.config.checkpoint_actions:
+            self._cancel_checkpoint()
+            delay = 0
+        elif self._checkpoint_handle is None:
+            delay = self.config.checkpoint_interval_ms / 1000
+        else:
+            return
+        # checkpoints must not join the transaction of the current action
+        self._checkpoint_handle = asyncio.get_running_loop().call_later(
+            delay, self._start_checkpoint, context=contextvars.Context())
+
+    def _schedule_checkpoint_retry(self):
+        self._cancel_checkpoint()
+        delay = min(
+            self.config.checkpoint_interval_ms * 2 ** (self._checkpoint_failures - 1),
+            self.config.checkpoint_max_retry_interval_ms) / 1000
+        self._checkpoint_handle = asyncio.get_running_loop().call_later(
+            delay, self._start_checkpoint, context=contextvars.Context())
+
+    def _cancel_checkpoint(self):
+        if self._checkpoint_handle is not None:
+            self._checkpoint_handle.cancel()
+            self._checkpoint_handle = None
+
+    def _start_checkpoint(self):
+        self._checkpoint_handle = None
+        task = asyncio.create_task(self._checkpoint())
+        self._checkpoint_tasks.add(task)
+        task.add_done_callback(self._checkpoint_tasks.discard)
+
+    async def _checkpoint(self):
+        async with self._lock:
+            try:
+                await self._flush()
+            except Exception:
+                self._checkpoint_failures += 1
+                logging.exception(
+                    f'Failed to save game {self.game_id} '
+                    f'({self._checkpoint_failures} times in a row), retrying later')
+                if self.has_unsaved_changes:
+                    self._schedule_checkpoint_retry()
+                else:
+                    self._checkpoint_failures = 0
+
+    async def flush(self):
+        """
+        Saves the state held in memory, if it has unsaved changes.
+        """
+        async with self._lock:
+            await self._flush()
+
+    async def _save(self, moves: List[GameMove], rev: int) -> int:
+        """
+        Saves the moves leading to the given revision,
+        and a snapshot of the state if the last one is old enough.
+
+        Returns:
+            the revision of the last saved snapshot
+        """
+        game_repo = self.repository.game_repository
+        await game_repo.add_moves(moves)
+        if rev - self._snapshot_rev < self.config.snapshot_interval:
+            return self._snapshot_rev
+        await game_repo.save_state(
+            self.game_id, self._game_state,
+            expected_rev=self._snapshot_rev,
+            rev=rev)
+        return rev
+
+    async def _flush(self):
+        if not self.config.write_behind:
+            # unsaved changes are waiting for the transactions of their actions
+            return
+        if self._game_state is None or not self.has_unsaved_changes:
+            return
+        rev = self._rev
+        try:
+            async with transaction_context(self.repository.database):
+                snapshot_rev = await self._save(self._unsaved_moves, rev)
+        except StaleDataError:
+            logging.error(
+                f'Game {self.game_id} has been modified elsewhere, '
+                f'discarding revisions {self._saved_rev + 1}-{rev}')
+            self._unload_game_state()
+            return
+        self._saved_rev = rev
+        self._snapshot_rev = snapshot_rev
+        self._unsaved_moves.clear()
+        self._checkpoint_failures = 0
+        self._cancel_checkpoint()
+
+    def etag_for(self, user_id: str, rev: Optional[int] = None) -> str:
+        """
+        The ETag of the game state as seen by the given user,
+        by default at the revision of the state held in memory.
+        """
+        return game_state_etag(self.game_id, self._rev if rev is None else rev, user_id)
+
+    def _get_other_player_id(self, player_id: str) -> str:
+        ids = set(self.player_connections.keys())
+        ids.remove(player_id)
+        return list(ids)[0]
 
     def is_player_connected(self, player_id):
         return self.player_connections.get(player_id) is not None
@@ -94,12 +386,41 @@ class GameInProgress:
         if player_id in self.player_connections:
             self.player_connections[player_id] = None
 
+        if not any(self.player_connections.values()):
+            async with self._lock:
+                # nobody is playing, the state may be freed once it is persisted
+                try:
+                    await self._flush()
+                except Exception:
+                    logging.exception(f'Failed to save game {self.game_id}, retrying later')
+                    self._schedule_checkpoint()
+                else:
+                    self._unload_game_state()
+
         logging.info(f'User {connection.user_id} disconnected from game {self.game_id}')
 
     async def apply_power(
             self, player: User,
             power_id: str) -> ActionResult:
-        ctx = ActionApplicationContext(await self.get_game())
+        async with self._lock:
+            return await self._apply_power(player, power_id)
+
+    async def _apply_power(
+            self, player: User,
+            power_id: str) -> ActionResult:
+        with ActionApplicationContext(await self._get_game_state()) as ctx:
+            result = self._check_and_apply_power(ctx, player, power_id)
+        if not result.is_legal:
+            return result
+        return await self._commit(ctx, GameMove(
+            player_id_=player.id_,
+            action_='apply_power',
+            power_id_=power_id,
+        ))
+
+    def _check_and_apply_power(
+            self, ctx: ActionApplicationContext,
+            player: User, power_id: str) -> ActionResult:
         game_state: GameState = ctx.game_state
 
         if game_state.finished:
@@ -145,15 +466,36 @@ class GameInProgress:
             self, player: User,
             piece_id: str,
             tile_id: str) -> ActionResult:
-        game = await self.get_game()
-        ctx = ActionApplicationContext(game)
+        async with self._lock:
+            return await self._make_move(player, piece_id, tile_id)
+
+    async def _make_move(
+            self, player: User,
+            piece_id: str,
+            tile_id: str) -> ActionResult:
+        with ActionApplicationContext(await self._get_game_state()) as ctx:
+            result = self._check_and_make_move(ctx, player, piece_id, tile_id)
+        if not result.is_legal:
+            return result
+        return await self._commit(ctx, GameMove(
+            player_id_=player.id_,
+            action_='move',
+            piece_id_=piece_id,
+            tile_id_=tile_id,
+        ))
+
+    def _check_and_make_move(
+            self, ctx: ActionApplicationContext,
+            player: User,
+            piece_id: str,
+            tile_id: str) -> ActionResult:
         # check move
 
         game_state: GameState = ctx.game_state
 
         tiles = game_state.board.tiles
         pieces = game_state.board.pieces
-        other_player_id = game.get_other_player_id(player.id_)
+        other_player_id = self._get_other_player_id(player.id_)
 
         if game_state.finished:
             return ActionResult(
@@ -196,43 +538,36 @@ class GameInProgress:
             )
 
         # perform move
-        game_state.moves_played += 1
+        game_state.play_move()
 
-        await self._capture_pieces(dest_tile, game_state.board)
-        await self._capture_powers(dest_tile, piece, game_state.board)
+        self._capture_pieces(dest_tile, piece, game_state)
+        self._capture_powers(dest_tile, piece, game_state)
 
-        piece.tile_id = tile_id
-        game_state.current_player_id = other_player_id
+        game_state.move_piece(piece_id, tile_id)
+        game_state.switch_turn(other_player_id)
 
         if not any(piece.owner_id == other_player_id for piece in pieces.values()):
-            game_state.finished = True
-            game_state.winner_id = player.id_
+            game_state.finish(player.id_)
         else:
             self._handle_power_spawning(game_state)
 
         return ctx.legal_result()
 
-    async def _capture_pieces(
+    def _capture_pieces(
             self, dest_tile: Tile,
-            board: GameBoard):
-        captured_pieces = []
-        for opid, other_piece in board.pieces.items():
-            if board.tiles[other_piece.tile_id].position == dest_tile.position:
-                captured_pieces.append(opid)
-        for captured_piece in captured_pieces:
-            del board.pieces[captured_piece]
-
-    async def _capture_powers(
+            piece: Piece,
+            game_state: GameState):
+        captured_piece = game_state.board.get_piece_on(dest_tile.id)
+        if captured_piece is not None and captured_piece.id != piece.id:
+            game_state.capture_piece(captured_piece.id)
+
+    def _capture_powers(
             self, dest_tile: Tile,
             piece: Piece,
-            board: GameBoard):
-        for power_id, power in board.powers.items():
-            if power.tile_id is None:
-                continue
-            if board.tiles[power.tile_id].position == dest_tile.position:
-                power.tile_id = None
-                power.piece_id = piece.id
-                power.authorized_player_ids.append(piece.owner_id)
+            game_state: GameState):
+        captured_power = game_state.board.get_power_on(dest_tile.id)
+        if captured_power is not None:
+            game_state.capture_power(captured_power.id, piece.id)
 
     def _handle_power_spawning(self, game_state: GameState):
         self.power_randomizer.after_move(
@@ -249,17 +584,23 @@ class GameConnection(BasicConnection):
             repository: Repository) -> None:
         super().__init__(qrws, user, notification_service, repository)
         self.game_in_progress = game_in_progress
+        # skipped diffs are replaced by the current state
+        qrws.outbound_queue.resync = self._resync
+
+    async def _get_game_state_message(self, user_id: str) -> GameStateMessage:
+        serialized = await self.game_in_progress.get_serialized_state_for(user_id)
+        return GameStateMessage(
+            recipient_id=user_id,
+            game_state=serialized.game_state,
+            etag=serialized.etag,
+        )
+
+    async def _resync(self, key: Hashable) -> GameStateMessage:
+        async with transaction_context(self.repository.database):
+            return await self._get_game_state_message(self.user_id)
 
     async def on_ready(self, user: User):
-        game = await self.game_in_progress.get_game()
-        game_state = game.game_state_
-        serialized, etag = game_state.serialize_with_etag_for(user)
-        await self.qrws.send_message(
-            GameStateMessage(
-                recipient_id=user.id_,
-                game_state=serialized,
-                etag=etag,
-            ))
+        await self.qrws.send_message(await self._get_game_state_message(user.id_))
 
     async def handle_message(self, user: User, message: Message) -> bool:
         if await super().handle_message(user, message):
@@ -313,22 +654,16 @@ class GameConnection(BasicConnection):
             ))
             if not result.is_legal:
                 return
-            coroutines = []
             for player_id, conn in conn.game_in_progress.player_connections.items():
                 if conn is None:
                     continue
-                diff, etag_from, etag_to = GameState.serialize_diff_with_etag_for(
-                    from_=result.old_game_state,
-                    to=result.new_game_state,
-                    user_id=player_id,
-                )
-                coroutines.append(conn.qrws.send_message(GameStateDiffMessage(
+                diff, etag_from, etag_to = result.diffs[player_id]
+                conn.qrws.post_message(GameStateDiffMessage(
                     recipient_id=player_id,
                     game_state_diff=diff,
                     etag_from=etag_from,
                     etag_to=etag_to,
-                )))
-            await asyncio.gather(*coroutines)
+                ))
 
         await self.repository.synchronize_transaction_on_commit(
             on_commit(self, action_result))
@@ -0,0 +1,226 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List, Optional, TYPE_CHECKING, Tuple
+
+if TYPE_CHECKING:
+    from quadradiusr_server.game_state import GameState, NextPowerSpawnInfo, Piece, Power
+
+
+Path = Tuple[str, ...]
+
+
+class Change(ABC):
+    """
+    A single revertible modification of a game state.
+    """
+
+    @abstractmethod
+    def paths(self) -> Tuple[Path, ...]:
+        """
+        Paths of the elements of the serialized game state
+        which are affected by this change.
+        """
+        ...
+
+    @abstractmethod
+    def apply(self, game_state: 'GameState') -> None:
+        ...
+
+    @abstractmethod
+    def revert(self, game_state: 'GameState') -> None:
+        ...
+
+
+@dataclass(frozen=True)
+class PieceMoved(Change):
+    piece_id: str
+    from_tile_id: str
+    to_tile_id: str
+
+    def paths(self) -> Tuple[Path, ...]:
+        return ('board', 'pieces', self.piece_id),
+
+    def apply(self, game_state: 'GameState') -> None:
+        game_state.board.place_piece(self.piece_id, self.to_tile_id)
+
+    def revert(self, game_state: 'GameState') -> None:
+        game_state.board.place_piece(self.piece_id, self.from_tile_id)
+
+
+@dataclass(frozen=True)
+class PieceCaptured(Change):
+    piece: 'Piece'
+
+    def paths(self) -> Tuple[Path, ...]:
+        return ('board', 'pieces', self.piece.id),
+
+    def apply(self, game_state: 'GameState') -> None:
+        game_state.board.remove_piece(self.piece.id)
+
+    def revert(self, game_state: 'GameState') -> None:
+        game_state.board.add_piece(self.piece)
+
+
+@dataclass(frozen=True)
+class PowerSpawned(Change):
+    power: 'Power'
+
+    def paths(self) -> Tuple[Path, ...]:
+        return ('board', 'powers', self.power.id),
+
+    def apply(self, game_state: 'GameState') -> None:
+        game_state.board.add_power(self.power)
+
+    def revert(self, game_state: 'GameState') -> None:
+        game_state.board.remove_power(self.power.id)
+
+
+@dataclass(frozen=True)
+class PowerCaptured(Change):
+    power_id: str
+    from_tile_id: str
+    from_piece_id: Optional[str]
+    piece_id: str
+    player_id: str
+
+    def paths(self) -> Tuple[Path, ...]:
+        return ('board', 'powers', self.power_id),
+
+    def apply(self, game_state: 'GameState') -> None:
+        game_state.board.place_power(self.power_id, None)
+        power = game_state.board.powers[self.power_id]
+        power.piece_id = self.piece_id
+        power.authorized_player_ids.append(self.player_id)
+
+    def revert(self, game_state: 'GameState') -> None:
+        game_state.board.place_power(self.power_id, self.from_tile_id)
+        power = game_state.board.powers[self.power_id]
+        power.piece_id = self.from_piece_id
+        power.authorized_player_ids.pop()
+
+
+@dataclass(frozen=True)
+class TileElevationChanged(Change):
+    tile_id: str
+    from_elevation: int
+    to_elevation: int
+
+    def paths(self) -> Tuple[Path, ...]:
+        return ('board', 'tiles', self.tile_id),
+
+    def apply(self, game_state: 'GameState') -> None:
+        game_state.board.set_elevation(self.tile_id, self.to_elevation)
+
+    def revert(self, game_state: 'GameState') -> None:
+        game_state.board.set_elevation(self.tile_id, self.from_elevation)
+
+
+@dataclass(frozen=True)
+class TurnSwitched(Change):
+    from_player_id: str
+    to_player_id: str
+
+    def paths(self) -> Tuple[Path, ...]:
+        return ('current_player_id',),
+
+    def apply(self, game_state: 'GameState') -> None:
+        game_state.current_player_id = self.to_player_id
+
+    def revert(self, game_state: 'GameState') -> None:
+        game_state.current_player_id = self.from_player_id
+
+
+@dataclass(frozen=True)
+class MovePlayed(Change):
+    def paths(self) -> Tuple[Path, ...]:
+        return ('moves_played',),
+
+    def apply(self, game_state: 'GameState') -> None:
+        game_state.moves_played += 1
+
+    def revert(self, game_state: 'GameState') -> None:
+        game_state.moves_played -= 1
+
+
+@dataclass(frozen=True)
+class GameFinished(Change):
+    winner_id: Optional[str]
+
+    def paths(self) -> Tuple[Path, ...]:
+        return ('finished',), ('winner_id',)
+
+    def apply(self, game_state: 'GameState') -> None:
+        game_state.finished = True
+        game_state.winner_id = self.winner_id
+
+    def revert(self, game_state: 'GameState') -> None:
+        game_state.finished = False
+        game_state.winner_id = None
+
+
+@dataclass(frozen=True)
+class NextPowerSpawnChanged(Change):
+    from_spawn_info: 'NextPowerSpawnInfo'
+    to_spawn_info: 'NextPowerSpawnInfo'
+
+    def paths(self) -> Tuple[Path, ...]:
+        return ('next_power_spawn',),
+
+    def apply(self, game_state: 'GameState') -> None:
+        game_state.next_power_spawn = self.to_spawn_info
+
+    def revert(self, game_state: 'GameState') -> None:
+        game_state.next_power_spawn = self.from_spawn_info
+
+
+class ActionJournal:
+    """
+    Records changes made to a game state during an action,
+    so that they can be reverted without copying the state.
+    """
+
+    def __init__(self) -> None:
+        self._changes: List[Change] = []
+
+    @property
+    def changes(self) -> List[Change]:
+        return list(self._changes)
+
+    def __len__(self):
+        return len(self._changes)
+
+    def record(self, change: Change):
+        self._changes.append(change)
+
+    def paths(self) -> List[Path]:
+        """
+        Paths of all elements affected by the recorded changes, without duplicates.
+        """
+        return list(dict.fromkeys(
+            path for change in self._changes for path in change.paths()))
+
+    def revert(self, game_state: 'GameState'):
+        for change in reversed(self._changes):
+            change.revert(game_state)
+
+    def reapply(self, game_state: 'GameState'):
+        for change in self._changes:
+            change.apply(game_state)
+
+    @contextmanager
+    def reverted(self, game_state: 'GameState'):
+        """
+        Temporarily reverts the recorded changes, so that
+        the game state may be observed as it was before the action.
+
+        Examples:
+
+        >>> with journal.reverted(game_state):
+        >>>    # game_state is the old state here
+        """
+        self.revert(game_state)
+        try:
+            yield game_state
+        finally:
+            self.reapply(game_state)
@@ -1,14 +1,20 @@
 import base64
-import json
+import hashlib
 import uuid
+from array import array
+from contextlib import contextmanager
 from dataclasses import dataclass, field
-from typing import Dict, Tuple, Optional, List
+from typing import Dict, Tuple, Optional, List, Mapping, Iterator
 
-import jsondiff as jsondiff
+from quadradiusr_server.game_journal import ActionJournal, Change, PieceMoved, PieceCaptured, \
+    PowerSpawned, PowerCaptured, TileElevationChanged, TurnSwitched, MovePlayed, GameFinished, \
+    NextPowerSpawnChanged, Path
+from quadradiusr_server.utils import diff_dicts, DIFF_DELETE, add_slots
 
-from quadradiusr_server.utils import SimpleJsonDiffSyntax
+_MISSING = object()
 
 
+@add_slots
 @dataclass
 class Tile:
     id: str
@@ -25,6 +31,7 @@ class Tile:
         }
 
 
+@add_slots
 @dataclass
 class Piece:
     id: str
@@ -38,6 +45,7 @@ class Piece:
         }
 
 
+@add_slots
 @dataclass
 class Power:
     id: str
@@ -52,7 +60,7 @@ class Power:
             'power_definition_id': self.power_definition_id if authorized else None,
             'tile_id': self.tile_id,
             'piece_id': self.piece_id,
-            'authorized_player_ids': self.authorized_player_ids,
+            'authorized_player_ids': list(self.authorized_player_ids),
         }
 
 
@@ -71,10 +79,49 @@ class GameSettings:
 
 @dataclass
 class GameBoard:
+    """
+    The board with all its tiles, pieces, and powers.
+
+    The board maintains indexes of positions, pieces, and powers.
+    The dictionaries of tiles, pieces, and powers should be modified only
+    using the methods of the board, otherwise :meth:`reindex` has to be called.
+    """
+
     tiles: Dict[str, Tile]
     pieces: Dict[str, Piece]
     powers: Dict[str, Power] = field(default_factory=dict)
 
+    def __post_init__(self):
+        self.reindex()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in ['_tile_ids_by_position', '_piece_ids_by_tile', '_power_ids_by_tile']:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.reindex()
+
+    def reindex(self):
+        self._tile_ids_by_position: Dict[Tuple[int, int], str] = {
+            tuple(tile.position): tile_id
+            for tile_id, tile in self.tiles.items()
+        }
+        self._reindex_occupants()
+
+    def _reindex_occupants(self):
+        self._piece_ids_by_tile: Dict[str, str] = {
+            piece.tile_id: piece_id
+            for piece_id, piece in self.pieces.items()
+        }
+        self._power_ids_by_tile: Dict[str, str] = {
+            power.tile_id: power_id
+            for power_id, power in self.powers.items()
+            if power.tile_id is not None
+        }
+
     def serialize_for(self, user_id: str):
         return {
             'tiles': {
@@ -92,14 +139,12 @@ class GameBoard:
         }
 
     def get_tile_at(self, x: int, y: int) -> Optional[Tile]:
-        for tile in self.tiles.values():
-            if tile.position == (x, y):
-                return tile
+        tile_id = self._tile_ids_by_position.get((x, y))
+        return self.tiles[tile_id] if tile_id is not None else None
 
     def get_piece_on(self, tile_id: str) -> Optional[Piece]:
-        for piece in self.pieces.values():
-            if piece.tile_id == tile_id:
-                return piece
+        piece_id = self._piece_ids_by_tile.get(tile_id)
+        return self.pieces[piece_id] if piece_id is not None else None
 
     def get_piece_at(self, x: int, y: int) -> Optional[Piece]:
         tile = self.get_tile_at(x, y)
@@ -107,18 +152,200 @@ class GameBoard:
             return None
         return self.get_piece_on(tile.id)
 
+    def get_power_on(self, tile_id: str) -> Optional[Power]:
+        power_id = self._power_ids_by_tile.get(tile_id)
+        return self.powers[power_id] if power_id is not None else None
+
     def get_empty_tiles(self) -> Dict[str, Tile]:
-        # skip tiles which have pieces on them
-        tiles = dict(self.tiles)
-        for piece in self.pieces.values():
-            del tiles[piece.tile_id]
+        # skip tiles which have pieces or powers on them
+        return {
+            tile_id: tile
+            for tile_id, tile in self.tiles.items()
+            if tile_id not in self._piece_ids_by_tile and
+            tile_id not in self._power_ids_by_tile
+        }
+
+    def set_elevation(self, tile_id: str, elevation: int):
+        self.tiles[tile_id].elevation = elevation
+
+    def add_piece(self, piece: Piece):
+        self.pieces[piece.id] = piece
+        self._piece_ids_by_tile[piece.tile_id] = piece.id
+
+    def remove_piece(self, piece_id: str) -> Piece:
+        piece = self.pieces.pop(piece_id)
+        if self._piece_ids_by_tile.get(piece.tile_id) == piece_id:
+            del self._piece_ids_by_tile[piece.tile_id]
+        return piece
+
+    def place_piece(self, piece_id: str, tile_id: str):
+        piece = self.remove_piece(piece_id)
+        piece.tile_id = tile_id
+        self.add_piece(piece)
+
+    def add_power(self, power: Power):
+        self.powers[power.id] = power
+        if power.tile_id is not None:
+            self._power_ids_by_tile[power.tile_id] = power.id
+
+    def remove_power(self, power_id: str) -> Power:
+        power = self.powers.pop(power_id)
+        if power.tile_id is not None and \
+                self._power_ids_by_tile.get(power.tile_id) == power_id:
+            del self._power_ids_by_tile[power.tile_id]
+        return power
+
+    def place_power(self, power_id: str, tile_id: Optional[str]):
+        power = self.remove_power(power_id)
+        power.tile_id = tile_id
+        self.add_power(power)
+
+
+class CompactGameBoard(GameBoard):
+    """
+    A memory-efficient board, which stores its tiles in a dense grid.
+
+    Tile IDs (which must be UUIDs) are packed into a single byte string,
+    and elevations are kept in an array, both indexed by a tile handle
+    ``x * height + y``. Tiles are created on access, so they must be
+    modified only using the methods of the board.
+
+    Tile IDs are also kept as strings together with their handles,
+    this index is rebuilt from the packed IDs when the board is unpickled.
+    """
+
+    _ID_SIZE = 16
+
+    def __init__(
+            self, size: Tuple[int, int],
+            tile_ids: bytes, elevations: array,
+            pieces: Dict[str, Piece],
+            powers: Dict[str, Power]) -> None:
+        if len(tile_ids) != size[0] * size[1] * self._ID_SIZE or \
+                len(elevations) != size[0] * size[1]:
+            raise ValueError(f'Tile data does not match board size {size}')
+        self.size = size
+        self.tile_ids = tile_ids
+        self.elevations = elevations
+        self.pieces = pieces
+        self.powers = powers
+        self._index_tile_ids()
+        self.reindex()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        for name in ['_tile_id_strs', '_handles_by_tile_id']:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._index_tile_ids()
+        self.reindex()
 
-        # skip tiles which have powers on them
-        for power in self.powers.values():
-            if power.tile_id:
-                del tiles[power.tile_id]
+    @classmethod
+    def from_board(cls, board: GameBoard) -> 'CompactGameBoard':
+        if isinstance(board, CompactGameBoard):
+            return board
+        width = max((tile.position[0] for tile in board.tiles.values()), default=-1) + 1
+        height = max((tile.position[1] for tile in board.tiles.values()), default=-1) + 1
+        if len(board.tiles) != width * height:
+            raise ValueError('Only boards with a full grid of tiles can be compacted')
+
+        tile_ids = bytearray(width * height * cls._ID_SIZE)
+        elevations = array('b', bytes(width * height))
+        for tile_id, tile in board.tiles.items():
+            tile_uuid = uuid.UUID(tile_id)
+            if str(tile_uuid) != tile_id:
+                raise ValueError(f'Tile ID {tile_id} is not a canonical UUID')
+            x, y = tile.position
+            handle = x * height + y
+            tile_ids[handle * cls._ID_SIZE:(handle + 1) * cls._ID_SIZE] = tile_uuid.bytes
+            elevations[handle] = tile.elevation
+        return cls(
+            size=(width, height),
+            tile_ids=bytes(tile_ids),
+            elevations=elevations,
+            pieces=dict(board.pieces),
+            powers=dict(board.powers),
+        )
 
-        return tiles
+    @property
+    def tiles(self) -> Mapping[str, Tile]:
+        return _CompactTiles(self)
+
+    def reindex(self):
+        # positions are implied by tile handles
+        self._reindex_occupants()
+
+    def _index_tile_ids(self):
+        # tile IDs never change, so they are indexed only once;
+        # formatting hex digits is much faster than constructing UUIDs
+        h = self.tile_ids.hex()
+        self._tile_id_strs: List[str] = [
+            f'{h[i:i + 8]}-{h[i + 8:i + 12]}-{h[i + 12:i + 16]}-'
+            f'{h[i + 16:i + 20]}-{h[i + 20:i + 32]}'
+            for i in range(0, len(h), 2 * self._ID_SIZE)
+        ]
+        self._handles_by_tile_id: Dict[str, int] = {
+            tile_id: handle for handle, tile_id in enumerate(self._tile_id_strs)
+        }
+
+    def _get_handle(self, tile_id: str) -> Optional[int]:
+        try:
+            return self._handles_by_tile_id.get(tile_id)
+        except TypeError:
+            return None
+
+    def _get_tile_id(self, handle: int) -> str:
+        return self._tile_id_strs[handle]
+
+    def _get_tile(self, handle: int) -> Tile:
+        height = self.size[1]
+        return Tile(
+            id=self._get_tile_id(handle),
+            position=(handle // height, handle % height),
+            elevation=self.elevations[handle],
+        )
+
+    def get_tile_at(self, x: int, y: int) -> Optional[Tile]:
+        width, height = self.size
+        if not (0 <= x < width and 0 <= y < height):
+            return None
+        return self._get_tile(x * height + y)
+
+    def set_elevation(self, tile_id: str, elevation: int):
+        handle = self._get_handle(tile_id)
+        if handle is None:
+            raise KeyError(tile_id)
+        self.elevations[handle] = elevation
+
+
+class _CompactTiles(Mapping):
+    def __init__(self, board: CompactGameBoard) -> None:
+        self._board = board
+
+    def __getitem__(self, tile_id: str) -> Tile:
+        handle = self._board._get_handle(tile_id)
+        if handle is None:
+            raise KeyError(tile_id)
+        return self._board._get_tile(handle)
+
+    def __contains__(self, tile_id) -> bool:
+        return self._board._get_handle(tile_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._board.elevations)
+
+    def __iter__(self) -> Iterator[str]:
+        for handle in range(len(self)):
+            yield self._board._get_tile_id(handle)
+
+    def values(self):
+        return [self._board._get_tile(handle) for handle in range(len(self))]
+
+    def items(self):
+        return [(tile.id, tile) for tile in self.values()]
 
 
 @dataclass
@@ -135,6 +362,13 @@ class NextPowerSpawnInfo:
 
 @dataclass
 class GameState:
+    """
+    The state of a game.
+
+    All modifications should be made using the methods of this class,
+    so that they are recorded in the active journal, if any.
+    """
+
     settings: GameSettings
     board: GameBoard
     current_player_id: str
@@ -143,6 +377,82 @@ class GameState:
     winner_id: Optional[str] = None
     moves_played: int = 0
 
+    # not a field, the journal is attached only for the duration of an action
+    _journal = None
+
+    @contextmanager
+    def journaled(self, journal: ActionJournal):
+        """
+        Records all changes made within the context to the given journal.
+        """
+        self._journal = journal
+        try:
+            yield journal
+        finally:
+            del self._journal
+
+    def apply_change(self, change: Change):
+        change.apply(self)
+        if self._journal is not None:
+            self._journal.record(change)
+
+    def move_piece(self, piece_id: str, tile_id: str):
+        piece = self.board.pieces[piece_id]
+        self.apply_change(PieceMoved(
+            piece_id=piece_id,
+            from_tile_id=piece.tile_id,
+            to_tile_id=tile_id,
+        ))
+
+    def capture_piece(self, piece_id: str):
+        self.apply_change(PieceCaptured(
+            piece=self.board.pieces[piece_id],
+        ))
+
+    def spawn_power(self, power: Power):
+        self.apply_change(PowerSpawned(
+            power=power,
+        ))
+
+    def capture_power(self, power_id: str, piece_id: str):
+        power = self.board.powers[power_id]
+        piece = self.board.pieces[piece_id]
+        self.apply_change(PowerCaptured(
+            power_id=power_id,
+            from_tile_id=power.tile_id,
+            from_piece_id=power.piece_id,
+            piece_id=piece_id,
+            player_id=piece.owner_id,
+        ))
+
+    def set_tile_elevation(self, tile_id: str, elevation: int):
+        tile = self.board.tiles[tile_id]
+        self.apply_change(TileElevationChanged(
+            tile_id=tile_id,
+            from_elevation=tile.elevation,
+            to_elevation=elevation,
+        ))
+
+    def switch_turn(self, player_id: str):
+        self.apply_change(TurnSwitched(
+            from_player_id=self.current_player_id,
+            to_player_id=player_id,
+        ))
+
+    def play_move(self):
+        self.apply_change(MovePlayed())
+
+    def finish(self, winner_id: Optional[str]):
+        self.apply_change(GameFinished(
+            winner_id=winner_id,
+        ))
+
+    def set_next_power_spawn(self, next_power_spawn: NextPowerSpawnInfo):
+        self.apply_change(NextPowerSpawnChanged(
+            from_spawn_info=self.next_power_spawn,
+            to_spawn_info=next_power_spawn,
+        ))
+
     def serialize_for(self, user_id: str) -> dict:
         return {
             'settings': self.settings.serialize_for(user_id),
@@ -154,30 +464,45 @@ class GameState:
             'moves_played': self.moves_played,
         }
 
-    def serialize_with_etag_for(self, user_id: str) -> Tuple[dict, str]:
-        serialized = self.serialize_for(user_id)
-        hash_int = hash(json.dumps(serialized, sort_keys=True))
-        hash_bytes = hash_int.to_bytes(
-            hash_int.bit_length() // 8 + 1,
-            byteorder='big', signed=True)
-        hash_str = base64.b85encode(hash_bytes).decode()
-        return serialized, hash_str
-
-    @staticmethod
-    def serialize_diff_with_etag_for(
-            from_: 'GameState',
-            to: 'GameState',
-            user_id: str) -> Tuple[dict, str, str]:
-        from_serialized, from_etag = from_.serialize_with_etag_for(user_id)
-        to_serialized, to_etag = to.serialize_with_etag_for(user_id)
-
-        diff = jsondiff.diff(
-            from_serialized, to_serialized,
-            marshal=True, syntax=SimpleJsonDiffSyntax())
-        return diff, from_etag, to_etag
+    def _serialize_path_for(self, path: Path, user_id: str):
+        if path[0] == 'board':
+            _, collection, entity_id = path
+            entity = getattr(self.board, collection).get(entity_id)
+            return entity.serialize_for(user_id) if entity is not None else _MISSING
+        value = getattr(self, path[0])
+        return value.serialize_for(user_id) if hasattr(value, 'serialize_for') else value
+
+    def serialize_diff_for(self, journal: ActionJournal, user_id: str) -> dict:
+        """
+        Serializes the difference introduced by changes recorded in the journal.
+
+        Only the elements affected by the changes are serialized.
+        """
+        paths = journal.paths()
+        with journal.reverted(self):
+            old_values = [self._serialize_path_for(path, user_id) for path in paths]
+        new_values = [self._serialize_path_for(path, user_id) for path in paths]
+
+        diff = {}
+        for path, old_value, new_value in zip(paths, old_values, new_values):
+            *parent_path, key = path
+            if old_value is _MISSING and new_value is _MISSING:
+                continue
+            elif new_value is _MISSING:
+                parent = _get_diff_parent(diff, parent_path)
+                parent.setdefault(DIFF_DELETE, []).append(key)
+            elif old_value is _MISSING:
+                _get_diff_parent(diff, parent_path)[key] = new_value
+            elif isinstance(old_value, dict) and isinstance(new_value, dict):
+                value_diff = diff_dicts(old_value, new_value)
+                if value_diff:
+                    _get_diff_parent(diff, parent_path)[key] = value_diff
+            elif old_value != new_value:
+                _get_diff_parent(diff, parent_path)[key] = new_value
+        return diff
 
     @classmethod
-    def initial(cls, player_a_id: str, player_b_id: str):
+    def initial(cls, player_a_id: str, player_b_id: str, *, compact: bool = False):
         board_size = (10, 8)
         tiles = dict()
         for x in range(board_size[0]):
@@ -188,39 +513,59 @@ class GameState:
                 )
                 tiles[tile.id] = tile
 
+        tile_ids_by_position = {
+            tile.position: tile_id
+            for tile_id, tile in tiles.items()
+        }
         pieces = dict()
         for x in range(board_size[0]):
             for y in range(2):
                 piece = Piece(
                     id=str(uuid.uuid4()),
                     owner_id=player_a_id,
-                    tile_id=[
-                        tile_id for tile_id, tile in tiles.items()
-                        if tile.position == (x, y)
-                    ][0],
+                    tile_id=tile_ids_by_position[(x, y)],
                 )
                 pieces[piece.id] = piece
                 piece = Piece(
                     id=str(uuid.uuid4()),
                     owner_id=player_b_id,
-                    tile_id=[
-                        tile_id for tile_id, tile in tiles.items()
-                        if tile.position == (x, y + board_size[1] - 2)
-                    ][0],
+                    tile_id=tile_ids_by_position[(x, y + board_size[1] - 2)],
                 )
                 pieces[piece.id] = piece
 
+        board = GameBoard(
+            tiles=tiles,
+            pieces=pieces,
+        )
         return GameState(
             settings=GameSettings(
                 board_size=board_size,
             ),
-            board=GameBoard(
-                tiles=tiles,
-                pieces=pieces,
-            ),
+            board=CompactGameBoard.from_board(board) if compact else board,
             current_player_id=player_a_id,
             next_power_spawn=NextPowerSpawnInfo(
                 rounds=0,
                 count=0,
             )
         )
+
+
+def game_state_etag(game_id: str, rev: int, user_id: str) -> str:
+    """
+    Computes the ETag of a game state at the given revision, as seen by the given user.
+
+    The revision changes with every action, and the user determines
+    the visibility of the state, so the ETag does not depend
+    on the contents of the state, and is stable across processes.
+    """
+    digest = hashlib.blake2b(
+        f'{game_id}:{rev}:{user_id}'.encode(),
+        digest_size=12).digest()
+    return base64.urlsafe_b64encode(digest).decode()
+
+
+def _get_diff_parent(diff: dict, parent_path: List[str]) -> dict:
+    parent = diff
+    for key in parent_path:
+        parent = parent.setdefault(key, {})
+    return parent
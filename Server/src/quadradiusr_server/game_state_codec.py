@@ -0,0 +1,314 @@
+import re
+from array import array
+from typing import Union, Optional, List, Any
+
+import msgpack
+
+from quadradiusr_server.game_journal import Change, PieceMoved, PieceCaptured, PowerSpawned, \
+    PowerCaptured, TileElevationChanged, TurnSwitched, MovePlayed, GameFinished, \
+    NextPowerSpawnChanged
+from quadradiusr_server.game_state import GameState, GameBoard, CompactGameBoard, Tile, Piece, \
+    Power, GameSettings, NextPowerSpawnInfo
+
+# stored game states start with the magic followed by the format version,
+# which distinguishes them from legacy pickled states
+MAGIC = b'QRGS'
+FORMAT_VERSION = 1
+# the same for the changes made by stored moves
+CHANGES_MAGIC = b'QRGC'
+CHANGES_FORMAT_VERSION = 1
+
+_UUID_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+_UUID_SIZE = 16
+
+
+class GameStateFormatError(ValueError):
+    pass
+
+
+def _pack_id(id_: Optional[str]) -> Union[bytes, str, None]:
+    """
+    Packs canonical UUIDs into 16 bytes, other IDs are kept as they are.
+    """
+    # a regular expression is much faster than constructing a UUID
+    if id_ is None or not _UUID_PATTERN.fullmatch(id_):
+        return id_
+    return bytes.fromhex(id_.replace('-', ''))
+
+
+def _unpack_id(id_: Union[bytes, str, None]) -> Optional[str]:
+    if not isinstance(id_, bytes):
+        return id_
+    h = id_.hex()
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+
+
+def _encode_piece(piece: Piece) -> list:
+    return [_pack_id(piece.id), _pack_id(piece.owner_id), _pack_id(piece.tile_id)]
+
+
+def _decode_piece(data: list) -> Piece:
+    id_, owner_id, tile_id = data
+    return Piece(id=_unpack_id(id_), owner_id=_unpack_id(owner_id), tile_id=_unpack_id(tile_id))
+
+
+def _encode_power(power: Power) -> list:
+    return [
+        _pack_id(power.id), power.power_definition_id,
+        _pack_id(power.tile_id), _pack_id(power.piece_id),
+        [_pack_id(player_id) for player_id in power.authorized_player_ids],
+    ]
+
+
+def _decode_power(data: list) -> Power:
+    id_, power_definition_id, tile_id, piece_id, authorized = data
+    return Power(
+        id=_unpack_id(id_),
+        power_definition_id=power_definition_id,
+        tile_id=_unpack_id(tile_id),
+        piece_id=_unpack_id(piece_id),
+        authorized_player_ids=[_unpack_id(player_id) for player_id in authorized],
+    )
+
+
+def _encode_spawn_info(spawn_info: NextPowerSpawnInfo) -> list:
+    return [spawn_info.rounds, spawn_info.count]
+
+
+def _decode_spawn_info(data: list) -> NextPowerSpawnInfo:
+    rounds, count = data
+    return NextPowerSpawnInfo(rounds=rounds, count=count)
+
+
+def _encode_grid(board: GameBoard) -> Optional[dict]:
+    tiles = board.tiles.values()
+    width = max((tile.position[0] for tile in tiles), default=-1) + 1
+    height = max((tile.position[1] for tile in tiles), default=-1) + 1
+    if len(tiles) != width * height:
+        return None
+
+    tile_ids = bytearray(width * height * _UUID_SIZE)
+    elevations = array('b', bytes(width * height))
+    for tile in tiles:
+        tile_id = _pack_id(tile.id)
+        if not isinstance(tile_id, bytes):
+            return None
+        x, y = tile.position
+        handle = x * height + y
+        tile_ids[handle * _UUID_SIZE:(handle + 1) * _UUID_SIZE] = tile_id
+        elevations[handle] = tile.elevation
+    return {
+        'size': [width, height],
+        'ids': bytes(tile_ids),
+        'elevations': elevations.tobytes(),
+    }
+
+
+def _encode_tiles(board: GameBoard) -> dict:
+    if isinstance(board, CompactGameBoard):
+        return {
+            'size': list(board.size),
+            'ids': board.tile_ids,
+            'elevations': board.elevations.tobytes(),
+        }
+    grid = _encode_grid(board)
+    if grid is not None:
+        return grid
+    return {
+        'list': [
+            [_pack_id(tile.id), tile.position[0], tile.position[1], tile.elevation]
+            for tile in board.tiles.values()
+        ],
+    }
+
+
+def _decode_board(data: dict, pieces, powers) -> GameBoard:
+    tiles = data['tiles']
+    if 'list' in tiles:
+        board = GameBoard(
+            tiles={
+                tile.id: tile for tile in (
+                    Tile(id=_unpack_id(id_), position=(x, y), elevation=elevation)
+                    for id_, x, y, elevation in tiles['list'])
+            },
+            pieces=pieces,
+            powers=powers,
+        )
+        return CompactGameBoard.from_board(board) if data['compact'] else board
+
+    elevations = array('b')
+    elevations.frombytes(tiles['elevations'])
+    if data['compact']:
+        return CompactGameBoard(
+            size=tuple(tiles['size']),
+            tile_ids=tiles['ids'],
+            elevations=elevations,
+            pieces=pieces,
+            powers=powers,
+        )
+
+    width, height = tiles['size']
+    tile_ids = tiles['ids']
+    if len(tile_ids) != width * height * _UUID_SIZE or len(elevations) != width * height:
+        raise GameStateFormatError(f'Tile data does not match board size {(width, height)}')
+    board_tiles = {}
+    for handle in range(width * height):
+        tile_id = _unpack_id(tile_ids[handle * _UUID_SIZE:(handle + 1) * _UUID_SIZE])
+        board_tiles[tile_id] = Tile(
+            id=tile_id,
+            position=(handle // height, handle % height),
+            elevation=elevations[handle],
+        )
+    return GameBoard(
+        tiles=board_tiles,
+        pieces=pieces,
+        powers=powers,
+    )
+
+
+def encode_game_state(game_state: GameState) -> bytes:
+    """
+    Encodes the game state into a compact, versioned binary format.
+
+    Tiles of boards with a full grid are stored in the form used by
+    :class:`CompactGameBoard`, and UUIDs are stored as bytes.
+    """
+    board = game_state.board
+    data = {
+        'board_size': list(game_state.settings.board_size),
+        'compact': isinstance(board, CompactGameBoard),
+        'tiles': _encode_tiles(board),
+        'pieces': [_encode_piece(piece) for piece in board.pieces.values()],
+        'powers': [_encode_power(power) for power in board.powers.values()],
+        'current_player_id': _pack_id(game_state.current_player_id),
+        'next_power_spawn': _encode_spawn_info(game_state.next_power_spawn),
+        'finished': game_state.finished,
+        'winner_id': _pack_id(game_state.winner_id),
+        'moves_played': game_state.moves_played,
+    }
+    return MAGIC + bytes([FORMAT_VERSION]) + msgpack.packb(data)
+
+
+def is_encoded_game_state(data: bytes) -> bool:
+    return data.startswith(MAGIC)
+
+
+def _unpack(data: bytes, magic: bytes, version: int, what: str) -> Any:
+    if not data.startswith(magic) or len(data) <= len(magic):
+        raise GameStateFormatError(f'Data is not {what}')
+    data_version = data[len(magic)]
+    if data_version != version:
+        raise GameStateFormatError(f'Unsupported format version of {what}: {data_version}')
+
+    try:
+        return msgpack.unpackb(data[len(magic) + 1:])
+    except (ValueError, msgpack.UnpackException) as e:
+        raise GameStateFormatError(str(e)) from e
+
+
+def decode_game_state(data: bytes) -> GameState:
+    """
+    Raises:
+        GameStateFormatError: when the data is not an encoded game state
+            or its format version is not supported
+    """
+    data = _unpack(data, MAGIC, FORMAT_VERSION, 'an encoded game state')
+    pieces = {
+        piece.id: piece for piece in map(_decode_piece, data['pieces'])
+    }
+    powers = {
+        power.id: power for power in map(_decode_power, data['powers'])
+    }
+    return GameState(
+        settings=GameSettings(
+            board_size=tuple(data['board_size']),
+        ),
+        board=_decode_board(data, pieces, powers),
+        current_player_id=_unpack_id(data['current_player_id']),
+        next_power_spawn=_decode_spawn_info(data['next_power_spawn']),
+        finished=data['finished'],
+        winner_id=_unpack_id(data['winner_id']),
+        moves_played=data['moves_played'],
+    )
+
+
+def _encode_change(change: Change) -> list:
+    if isinstance(change, PieceMoved):
+        return ['piece_moved', _pack_id(change.piece_id),
+                _pack_id(change.from_tile_id), _pack_id(change.to_tile_id)]
+    if isinstance(change, PieceCaptured):
+        return ['piece_captured', _encode_piece(change.piece)]
+    if isinstance(change, PowerSpawned):
+        return ['power_spawned', _encode_power(change.power)]
+    if isinstance(change, PowerCaptured):
+        return ['power_captured', _pack_id(change.power_id),
+                _pack_id(change.from_tile_id), _pack_id(change.from_piece_id),
+                _pack_id(change.piece_id), _pack_id(change.player_id)]
+    if isinstance(change, TileElevationChanged):
+        return ['tile_elevation_changed', _pack_id(change.tile_id),
+                change.from_elevation, change.to_elevation]
+    if isinstance(change, TurnSwitched):
+        return ['turn_switched', _pack_id(change.from_player_id), _pack_id(change.to_player_id)]
+    if isinstance(change, MovePlayed):
+        return ['move_played']
+    if isinstance(change, GameFinished):
+        return ['game_finished', _pack_id(change.winner_id)]
+    if isinstance(change, NextPowerSpawnChanged):
+        return ['next_power_spawn_changed',
+                _encode_spawn_info(change.from_spawn_info),
+                _encode_spawn_info(change.to_spawn_info)]
+    raise TypeError(f'Unsupported change: {change!r}')
+
+
+def _decode_change(data: list) -> Change:
+    kind, *args = data
+    if kind == 'piece_moved':
+        piece_id, from_tile_id, to_tile_id = map(_unpack_id, args)
+        return PieceMoved(piece_id, from_tile_id, to_tile_id)
+    if kind == 'piece_captured':
+        return PieceCaptured(_decode_piece(args[0]))
+    if kind == 'power_spawned':
+        return PowerSpawned(_decode_power(args[0]))
+    if kind == 'power_captured':
+        power_id, from_tile_id, from_piece_id, piece_id, player_id = map(_unpack_id, args)
+        return PowerCaptured(power_id, from_tile_id, from_piece_id, piece_id, player_id)
+    if kind == 'tile_elevation_changed':
+        tile_id, from_elevation, to_elevation = args
+        return TileElevationChanged(_unpack_id(tile_id), from_elevation, to_elevation)
+    if kind == 'turn_switched':
+        from_player_id, to_player_id = map(_unpack_id, args)
+        return TurnSwitched(from_player_id, to_player_id)
+    if kind == 'move_played':
+        return MovePlayed()
+    if kind == 'game_finished':
+        return GameFinished(_unpack_id(args[0]))
+    if kind == 'next_power_spawn_changed':
+        from_spawn_info, to_spawn_info = map(_decode_spawn_info, args)
+        return NextPowerSpawnChanged(from_spawn_info, to_spawn_info)
+    raise GameStateFormatError(f'Unknown change: {kind}')
+
+
+def encode_changes(changes: List[Change]) -> bytes:
+    """
+    Encodes changes made to a game state in the same way as
+    :func:`encode_game_state`, so that they can be stored with a move.
+    """
+    data = [_encode_change(change) for change in changes]
+    return CHANGES_MAGIC + bytes([CHANGES_FORMAT_VERSION]) + msgpack.packb(data)
+
+
+def is_encoded_changes(data: bytes) -> bool:
+    return data.startswith(CHANGES_MAGIC)
+
+
+def decode_changes(data: bytes) -> List[Change]:
+    """
+    Raises:
+        GameStateFormatError: when the data is not encoded changes
+            or its format version is not supported
+    """
+    data = _unpack(data, CHANGES_MAGIC, CHANGES_FORMAT_VERSION, 'encoded changes')
+    try:
+        return [_decode_change(change) for change in data]
+    except (TypeError, ValueError) as e:
+        raise GameStateFormatError(f'Malformed change: {e}') from e
@@ -0,0 +1,88 @@
+import json
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Union
+
+from aiohttp import web
+from aiohttp.abc import BaseRequest
+
+
+class JsonCodec(ABC):
+    """
+    Encodes and decodes JSON, used by the QRWS protocol and the REST API.
+    """
+
+    @abstractmethod
+    def dumps(self, obj: Any) -> str:
+        ...
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        return self.dumps(obj).encode('utf-8')
+
+    @abstractmethod
+    def loads(self, data: Union[str, bytes]) -> Any:
+        """
+        Raises:
+            json.JSONDecodeError: when the data is not a valid JSON
+        """
+        ...
+
+
+class StdlibJsonCodec(JsonCodec):
+    def dumps(self, obj: Any) -> str:
+        return json.dumps(obj)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    def __init__(self) -> None:
+        import orjson
+        self._orjson = orjson
+
+    def dumps(self, obj: Any) -> str:
+        return self._orjson.dumps(obj).decode('utf-8')
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        return self._orjson.dumps(obj)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        # orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+        return self._orjson.loads(data)
+
+
+_codec: JsonCodec = StdlibJsonCodec()
+
+
+def create_codec(name: str) -> JsonCodec:
+    if name == 'json':
+        return StdlibJsonCodec()
+    elif name == 'orjson':
+        try:
+            return OrjsonCodec()
+        except ImportError:
+            logging.warning('orjson is not installed, falling back to json')
+            return StdlibJsonCodec()
+    else:
+        raise ValueError(f'Unknown JSON codec: {name}')
+
+
+def get_codec() -> JsonCodec:
+    return _codec
+
+
+def set_codec(name: str):
+    global _codec
+    _codec = create_codec(name)
+
+
+def json_response(data: Any, **kwargs) -> web.Response:
+    return web.Response(
+        body=_codec.dumps_bytes(data),
+        content_type='application/json',
+        **kwargs)
+
+
+async def read_json(request: BaseRequest) -> Any:
+    return _codec.loads(await request.read())
@@ -1,26 +1,44 @@
+import asyncio
 import datetime
 import logging
 import uuid
-from typing import Dict, List
+from typing import Dict, List, Optional, Set
 
+from quadradiusr_server.config import LobbyConfig
 from quadradiusr_server.constants import QrwsCloseCode
 from quadradiusr_server.db.base import User, LobbyMessage
 from quadradiusr_server.db.repository import Repository
-from quadradiusr_server.notification import NotificationService, Notification
+from quadradiusr_server.notification import NotificationService
 from quadradiusr_server.qrws_connection import BasicConnection, QrwsConnection
 from quadradiusr_server.qrws_messages import Message, SendMessageMessage, KickMessage
 from quadradiusr_server.rest.mappers import lobby_message_to_json
 
 
 class LiveLobby:
+    """
+    A lobby with connected players.
+
+    Players are notified about others joining and leaving
+    either immediately (``lobby.joined`` and ``lobby.left``),
+    or, if their connection opts in, with a single ``lobby.presence``
+    notification per presence window, which contains the net changes.
+    """
+
     def __init__(
             self, lobby_id: str, repository: Repository,
-            ns: NotificationService) -> None:
+            ns: NotificationService,
+            config: LobbyConfig = None) -> None:
         self.lobby_id = lobby_id
         self.repository = repository
         self.ns = ns
+        self.config = config if config is not None else LobbyConfig()
 
         self._players: Dict[str, LobbyConnection] = {}
+        # user ID -> the user as sent in presence notifications
+        self._player_data: Dict[str, dict] = {}
+        # players which were present in the last presence notification
+        self._announced_player_ids: Set[str] = set()
+        self._presence_flush: Optional[asyncio.TimerHandle] = None
 
     @property
     def player_ids(self) -> List[str]:
@@ -38,37 +56,37 @@ class LiveLobby:
         if user_id in self._players:
             await self._players[user_id].kick()
         self._players[user_id] = lobby_conn
-
-        subjects = set(self._players.keys()) - {user_id}
-        for subject_id in subjects:
-            self.ns.notify(Notification(
-                topic='lobby.joined',
-                subject_id=subject_id,
-                data={
-                    'lobby_id': self.lobby_id,
-                    'user': {
-                        'id': user.id_,
-                        'username': user.username_,
-                    },
-                },
-            ))
+        self._player_data[user_id] = {
+            'id': user.id_,
+            'username': user.username_,
+        }
+
+        subjects = self._get_immediate_subjects() - {user_id}
+        self.ns.notify_all(
+            subjects,
+            topic='lobby.joined',
+            data={
+                'lobby_id': self.lobby_id,
+                'user': self._player_data[user_id],
+            })
+        self._schedule_presence_flush()
         logging.info(f'User {user.friendly_name} joined lobby {lobby_conn.lobby.lobby_id}')
 
     async def leave(self, lobby_conn: 'LobbyConnection'):
         user_id = lobby_conn.user_id
         if lobby_conn in self._players.values():
             del self._players[user_id]
-
-        subjects = set(self._players.keys())
-        for subject_id in subjects:
-            self.ns.notify(Notification(
-                topic='lobby.left',
-                subject_id=subject_id,
-                data={
-                    'lobby_id': self.lobby_id,
-                    'user_id': user_id,
-                },
-            ))
+            del self._player_data[user_id]
+
+        subjects = self._get_immediate_subjects()
+        self.ns.notify_all(
+            subjects,
+            topic='lobby.left',
+            data={
+                'lobby_id': self.lobby_id,
+                'user_id': user_id,
+            })
+        self._schedule_presence_flush()
         logging.info(f'User {user_id} left lobby {lobby_conn.lobby.lobby_id}')
 
     async def send_message(self, user: User, content: str):
@@ -84,19 +102,50 @@ class LiveLobby:
             created_at_=datetime.datetime.now(datetime.timezone.utc),
         )
         await lobby_repo.add_message(lobby_message)
-        for subject_id in self._players.keys():
-            self.ns.notify(Notification(
-                topic='lobby.message.received',
-                subject_id=subject_id,
-                data={
-                    'message': lobby_message_to_json(lobby_message),
-                },
-            ))
+        self.ns.notify_all(
+            list(self._players.keys()),
+            topic='lobby.message.received',
+            data={
+                'message': lobby_message_to_json(lobby_message),
+            })
         logging.info(f'Message by {user.friendly_name} in {lobby.id_}: {content}')
 
     def joined(self, user: User):
         return user.id_ in self._players.keys()
 
+    def _get_immediate_subjects(self) -> Set[str]:
+        return {
+            user_id for user_id, conn in self._players.items()
+            if not conn.coalesce_presence
+        }
+
+    def _schedule_presence_flush(self):
+        if self._presence_flush is None:
+            self._presence_flush = asyncio.get_running_loop().call_later(
+                self.config.presence_window, self._flush_presence)
+
+    def _flush_presence(self):
+        self._presence_flush = None
+        player_ids = set(self._players.keys())
+        joined = player_ids - self._announced_player_ids
+        left = self._announced_player_ids - player_ids
+        self._announced_player_ids = player_ids
+        if not joined and not left:
+            return
+
+        subjects = [
+            user_id for user_id, conn in self._players.items()
+            if conn.coalesce_presence
+        ]
+        self.ns.notify_all(
+            subjects,
+            topic='lobby.presence',
+            data={
+                'lobby_id': self.lobby_id,
+                'joined': [self._player_data[user_id] for user_id in sorted(joined)],
+                'left': sorted(left),
+            })
+
 
 class LobbyConnection(BasicConnection):
 
@@ -105,9 +154,11 @@ class LobbyConnection(BasicConnection):
             qrws: QrwsConnection,
             user: User,
             notification_service: NotificationService,
-            repository: Repository) -> None:
+            repository: Repository,
+            *, coalesce_presence: bool = False) -> None:
         super().__init__(qrws, user, notification_service, repository)
         self.lobby: LiveLobby = lobby
+        self.coalesce_presence = coalesce_presence
 
     async def handle_message(self, user: User, message: Message) -> bool:
         if await super().handle_message(user, message):
@@ -1,10 +1,13 @@
 import abc
 import asyncio
 import fnmatch
+import functools
+import re
 from abc import ABC
-from collections import defaultdict
-from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from dataclasses import dataclass, field
+from typing import Dict, List, Iterable, Optional, Set, Callable, Awaitable
+
+from quadradiusr_server.qrws_messages import NotificationMessage
 
 
 @dataclass
@@ -12,6 +15,29 @@ class Notification:
     topic: str
     subject_id: str
     data: dict
+    _message: Optional[NotificationMessage] = field(
+        default=None, init=False, repr=False, compare=False)
+
+    def to_message(self) -> NotificationMessage:
+        if self._message is None:
+            self._message = NotificationMessage(
+                topic=self.topic,
+                data=self.data,
+            )
+        return self._message
+
+    def for_subject(self, subject_id: str) -> 'Notification':
+        """
+        Copies the notification for another subject,
+        sharing the message, so that it is encoded only once.
+        """
+        notification = Notification(
+            topic=self.topic,
+            subject_id=subject_id,
+            data=self.data,
+        )
+        notification._message = self.to_message()
+        return notification
 
 
 class Handler(ABC):
@@ -20,42 +46,137 @@ class Handler(ABC):
         pass
 
 
-class NotificationService:
+class NotificationBackend(ABC):
+    """
+    Propagates notifications between server processes.
+
+    Notifications are always dispatched to local handlers
+    by the notification service, backends only publish them
+    to other processes, and receive notifications published there.
+    """
+
+    async def start(self, receive: Callable[[Notification], Awaitable[None]]):
+        pass
+
+    @abc.abstractmethod
+    async def publish(self, notification: Notification):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class LocalNotificationBackend(NotificationBackend):
+    """
+    The default backend, used when there is a single server process.
+    """
+
+    async def publish(self, notification: Notification):
+        pass
+
+
+class _TopicHandlers:
+    """
+    Handlers of a single subject, indexed by topic.
+
+    Exact topics are looked up directly, and only patterns are matched.
+    """
+
     def __init__(self) -> None:
-        self.handlers: Dict[str, List[Tuple[str, Handler]]] = \
-            defaultdict(lambda: [])
+        self.exact: Dict[str, List[Handler]] = {}
+        self.patterns: Dict[str, List[Handler]] = {}
+
+    def _get_index(self, topic: str) -> Dict[str, List[Handler]]:
+        return self.patterns if _is_topic_pattern(topic) else self.exact
+
+    def add(self, topic: str, handler: Handler):
+        self._get_index(topic).setdefault(topic, []).append(handler)
+
+    def remove(self, topic: str, handler: Handler):
+        index = self._get_index(topic)
+        handlers = index.get(topic, [])
+        handlers.remove(handler)
+        if not handlers:
+            del index[topic]
+
+    def is_empty(self) -> bool:
+        return not self.exact and not self.patterns
+
+    def collect(self, topic: str, handlers: Set[Handler]):
+        handlers.update(self.exact.get(topic, ()))
+        for pattern, pattern_handlers in self.patterns.items():
+            if _compile_topic_pattern(pattern)(topic):
+                handlers.update(pattern_handlers)
+
+
+def _is_topic_pattern(topic: str) -> bool:
+    return any(c in topic for c in '*?[')
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_topic_pattern(pattern: str) -> Callable[[str], Optional[re.Match]]:
+    return re.compile(fnmatch.translate(pattern)).match
+
+
+class NotificationService:
+    def __init__(self, backend: NotificationBackend = None) -> None:
+        self.backend = backend if backend is not None else LocalNotificationBackend()
+        # subject ID (or '*' for all subjects) -> handlers
+        self._handlers: Dict[str, _TopicHandlers] = {}
+        self._tasks: Set[asyncio.Task] = set()
 
     def register_handler(
             self, subject_id: str,
             topic: str, handler: Handler):
-        self.handlers[subject_id].append((topic, handler))
+        if subject_id not in self._handlers:
+            self._handlers[subject_id] = _TopicHandlers()
+        self._handlers[subject_id].add(topic, handler)
 
     def unregister_handler(
             self, subject_id: str,
             topic: str, handler: Handler):
-        self.handlers[subject_id].remove((topic, handler))
+        topic_handlers = self._handlers.get(subject_id, _TopicHandlers())
+        topic_handlers.remove(topic, handler)
+        if topic_handlers.is_empty():
+            del self._handlers[subject_id]
 
     def notify(self, notification: Notification):
-        import asyncio
-        asyncio.create_task(self.notify_now(notification))
+        task = asyncio.create_task(self.notify_now(notification))
+        # keep a reference, so that the task is not garbage collected
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def notify_all(self, subject_ids: Iterable[str], topic: str, data: dict):
+        """
+        Sends the same notification to many subjects,
+        encoding the message only once.
+        """
+        notification = None
+        for subject_id in subject_ids:
+            if notification is None:
+                notification = Notification(
+                    topic=topic,
+                    subject_id=subject_id,
+                    data=data,
+                )
+            else:
+                notification = notification.for_subject(subject_id)
+            self.notify(notification)
+
+    async def start(self):
+        await self.backend.start(self._dispatch)
+
+    async def stop(self):
+        await self.backend.stop()
 
     async def notify_now(self, notification: Notification):
-        handlers = set()
-        for subject_id, tpl in self.handlers.items():
-            for topic, handler in tpl:
-                if self._subject_matches(notification.subject_id, subject_id) and \
-                        self._topic_matches(notification.topic, topic):
-                    handlers.add(handler)
-        await asyncio.gather(*[h.handle(notification) for h in handlers])
+        await self.backend.publish(notification)
+        await self._dispatch(notification)
 
-    def _subject_matches(self, subject_id: str, subject_id_wildcard: str):
-        if subject_id_wildcard == '*':
-            return True
-        return subject_id == subject_id_wildcard
-
-    def _topic_matches(self, topic: str, topic_wildcard: str):
-        if topic_wildcard == '*':
-            return True
-        filtered = fnmatch.filter([topic], topic_wildcard)
-        if filtered:
-            return True
+    async def _dispatch(self, notification: Notification):
+        handlers: Set[Handler] = set()
+        for subject_id in (notification.subject_id, '*'):
+            topic_handlers = self._handlers.get(subject_id)
+            if topic_handlers is not None:
+                topic_handlers.collect(notification.topic, handlers)
+        await asyncio.gather(*[h.handle(notification) for h in handlers])
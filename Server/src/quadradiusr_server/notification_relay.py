@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Optional, Callable, Awaitable, Dict
+
+from quadradiusr_server.notification import NotificationBackend, Notification
+
+# maximum size of a single encoded notification
+_LINE_LIMIT = 16 * 1024 * 1024
+
+
+def _encode_notification(notification: Notification) -> bytes:
+    return json.dumps({
+        'topic': notification.topic,
+        'subject_id': notification.subject_id,
+        'data': notification.data,
+    }).encode() + b'\n'
+
+
+def _decode_notification(line: bytes) -> Notification:
+    data = json.loads(line)
+    return Notification(
+        topic=data['topic'],
+        subject_id=data['subject_id'],
+        data=data['data'],
+    )
+
+
+class RelayNotificationBackend(NotificationBackend):
+    """
+    Publishes notifications to other server processes
+    through a :class:`NotificationRelay` listening on a Unix socket.
+
+    When the connection to the relay is lost, it is reestablished,
+    notifications published in the meantime do not reach other processes.
+    """
+
+    def __init__(self, path: str, *, reconnect_delay: float = 1.0) -> None:
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self._receive: Optional[Callable[[Notification], Awaitable[None]]] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, receive: Callable[[Notification], Awaitable[None]]):
+        self._receive = receive
+        # the first connection has to succeed, so that misconfiguration is visible
+        reader = await self._connect()
+        self._task = asyncio.create_task(self._run(reader))
+
+    async def _connect(self) -> asyncio.StreamReader:
+        reader, self._writer = await asyncio.open_unix_connection(
+            self.path, limit=_LINE_LIMIT)
+        logging.info(f'Connected to notification relay {self.path}')
+        return reader
+
+    async def _run(self, reader: Optional[asyncio.StreamReader]):
+        while True:
+            if reader is not None:
+                await self._read(reader)
+                self._writer = None
+                logging.warning(f'Disconnected from notification relay {self.path}')
+            await asyncio.sleep(self.reconnect_delay)
+            try:
+                reader = await self._connect()
+            except OSError as e:
+                logging.warning(f'Cannot connect to notification relay {self.path}: {e}')
+                reader = None
+
+    async def _read(self, reader: asyncio.StreamReader):
+        while True:
+            try:
+                line = await reader.readline()
+            except (OSError, ValueError):
+                return
+            if not line:
+                return
+            try:
+                notification = _decode_notification(line)
+            except (ValueError, KeyError):
+                logging.error(f'Received a malformed notification from relay: {line!r}')
+                continue
+            await self._receive(notification)
+
+    async def publish(self, notification: Notification):
+        writer = self._writer
+        if writer is None:
+            logging.debug(f'Not connected to relay, dropping notification {notification}')
+            return
+        writer.write(_encode_notification(notification))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class _RelayPeer:
+    """
+    A process connected to the relay.
+
+    Notifications are written to the peer by a separate task,
+    so that a slow peer does not block relaying to other peers.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, queue_size: int) -> None:
+        self.writer = writer
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._task = asyncio.create_task(self._write())
+
+    def send(self, line: bytes) -> bool:
+        """
+        Returns:
+            ``False`` when the queue of the peer is full
+        """
+        try:
+            self._queue.put_nowait(line)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _write(self):
+        try:
+            while True:
+                line = await self._queue.get()
+                self.writer.write(line)
+                await self.writer.drain()
+        except OSError as e:
+            logging.warning(f'Cannot write to notification relay client: {e}')
+            self.writer.close()
+
+    def close(self):
+        self._task.cancel()
+        self.writer.close()
+
+    def abort(self):
+        # pending data would never be flushed to a peer which does not read
+        self._task.cancel()
+        self.writer.transport.abort()
+
+
+class NotificationRelay:
+    """
+    A broker which relays notifications between server processes
+    connected to a Unix socket.
+
+    Each notification is relayed to all processes
+    except the one which has published it.
+    A process which does not keep up with ``queue_size``
+    pending notifications is disconnected,
+    so that it reconnects and the relay does not buffer without limit.
+    """
+
+    def __init__(self, path: str, *, queue_size: int = 1024) -> None:
+        self.path = path
+        self.queue_size = queue_size
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Dict[asyncio.StreamWriter, _RelayPeer] = dict()
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._server = await asyncio.start_unix_server(
+            self._handle_client, self.path, limit=_LINE_LIMIT)
+        logging.info(f'Notification relay listening on {self.path}')
+
+    async def _handle_client(
+            self, reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter):
+        peer = _RelayPeer(writer, self.queue_size)
+        self._peers[writer] = peer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for other in list(self._peers.values()):
+                    if other is not peer and not other.send(line):
+                        logging.warning(
+                            'Notification relay client does not keep up, disconnecting it')
+                        self._peers.pop(other.writer, None)
+                        other.abort()
+        except (OSError, ValueError) as e:
+            logging.warning(f'Notification relay client failed: {e}')
+        finally:
+            self._peers.pop(writer, None)
+            peer.close()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for peer in list(self._peers.values()):
+            peer.close()
+        self._peers.clear()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    async def run(self):
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
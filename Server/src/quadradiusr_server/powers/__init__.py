@@ -19,6 +19,10 @@ class PowerDefinition(ABC):
 
     @abstractmethod
     def apply(self, game_state: GameState, power_id: str) -> None:
+        """
+        Applies the power. The game state must be modified
+        only using its methods, so that the changes are journaled.
+        """
         ...
 
 
@@ -31,4 +35,8 @@ class PowerRandomizer(ABC):
     def after_move(
             self, game_state: GameState,
             power_definitions: List[PowerDefinition]) -> None:
+        """
+        Spawns powers after a move. The game state must be modified
+        only using its methods, so that the changes are journaled.
+        """
         ...
@@ -19,4 +19,4 @@ class RaiseTilePowerDefinition(PowerDefinition):
 
         piece = game_state.board.pieces[power.piece_id]
         tile = game_state.board.tiles[piece.tile_id]
-        tile.elevation += 1
+        game_state.set_tile_elevation(tile.id, tile.elevation + 1)
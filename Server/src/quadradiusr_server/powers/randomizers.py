@@ -13,8 +13,11 @@ class DefaultPowerRandomizer(PowerRandomizer):
     def after_move(
             self, game_state: GameState,
             power_definitions: List[PowerDefinition]) -> None:
-        spawn_info: NextPowerSpawnInfo = game_state.next_power_spawn
-        spawn_info.rounds -= 1
+        spawn_info = NextPowerSpawnInfo(
+            rounds=game_state.next_power_spawn.rounds - 1,
+            count=game_state.next_power_spawn.count,
+        )
+        game_state.set_next_power_spawn(spawn_info)
         if spawn_info.rounds > 0:
             return
 
@@ -27,9 +30,9 @@ class DefaultPowerRandomizer(PowerRandomizer):
                 power_definition_id=self._random_power_definition(power_definitions),
                 tile_id=tile_id,
             )
-            game_state.board.powers[power.id] = power
+            game_state.spawn_power(power)
 
-        game_state.next_power_spawn = self._random_spawn_info()
+        game_state.set_next_power_spawn(self._random_spawn_info())
 
     def _random_spawn_info(self) -> NextPowerSpawnInfo:
         return NextPowerSpawnInfo(
@@ -1,20 +1,27 @@
+import asyncio
+import contextvars
+import logging
 from abc import ABC
+from collections import deque
 from dataclasses import dataclass
-from typing import Optional, Callable, List
+from typing import Optional, Callable, List, Deque, Dict, Hashable, Awaitable
 
 from aiohttp import WSMsgType, web
 from aiohttp.abc import BaseRequest
-from aiohttp.web_exceptions import HTTPUnauthorized
+from aiohttp.web_exceptions import HTTPUnauthorized, HTTPBadRequest
 from aiohttp.web_ws import WebSocketResponse
 
 from quadradiusr_server.auth import Auth
-from quadradiusr_server.constants import QrwsOpcode, QrwsCloseCode
+from quadradiusr_server.config import QrwsConfig
+from quadradiusr_server.constants import QrwsOpcode, QrwsCloseCode, QrwsEncoding
 from quadradiusr_server.db.base import User
 from quadradiusr_server.db.repository import Repository
 from quadradiusr_server.db.transactions import transaction_context
+from quadradiusr_server.json_codec import get_codec
 from quadradiusr_server.notification import NotificationService, Handler, Notification
 from quadradiusr_server.qrws_messages import Message, parse_message, ErrorMessage, \
-    ServerReadyMessage, IdentifyMessage, SubscribeMessage, NotificationMessage, SubscribedMessage
+    ServerReadyMessage, IdentifyMessage, SubscribeMessage, SubscribedMessage, \
+    decode_binary_message
 
 
 @dataclass
@@ -23,18 +30,181 @@ class QrwsCloseException(Exception):
     message: str = None
 
 
+@dataclass
+class QrwsStats:
+    """
+    Statistics of outbound queues, aggregated over connections.
+    """
+    queued_messages: int = 0
+    max_queue_depth: int = 0
+    dropped_messages: int = 0
+    coalesced_messages: int = 0
+    evicted_connections: int = 0
+
+
+class OutboundQueuePolicy:
+    DROP_OLDEST = 'drop_oldest'
+    COALESCE = 'coalesce'
+    DISCONNECT = 'disconnect'
+
+
+class OutboundQueue:
+    """
+    A bounded queue of messages waiting to be sent to a client.
+
+    Incremental messages are never skipped on their own. When one of them
+    has to be dropped or coalesced, all queued messages with its key are
+    replaced by a resynchronization, i.e. a complete message produced
+    by :attr:`resync` right before it is sent.
+    """
+
+    def __init__(self, max_size: int, policy: str, stats: QrwsStats) -> None:
+        if policy not in (
+                OutboundQueuePolicy.DROP_OLDEST,
+                OutboundQueuePolicy.COALESCE,
+                OutboundQueuePolicy.DISCONNECT):
+            raise ValueError(f'Unknown outbound queue policy: {policy}')
+        self.max_size = max_size
+        self.policy = policy
+        self.stats = stats
+        self.dropped_messages = 0
+        # produces a complete message with the given coalesce key,
+        # without it the client is disconnected instead of resynchronized
+        self.resync: Optional[Callable[[Hashable], Awaitable[Message]]] = None
+        self._messages: Deque[Message] = deque()
+        # coalesce keys of pending resynchronizations, in order
+        self._resyncs: Dict[Hashable, None] = {}
+
+    def __len__(self) -> int:
+        return len(self._messages) + len(self._resyncs)
+
+    def put(self, message: Message) -> bool:
+        """
+        Returns:
+            ``False`` when the queue is full and the client should be disconnected
+        """
+        if len(self._messages) >= self.max_size:
+            if self.policy == OutboundQueuePolicy.DISCONNECT:
+                return False
+            if self.policy == OutboundQueuePolicy.COALESCE:
+                coalesced = self._coalesce(message)
+                if coalesced is not None:
+                    return coalesced
+            if not self._drop_oldest():
+                return False
+
+        self._messages.append(message)
+        self.stats.queued_messages += 1
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, len(self))
+        return True
+
+    def _coalesce(self, message: Message) -> Optional[bool]:
+        key = message.coalesce_key
+        if key is None or not any(queued.coalesce_key == key for queued in self._messages):
+            return None
+        if message.is_incremental:
+            # the message is covered by the resynchronization
+            if not self._request_resync(key):
+                return False
+        else:
+            self._remove(key)
+            self._messages.append(message)
+            self.stats.queued_messages += 1
+        self.stats.coalesced_messages += 1
+        return True
+
+    def _drop_oldest(self) -> bool:
+        dropped = self._messages.popleft()
+        self.dropped_messages += 1
+        self.stats.dropped_messages += 1
+        self.stats.queued_messages -= 1
+        if dropped.is_incremental:
+            return self._request_resync(dropped.coalesce_key)
+        return True
+
+    def _request_resync(self, key: Hashable) -> bool:
+        if self.resync is None:
+            return False
+        self._remove(key)
+        if key not in self._resyncs:
+            self._resyncs[key] = None
+            self.stats.queued_messages += 1
+        return True
+
+    def _remove(self, key: Hashable):
+        kept = deque(queued for queued in self._messages if queued.coalesce_key != key)
+        self.stats.queued_messages -= len(self._messages) - len(kept)
+        self._messages = kept
+
+    def pop_resync(self) -> Optional[Hashable]:
+        """
+        Returns:
+            the coalesce key of a pending resynchronization,
+            which has to be sent before the queued messages
+        """
+        if not self._resyncs:
+            return None
+        key = next(iter(self._resyncs))
+        del self._resyncs[key]
+        self.stats.queued_messages -= 1
+        return key
+
+    def pop(self) -> Message:
+        self.stats.queued_messages -= 1
+        return self._messages.popleft()
+
+    def clear(self):
+        self.stats.queued_messages -= len(self)
+        self._messages.clear()
+        self._resyncs.clear()
+
+
+def get_available_encodings() -> List[str]:
+    return [QrwsEncoding.JSON, QrwsEncoding.MSGPACK]
+
+
 class QrwsConnection:
     """
     A wrapper for QR WS connection.
+
+    Messages are sent in text frames (JSON) by default,
+    the client may request binary frames (MessagePack)
+    using the ``encoding`` query parameter.
+
+    Replies are sent directly using :meth:`send_message`,
+    whereas messages which are pushed to the client
+    (e.g. notifications) are queued using :meth:`post_message`,
+    so that a slow client does not stall the sender.
     """
 
-    def __init__(self, ws: WebSocketResponse = None) -> None:
+    def __init__(
+            self, ws: WebSocketResponse = None, *,
+            config: QrwsConfig = None,
+            stats: QrwsStats = None) -> None:
+        config = config if config is not None else QrwsConfig()
         self.ws = ws if ws is not None else web.WebSocketResponse()
         self.is_ready = False
+        self.encoding = QrwsEncoding.JSON
+        self.outbound_queue = OutboundQueue(
+            config.outbound_queue_size,
+            config.outbound_queue_policy,
+            stats if stats is not None else QrwsStats())
+        # coalesce key -> the last complete message sent on resynchronization
+        self._resynced: Dict[Hashable, Message] = {}
+        self._writer: Optional[asyncio.Task] = None
+        self._evicted: Optional[asyncio.Task] = None
 
     async def prepare(self, request: BaseRequest):
+        encoding = request.query.get('encoding', QrwsEncoding.JSON)
+        if encoding not in get_available_encodings():
+            raise HTTPBadRequest(reason=f'Unsupported encoding: {encoding}')
+        self.encoding = encoding
         await self.ws.prepare(request)
 
+    @property
+    def is_binary(self) -> bool:
+        return self.encoding == QrwsEncoding.MSGPACK
+
     @property
     def closed(self):
         return self.ws.closed
@@ -69,13 +239,20 @@ class QrwsConnection:
                 WSMsgType.CLOSE, WSMsgType.CLOSED
             }:
                 raise QrwsCloseException()
-            elif ws_msg.type != WSMsgType.TEXT:
+            elif ws_msg.type != (WSMsgType.BINARY if self.is_binary else WSMsgType.TEXT):
                 await self.send_error('Unexpected message type')
                 continue
 
-            data = ws_msg.json()
+            try:
+                if self.is_binary:
+                    data = decode_binary_message(ws_msg.data)
+                else:
+                    data = get_codec().loads(ws_msg.data)
+            except ValueError:
+                await self.send_error('Malformed message')
+                continue
 
-            if 'op' not in data:
+            if not isinstance(data, dict) or 'op' not in data:
                 await self.send_error('Missing operation')
                 continue
 
@@ -91,7 +268,71 @@ class QrwsConnection:
                 continue
 
     async def send_message(self, message: Message):
-        await self.ws.send_json(message.to_json())
+        if self.is_binary:
+            await self.ws.send_bytes(message.encode_binary())
+        else:
+            await self.ws.send_str(message.encode())
+
+    def post_message(self, message: Message):
+        """
+        Queues the message to be sent by a writer task, without waiting.
+
+        When the queue is full, the configured policy is applied.
+        """
+        if self.closed or self._evicted is not None:
+            return
+        if not self.outbound_queue.put(message):
+            self._evict()
+            return
+        if self._writer is None or self._writer.done():
+            # the writer must not join the transaction of the sender
+            self._writer = contextvars.Context().run(
+                asyncio.create_task, self._write_queued())
+
+    async def _write_queued(self):
+        queue = self.outbound_queue
+        try:
+            while queue and not self.closed:
+                key = queue.pop_resync()
+                if key is not None:
+                    try:
+                        message = await queue.resync(key)
+                    except Exception:
+                        logging.exception('Failed to resynchronize a client')
+                        self._evict()
+                        return
+                    self._resynced[key] = message
+                else:
+                    message = queue.pop()
+                    if message.is_incremental and not self._follows_resync(message):
+                        # already included in the resynchronization
+                        continue
+                await self.send_message(message)
+        except ConnectionError:
+            pass
+        finally:
+            if self.closed:
+                queue.clear()
+
+    def _follows_resync(self, message: Message) -> bool:
+        key = message.coalesce_key
+        resynced = self._resynced.get(key)
+        if resynced is None:
+            return True
+        if not message.follows(resynced):
+            return False
+        del self._resynced[key]
+        return True
+
+    def _evict(self):
+        logging.info(
+            f'Disconnecting a slow client, {len(self.outbound_queue)} '
+            f'messages are waiting to be sent')
+        self.outbound_queue.stats.evicted_connections += 1
+        self.outbound_queue.clear()
+        self._evicted = asyncio.create_task(self.close(
+            QrwsCloseCode.SLOW_CONSUMER,
+            'Too many messages waiting to be sent'))
 
     async def send_error(self, message: str, *, close_code: Optional[int] = None):
         await self.send_message(ErrorMessage(
@@ -101,6 +342,8 @@ class QrwsConnection:
             await self.ws.close(code=close_code, message=message.encode())
 
     async def close(self, code: int, message: str) -> bool:
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
         return await self.ws.close(
             code=code,
             message=message.encode() if message else None)
@@ -120,10 +363,7 @@ class BasicConnection(ABC):
 
         class SubscribeHandler(Handler):
             async def handle(self, notification: Notification):
-                await qrws.send_message(NotificationMessage(
-                    topic=notification.topic,
-                    data=notification.data,
-                ))
+                qrws.post_message(notification.to_message())
 
         self._sub_handler = SubscribeHandler()
 
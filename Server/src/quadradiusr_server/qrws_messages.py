@@ -1,11 +1,17 @@
 from abc import ABC
+from typing import Optional, Hashable
+
+import msgpack
 
 from quadradiusr_server.constants import QrwsOpcode
+from quadradiusr_server.json_codec import get_codec
 
 
 class Message(ABC):
     def __init__(self, op: int) -> None:
         self.op = op
+        self._encoded: Optional[str] = None
+        self._encoded_binary: Optional[bytes] = None
 
     def _to_json_data(self):
         return {}
@@ -16,6 +22,53 @@ class Message(ABC):
             'd': self._to_json_data(),
         }
 
+    @property
+    def coalesce_key(self) -> Optional[Hashable]:
+        """
+        Messages with the same key supersede each other,
+        so that only the latest one has to be sent to a slow client.
+        ``None`` means that the message cannot be skipped.
+        """
+        return None
+
+    @property
+    def is_incremental(self) -> bool:
+        """
+        Incremental messages build upon the previous messages with
+        the same :attr:`coalesce_key`. When one of them is skipped,
+        the client has to be sent a complete message instead.
+        """
+        return False
+
+    def follows(self, previous: 'Message') -> bool:
+        """
+        Whether this incremental message applies to
+        the given complete message with the same key.
+        """
+        return True
+
+    def encode(self) -> str:
+        """
+        Encodes the message as a websocket frame payload.
+
+        The result is cached, so that a message sent to many
+        connections is encoded only once. Messages must not be
+        modified after they have been sent.
+        """
+        if self._encoded is None:
+            self._encoded = get_codec().dumps(self.to_json())
+        return self._encoded
+
+    def encode_binary(self) -> bytes:
+        """
+        Encodes the message as a binary websocket frame payload (MessagePack).
+
+        The result is cached in the same way as in :meth:`encode`.
+        """
+        if self._encoded_binary is None:
+            self._encoded_binary = msgpack.packb(self.to_json())
+        return self._encoded_binary
+
 
 class HeartbeatMessage(Message):
     def __init__(self) -> None:
@@ -111,6 +164,10 @@ class GameStateMessage(Message):
         self.game_state = game_state
         self.etag = etag
 
+    @property
+    def coalesce_key(self) -> Optional[Hashable]:
+        return QrwsOpcode.GAME_STATE, self.recipient_id
+
     def _to_json_data(self):
         return {
             'recipient_id': self.recipient_id,
@@ -130,6 +187,18 @@ class GameStateDiffMessage(Message):
         self.etag_from = etag_from
         self.etag_to = etag_to
 
+    @property
+    def coalesce_key(self) -> Optional[Hashable]:
+        return QrwsOpcode.GAME_STATE, self.recipient_id
+
+    @property
+    def is_incremental(self) -> bool:
+        return True
+
+    def follows(self, previous: Message) -> bool:
+        return isinstance(previous, GameStateMessage) and \
+            previous.etag == self.etag_from
+
     def _to_json_data(self):
         return {
             'recipient_id': self.recipient_id,
@@ -181,6 +250,19 @@ class ApplyPowerMessage(Message):
         }
 
 
+def decode_binary_message(payload: bytes) -> dict:
+    """
+    Decodes a binary websocket frame payload (MessagePack).
+
+    Raises:
+        ValueError: when the payload is malformed
+    """
+    try:
+        return msgpack.unpackb(payload)
+    except msgpack.UnpackException as e:
+        raise ValueError(str(e)) from e
+
+
 def parse_message(*, op: int, data: dict) -> Message:
     if op == QrwsOpcode.HEARTBEAT:
         return HeartbeatMessage()
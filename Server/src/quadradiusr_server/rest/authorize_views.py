@@ -4,6 +4,7 @@ from aiohttp import web
 
 from quadradiusr_server.auth import Auth
 from quadradiusr_server.db.transactions import transactional
+from quadradiusr_server.json_codec import json_response, read_json
 from quadradiusr_server.server import routes
 
 
@@ -14,7 +15,7 @@ class AuthorizeView(web.View):
         auth: Auth = self.request.app['auth']
 
         try:
-            body = await self.request.json()
+            body = await read_json(self.request)
             username = str(body['username'])
             password = str(body['password'])
         except (JSONDecodeError, KeyError):
@@ -27,6 +28,15 @@ class AuthorizeView(web.View):
             return web.Response(status=401)
 
         token = await auth.issue_token(user)
-        return web.json_response({
+        return json_response({
             'token': token,
         })
+
+    @transactional
+    async def delete(self):
+        auth: Auth = self.request.app['auth']
+
+        token = self.request.headers.get('authorization')
+        if not token or not await auth.revoke_token(token):
+            return web.Response(status=401)
+        return web.Response(status=204)
@@ -13,6 +13,7 @@ from quadradiusr_server.db.base import GameInvite, Game
 from quadradiusr_server.db.repository import Repository
 from quadradiusr_server.db.transactions import transactional
 from quadradiusr_server.game_state import GameState
+from quadradiusr_server.json_codec import json_response, read_json
 from quadradiusr_server.notification import Notification, NotificationService
 from quadradiusr_server.rest.auth import authorized_endpoint
 from quadradiusr_server.rest.mappers import game_invite_to_json, game_to_json
@@ -41,7 +42,7 @@ class GameInvitesView(web.View):
         ns: NotificationService = self.request.app['notification']
 
         try:
-            body = await self.request.json()
+            body = await read_json(self.request)
             subject_id = str(body['subject_id'])
             expires_in = isodate.parse_duration(str(body.get('expires_in', 'PT2M')))
         except (JSONDecodeError, KeyError, ValueError):
@@ -87,7 +88,7 @@ class GameInviteView(GameInviteViewBase, web.View):
         repository: Repository = self.request.app['repository']
         game_invite = await self._get_game_invite(auth_user, repository)
 
-        return web.json_response(game_invite_to_json(game_invite))
+        return json_response(game_invite_to_json(game_invite))
 
     @transactional
     @authorized_endpoint
@@ -124,7 +125,9 @@ class GameInviteAcceptView(GameInviteViewBase, web.View):
         if auth_user.id_ != game_invite.subject_id_:
             raise HTTPForbidden(reason='You are not the person being invited')
 
-        game_state: GameState = GameState.initial(game_invite.from_id_, game_invite.subject_id_)
+        game_state: GameState = GameState.initial(
+            game_invite.from_id_, game_invite.subject_id_,
+            compact=game_config.compact_board)
         game_state.next_power_spawn = game_config.get_power_randomizer().initial_spawn_info()
 
         game = Game(
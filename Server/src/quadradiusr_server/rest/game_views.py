@@ -5,12 +5,13 @@ from aiohttp.web_exceptions import HTTPNotFound, HTTPForbidden
 
 from quadradiusr_server.auth import User, Auth
 from quadradiusr_server.constants import QrwsCloseCode
-from quadradiusr_server.db.base import Game
+from quadradiusr_server.db.game_repository import GamePlayers
 from quadradiusr_server.db.repository import Repository
 from quadradiusr_server.db.transactions import transactional, transaction_context
 from quadradiusr_server.game import GameConnection, GameState
+from quadradiusr_server.game_state import game_state_etag
+from quadradiusr_server.json_codec import json_response
 from quadradiusr_server.notification import NotificationService
-from quadradiusr_server.qrws_connection import QrwsConnection
 from quadradiusr_server.rest.auth import authorized_endpoint
 from quadradiusr_server.rest.mappers import game_to_json
 from quadradiusr_server.server import routes, QuadradiusRServer
@@ -18,17 +19,16 @@ from quadradiusr_server.utils import get_if_none_match_from_request
 
 
 class GameViewBase(web.View, metaclass=ABCMeta):
-    async def _get_game(
+    async def _get_game_players(
             self, auth_user: User,
-            repository: Repository) -> Game:
+            repository: Repository) -> GamePlayers:
         game_id = self.request.match_info.get('game_id')
-        game = await repository.game_repository.get_by_id(game_id)
-        if not game:
+        players = await repository.game_repository.get_players(game_id)
+        if not players:
             raise HTTPNotFound(reason='Game not found')
-        if auth_user.id_ != game.player_a_id_ and \
-                auth_user.id_ != game.player_b_id_:
+        if not players.is_player(auth_user.id_):
             raise HTTPForbidden(reason='You are not a part of this game, sorry')
-        return game
+        return players
 
 
 @routes.view('/game/{game_id}')
@@ -38,11 +38,16 @@ class GameView(GameViewBase, web.View):
     async def get(self, *, auth_user: User):
         server: QuadradiusRServer = self.request.app['server']
         repository: Repository = self.request.app['repository']
-        game = await self._get_game(auth_user, repository)
+        game_id = self.request.match_info.get('game_id')
+        game = await repository.game_repository.get_metadata(game_id)
+        if not game:
+            raise HTTPNotFound(reason='Game not found')
+        if auth_user.id_ not in (game.player_a_id_, game.player_b_id_):
+            raise HTTPForbidden(reason='You are not a part of this game, sorry')
 
-        return web.json_response({
+        return json_response({
             **game_to_json(game),
-            'ws_url': server.get_href('ws') + f'/game/{game.id_}/connect',
+            'ws_url': server.get_owner_href(game.id_, 'ws') + f'/game/{game.id_}/connect',
         })
 
 
@@ -54,20 +59,23 @@ class GameConnectView(GameViewBase, web.View):
         repository: Repository = self.request.app['repository']
         ns: NotificationService = self.request.app['notification']
 
+        # the game is held in memory of its owner only
+        server.redirect_to_owner(self.request.match_info.get('game_id'), self.request)
+
         if 'force' in self.request.rel_url.query:
             force = bool(self.request.rel_url.query['force'])
         else:
             force = False
 
         async with transaction_context(repository.database):
-            qrws = QrwsConnection()
+            qrws = server.create_qrws_connection()
             await qrws.prepare(self.request)
             user = await qrws.authorize(auth, repository)
-            game = await self._get_game(user, repository)
+            players = await self._get_game_players(user, repository)
 
             await repository.expunge_all()
 
-        game_in_progress = server.start_game(game)
+        game_in_progress = server.start_game(players)
         if game_in_progress.is_player_connected(user.id_) and not force:
             await qrws.send_error(
                 'You are already connected to this game',
@@ -88,18 +96,41 @@ class GameStateView(GameViewBase, web.View):
     @transactional
     @authorized_endpoint
     async def get(self, *, auth_user: User):
+        server: QuadradiusRServer = self.request.app['server']
         repository: Repository = self.request.app['repository']
-        game = await self._get_game(auth_user, repository)
-        game_state: GameState = game.game_state_
-        serialized, etag = game_state.serialize_with_etag_for(auth_user)
+
+        # with write-behind persistence, only the owner knows the latest state
+        server.redirect_to_owner(self.request.match_info.get('game_id'), self.request, 'http')
+
+        game_id = (await self._get_game_players(auth_user, repository)).game_id
 
         user_etag = get_if_none_match_from_request(self.request)
+
+        # prefer the live state, the persisted one may lag behind
+        game_in_progress = server.games.get(game_id)
+        if game_in_progress and game_in_progress.game_state:
+            # the state is serialized only when the client does not have it
+            if user_etag and game_in_progress.etag_for(auth_user.id_) == user_etag:
+                return web.Response(status=304)
+            serialized = await game_in_progress.get_serialized_state_for(auth_user.id_)
+            return web.Response(
+                body=serialized.to_json(),
+                content_type='application/json',
+                headers={
+                    'etag': f'"{serialized.etag}"',
+                })
+
+        rev = await repository.game_repository.get_rev(game_id)
+        etag = game_state_etag(game_id, rev, auth_user.id_)
         if user_etag and etag == user_etag:
             return web.Response(status=304)
 
-        return web.json_response({
-            'game_id': game.id_,
-            **serialized,
+        stored = await repository.game_repository.get_state(game_id)
+        game_state: GameState = stored.game_state
+        etag = game_state_etag(game_id, stored.rev, auth_user.id_)
+        return json_response({
+            'game_id': game_id,
+            **game_state.serialize_for(auth_user.id_),
         }, headers={
             'etag': f'"{etag}"',
         })
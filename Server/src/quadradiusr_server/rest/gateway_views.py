@@ -4,8 +4,8 @@ from quadradiusr_server.auth import Auth
 from quadradiusr_server.db.repository import Repository
 from quadradiusr_server.db.transactions import transactional
 from quadradiusr_server.gateway import GatewayConnection
+from quadradiusr_server.json_codec import json_response
 from quadradiusr_server.notification import NotificationService
-from quadradiusr_server.qrws_connection import QrwsConnection
 from quadradiusr_server.server import routes, QuadradiusRServer
 from quadradiusr_server.utils import is_request_websocket_upgradable
 
@@ -20,11 +20,11 @@ class GatewayView(web.View):
         ns: NotificationService = self.request.app['notification']
 
         if not is_request_websocket_upgradable(self.request):
-            return web.json_response({
+            return json_response({
                 'url': server.get_href('ws') + '/gateway',
             })
 
-        qrws = QrwsConnection()
+        qrws = server.create_qrws_connection()
         await qrws.prepare(self.request)
         user = await qrws.authorize(auth, repository)
 
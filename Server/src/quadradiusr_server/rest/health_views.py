@@ -1,11 +1,17 @@
+import dataclasses
+
 from aiohttp import web
 
-from quadradiusr_server.server import routes
+from quadradiusr_server.json_codec import json_response
+from quadradiusr_server.server import routes, QuadradiusRServer
 
 
 @routes.view('/health')
 class HealthView(web.View):
     async def get(self):
-        return web.json_response({
+        server: QuadradiusRServer = self.request.app['server']
+        return json_response({
             'status': 'up',
+            'qrws': dataclasses.asdict(server.qrws_stats),
+            'password_hashing': dataclasses.asdict(server.auth.hashing_stats),
         })
@@ -9,9 +9,9 @@ from quadradiusr_server.constants import QrwsCloseCode
 from quadradiusr_server.db.base import Lobby, User
 from quadradiusr_server.db.repository import Repository
 from quadradiusr_server.db.transactions import transactional, transaction_context
+from quadradiusr_server.json_codec import json_response
 from quadradiusr_server.lobby import LobbyConnection
 from quadradiusr_server.notification import NotificationService
-from quadradiusr_server.qrws_connection import QrwsConnection
 from quadradiusr_server.rest.auth import authorized_endpoint
 from quadradiusr_server.rest.mappers import lobby_message_to_json, lobby_to_json
 from quadradiusr_server.server import routes, QuadradiusRServer
@@ -36,9 +36,9 @@ class LobbiesView(web.View):
         repository: Repository = self.request.app['repository']
         lobbies = await repository.lobby_repository.get_all()
 
-        return web.json_response([lobby_to_json(
+        return json_response([lobby_to_json(
             lobby,
-            href_ws=server.get_href('ws'),
+            href_ws=server.get_owner_href(lobby.id_, 'ws'),
         ) for lobby in lobbies])
 
 
@@ -49,12 +49,16 @@ class LobbyView(LobbyViewBase, web.View):
     async def get(self):
         server: QuadradiusRServer = self.request.app['server']
         repository: Repository = self.request.app['repository']
+
+        # the lobby is held in memory of its owner only
+        server.redirect_to_owner(self.request.match_info.get('lobby_id'), self.request, 'http')
+
         lobby = await self._get_lobby(repository)
         live_lobby = server.start_lobby(lobby)
         players = await live_lobby.get_players()
-        return web.json_response(lobby_to_json(
+        return json_response(lobby_to_json(
             lobby,
-            href_ws=server.get_href('ws'),
+            href_ws=server.get_owner_href(lobby.id_, 'ws'),
             players=players,
         ))
 
@@ -67,14 +71,18 @@ class LobbyConnectView(LobbyViewBase, web.View):
         auth: Auth = self.request.app['auth']
         ns: NotificationService = self.request.app['notification']
 
+        # the lobby is held in memory of its owner only
+        server.redirect_to_owner(self.request.match_info.get('lobby_id'), self.request)
+
         if 'force' in self.request.rel_url.query:
             force = bool(self.request.rel_url.query['force'])
         else:
             force = False
+        coalesce_presence = self.request.rel_url.query.get('presence') == 'coalesced'
 
         async with transaction_context(repository.database):
             lobby = await self._get_lobby(repository)
-            qrws = QrwsConnection()
+            qrws = server.create_qrws_connection()
             await qrws.prepare(self.request)
             user = await qrws.authorize(auth, repository)
 
@@ -87,7 +95,8 @@ class LobbyConnectView(LobbyViewBase, web.View):
 
             lobby_conn = LobbyConnection(
                 live_lobby, qrws, user,
-                ns, repository)
+                ns, repository,
+                coalesce_presence=coalesce_presence)
             await live_lobby.join(lobby_conn)
 
         try:
@@ -105,6 +114,9 @@ class LobbyMessagesView(LobbyViewBase, web.View):
         server: QuadradiusRServer = self.request.app['server']
         repository: Repository = self.request.app['repository']
 
+        # the lobby is held in memory of its owner only
+        server.redirect_to_owner(self.request.match_info.get('lobby_id'), self.request, 'http')
+
         lobby = await self._get_lobby(repository)
         live_lobby = server.start_lobby(lobby)
 
@@ -133,5 +145,5 @@ class LobbyMessagesView(LobbyViewBase, web.View):
             before=before,
             limit=limit,
         )
-        return web.json_response([
+        return json_response([
             lobby_message_to_json(lm) for lm in messages])
@@ -4,6 +4,7 @@ from aiohttp import web
 from aiohttp.web_exceptions import HTTPNotFound
 
 from quadradiusr_server.db.transactions import transactional
+from quadradiusr_server.json_codec import json_response
 from quadradiusr_server.powers import PowerDefinition
 from quadradiusr_server.rest.auth import authorized_endpoint
 from quadradiusr_server.rest.mappers import power_definition_to_json
@@ -29,7 +30,7 @@ class PowerDefinitionsView(web.View):
         server: QuadradiusRServer = self.request.app['server']
 
         power_definitions = server.config.game.get_power_definitions().values()
-        return web.json_response([power_definition_to_json(
+        return json_response([power_definition_to_json(
             power_definition,
         ) for power_definition in power_definitions])
 
@@ -40,6 +41,6 @@ class PowerDefinitionView(PowerDefinitionViewBase, web.View):
     @authorized_endpoint
     async def get(self):
         power_definition = await self._get_power_definition()
-        return web.json_response(power_definition_to_json(
+        return json_response(power_definition_to_json(
             power_definition,
         ))
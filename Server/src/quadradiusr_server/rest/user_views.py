@@ -8,6 +8,7 @@ from aiohttp.web_exceptions import HTTPBadRequest, HTTPConflict
 from quadradiusr_server.auth import User, Auth
 from quadradiusr_server.db.repository import Repository
 from quadradiusr_server.db.transactions import transactional
+from quadradiusr_server.json_codec import json_response, read_json
 from quadradiusr_server.rest.auth import authorized_endpoint
 from quadradiusr_server.rest.mappers import user_to_json
 from quadradiusr_server.server import routes
@@ -21,12 +22,16 @@ class UsersView(web.View):
         auth: Auth = self.request.app['auth']
 
         try:
-            body = await self.request.json()
+            body = await read_json(self.request)
             username = str(body['username'])
             password = str(body['password'])
         except (JSONDecodeError, KeyError):
             raise HTTPBadRequest(reason='Malformed request body')
 
+        # hash before querying, so that the transaction
+        # is not held open while waiting for the hash
+        password_hash = await auth.hash_password_async(password.encode('utf-8'))
+
         existing_user = await repository.user_repository.get_by_username(username)
         if existing_user is not None:
             raise HTTPConflict(reason='User already exists')
@@ -34,7 +39,7 @@ class UsersView(web.View):
         user = User(
             id_=str(uuid.uuid4()),
             username_=username,
-            password_=auth.hash_password(password.encode('utf-8')),
+            password_=password_hash,
         )
         await repository.user_repository.add(user)
         logging.info(f'New user created: {user.friendly_name}')
@@ -54,4 +59,4 @@ class UserView(web.View):
             return web.Response(status=403)
 
         json = user_to_json(auth_user)
-        return web.json_response(json)
+        return json_response(json)
@@ -0,0 +1,63 @@
+import bisect
+import hashlib
+from typing import List, Optional
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key.encode(), digest_size=8).digest(),
+        byteorder='big')
+
+
+class ConsistentHashRing:
+    """
+    Assigns keys to nodes, so that adding or removing a node
+    reassigns only the keys of that node.
+    """
+
+    def __init__(self, nodes: List[str], *, replicas: int = 160) -> None:
+        ring = sorted(
+            (_hash(f'{node}#{i}'), node)
+            for node in set(nodes)
+            for i in range(replicas))
+        self._hashes = [h for h, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    def __len__(self) -> int:
+        return len(set(self._nodes))
+
+    def get_node(self, key: str) -> Optional[str]:
+        if not self._nodes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[i]
+
+
+class OwnerRouter:
+    """
+    Decides which worker owns a game or a lobby.
+
+    Live games and lobbies are held in the memory of their owner,
+    so all connections to them have to be made to the owner.
+    Workers are identified by their hrefs (see ``server.href``).
+    Without workers, everything is owned by the local server.
+    """
+
+    def __init__(self, workers: List[str], local_worker: Optional[str]) -> None:
+        if workers and local_worker not in workers:
+            raise ValueError(
+                f'The href of this server ({local_worker}) '
+                f'is not one of the workers: {workers}')
+        self.local_worker = local_worker
+        self._ring = ConsistentHashRing(workers)
+
+    def get_owner(self, key: str) -> Optional[str]:
+        """
+        Returns:
+            the href of the owner, ``None`` when it is the local server
+        """
+        owner = self._ring.get_node(key)
+        return owner if owner != self.local_worker else None
+
+    def is_local(self, key: str) -> bool:
+        return self.get_owner(key) is None
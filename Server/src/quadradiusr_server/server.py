@@ -8,14 +8,20 @@ from aiohttp import web
 from aiohttp.web_runner import AppRunner, TCPSite
 
 from quadradiusr_server.auth import Auth
-from quadradiusr_server.config import ServerConfig
+from quadradiusr_server.config import ServerConfig, NotificationConfig
 from quadradiusr_server.cron import Cron, SetupService
-from quadradiusr_server.db.base import Game, Lobby
+from quadradiusr_server.db.base import Lobby
 from quadradiusr_server.db.database_engine import DatabaseEngine
+from quadradiusr_server.db.game_repository import GamePlayers
 from quadradiusr_server.db.repository import Repository
 from quadradiusr_server.game import GameInProgress
+from quadradiusr_server.json_codec import set_codec
 from quadradiusr_server.lobby import LiveLobby
-from quadradiusr_server.notification import NotificationService
+from quadradiusr_server.notification import NotificationService, NotificationBackend, \
+    LocalNotificationBackend
+from quadradiusr_server.notification_relay import RelayNotificationBackend
+from quadradiusr_server.qrws_connection import QrwsConnection, QrwsStats
+from quadradiusr_server.routing import OwnerRouter
 from quadradiusr_server.utils import import_submodules
 
 routes = web.RouteTableDef()
@@ -25,15 +31,37 @@ class ServerNotStartedException(Exception):
     pass
 
 
+def create_event_loop(name: str) -> asyncio.AbstractEventLoop:
+    if name == 'asyncio':
+        return asyncio.new_event_loop()
+    elif name == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            logging.warning('uvloop is not installed, falling back to asyncio')
+            return asyncio.new_event_loop()
+        return uvloop.new_event_loop()
+    else:
+        raise ValueError(f'Unknown event loop: {name}')
+
+
 class QuadradiusRServer:
     def __init__(self, config: ServerConfig) -> None:
         self.config: ServerConfig = config
-        self.notification_service = NotificationService()
+        set_codec(config.json_codec)
+        self.notification_service = NotificationService(
+            self._create_notification_backend(config.notification))
         self.database = DatabaseEngine(config.database)
         self.repository = Repository(self.database)
-        self.auth = Auth(config.auth, self.repository)
-        self.cron = Cron(config.cron, self.repository, self.notification_service)
+        self.auth = Auth(config.auth, self.repository, self.notification_service)
+        self.cron = Cron(
+            config.cron, self.repository,
+            self.notification_service, self.auth)
         self.setup_service = SetupService(self.repository)
+        self.qrws_stats = QrwsStats()
+        self.router = OwnerRouter(
+            config.cluster.workers,
+            config.cluster.worker_href or config.href)
         self.app = web.Application()
         self.app['server'] = self
         self.app['auth'] = self.auth
@@ -53,12 +81,24 @@ class QuadradiusRServer:
 
         self.runner: Optional[AppRunner] = None
         self.site: Optional[TCPSite] = None
+        self.worker_site: Optional[TCPSite] = None
 
         self.lobbies: Dict[str, LiveLobby] = dict()
         self.games: Dict[str, GameInProgress] = dict()
         self.gateway_connections: Dict[str, List[object]] = \
             defaultdict(lambda: [])
 
+    @staticmethod
+    def _create_notification_backend(config: NotificationConfig) -> NotificationBackend:
+        if config.backend == 'local':
+            return LocalNotificationBackend()
+        elif config.backend == 'relay':
+            if not config.relay_path:
+                raise ValueError('Notification relay path is not set')
+            return RelayNotificationBackend(config.relay_path)
+        else:
+            raise ValueError(f'Unknown notification backend: {config.backend}')
+
     def _ensure_started(self):
         if not self.site:
             raise ServerNotStartedException()
@@ -99,8 +139,30 @@ class QuadradiusRServer:
         else:
             return self.get_url(protocol)
 
+    def get_owner_href(self, key: str, protocol: str = 'http') -> str:
+        """
+        Returns the href of the worker which owns the game or the lobby.
+        """
+        owner = self.router.get_owner(key)
+        if owner is None:
+            if not self.config.cluster.workers:
+                return self.get_href(protocol)
+            # server.href is shared by all workers
+            owner = self.router.local_worker
+        return f'{self._get_scheme(protocol)}://{owner}'
+
+    def redirect_to_owner(self, key: str, request: web.Request, protocol: str = 'ws'):
+        """
+        Redirects the request to the worker which owns
+        the game or the lobby, unless it is this one.
+        """
+        if not self.router.is_local(key):
+            raise web.HTTPTemporaryRedirect(
+                self.get_owner_href(key, protocol) + str(request.rel_url))
+
     async def start(self):
         await self.database.initialize()
+        await self.notification_service.start()
 
         self.runner = AppRunner(self.app)
         await self.runner.setup()
@@ -118,9 +180,23 @@ class QuadradiusRServer:
             # TODO ssl_context=ssl_context,
         )
 
-        await self.setup_service.run_setup_jobs()
-        await self.cron.register()
+        if cfg.cluster.worker_port:
+            self.worker_site = TCPSite(
+                runner=self.runner,
+                host=cfg.host,
+                port=cfg.cluster.worker_port,
+                shutdown_timeout=cfg.shutdown_timeout,
+                backlog=cfg.backlog,
+                reuse_address=cfg.reuse_address,
+            )
+
+        if cfg.cluster.primary:
+            await self.setup_service.run_setup_jobs()
+        await self.auth.sync_revoked_tokens()
+        await self.cron.register(primary=cfg.cluster.primary)
         await self.site.start()
+        if self.worker_site:
+            await self.worker_site.start()
 
         addr = self.address
         logging.info(f'Server started at {addr[0]}:{addr[1]}')
@@ -130,8 +206,20 @@ class QuadradiusRServer:
 
     async def shutdown(self):
         logging.info('Server shutdown initiated')
+        await self.cron.stop()
         if self.runner:
             await self.runner.cleanup()
+        try:
+            await self.auth.flush_token_accesses()
+        except Exception:
+            logging.exception('Failed to save token accesses')
+        self.auth.shutdown()
+        for game in self.games.values():
+            try:
+                await game.flush()
+            except Exception:
+                logging.exception(f'Failed to save game {game.game_id}')
+        await self.notification_service.stop()
         if self.database:
             await self.database.dispose()
         if self.config.embedded_mode and os.path.isfile('.server_port'):
@@ -144,7 +232,7 @@ class QuadradiusRServer:
             await asyncio.sleep(3600)
 
     def run(self) -> int:
-        loop = asyncio.new_event_loop()
+        loop = create_event_loop(self.config.event_loop)
         try:
             loop.run_until_complete(self._run_async())
             return 0
@@ -155,6 +243,11 @@ class QuadradiusRServer:
         finally:
             loop.close()
 
+    def create_qrws_connection(self) -> QrwsConnection:
+        return QrwsConnection(
+            config=self.config.qrws,
+            stats=self.qrws_stats)
+
     def register_gateway(self, gateway):
         user_id = gateway.user_id
         self.gateway_connections[user_id].append(gateway)
@@ -167,14 +260,15 @@ class QuadradiusRServer:
         if lobby.id_ not in self.lobbies.keys():
             self.lobbies[lobby.id_] = LiveLobby(
                 lobby.id_, self.repository,
-                self.notification_service)
+                self.notification_service,
+                self.config.lobby)
         return self.lobbies[lobby.id_]
 
-    def start_game(self, game: Game) -> GameInProgress:
-        if game.id_ not in self.games.keys():
-            self.games[game.id_] = GameInProgress(
-                game, self.repository, self.config.game)
-        return self.games[game.id_]
+    def start_game(self, players: GamePlayers) -> GameInProgress:
+        if players.game_id not in self.games.keys():
+            self.games[players.game_id] = GameInProgress(
+                players, self.repository, self.config.game)
+        return self.games[players.game_id]
 
 
 # importing submodules automatically registers endpoints
@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import hmac
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+# signed tokens start with the version of their format,
+# which distinguishes them from random tokens
+VERSION = 'v1'
+
+
+@dataclass
+class TokenClaims:
+    token_id: str
+    user_id: str
+    username: str
+    expires_at: datetime
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class TokenSigner:
+    """
+    Issues and verifies tokens which carry their claims,
+    signed using HMAC-SHA256, so that they can be verified
+    without accessing the database.
+
+    A token has the form ``v1.<claims>.<signature>``,
+    where both parts are encoded using URL-safe base64.
+    """
+
+    def __init__(self, secret: bytes) -> None:
+        if not secret:
+            raise ValueError('Token secret must not be empty')
+        self._secret = secret
+
+    def _sign(self, message: str) -> str:
+        return _b64encode(hmac.new(self._secret, message.encode(), hashlib.sha256).digest())
+
+    @staticmethod
+    def is_signed_token(token: str) -> bool:
+        return token.startswith(VERSION + '.')
+
+    def sign(self, claims: TokenClaims) -> str:
+        payload = _b64encode(json.dumps({
+            't': claims.token_id,
+            'u': claims.user_id,
+            'n': claims.username,
+            'e': int(claims.expires_at.timestamp()),
+        }, separators=(',', ':')).encode())
+        message = f'{VERSION}.{payload}'
+        return f'{message}.{self._sign(message)}'
+
+    def verify(self, token: str) -> Optional[TokenClaims]:
+        """
+        Returns:
+            claims of the token, or ``None`` if its signature is invalid;
+            the expiration is not checked
+        """
+        # signed tokens are always ASCII, compare_digest rejects other strings
+        if not token.isascii():
+            return None
+        message, _, signature = token.rpartition('.')
+        if not self.is_signed_token(message) or \
+                not hmac.compare_digest(self._sign(message), signature):
+            return None
+        try:
+            claims = json.loads(_b64decode(message[len(VERSION) + 1:]))
+            return TokenClaims(
+                token_id=claims['t'],
+                user_id=claims['u'],
+                username=claims['n'],
+                expires_at=datetime.fromtimestamp(claims['e'], tz=timezone.utc),
+            )
+        except (ValueError, KeyError, TypeError, OverflowError, OSError):
+            return None
@@ -0,0 +1,196 @@
+import asyncio
+import copy
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+from multiprocessing.process import BaseProcess
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+from sqlalchemy.engine import make_url
+
+from quadradiusr_server import logger
+from quadradiusr_server.config import ServerConfig
+from quadradiusr_server.cron import SetupService
+from quadradiusr_server.db.database_engine import DatabaseEngine
+from quadradiusr_server.db.repository import Repository
+from quadradiusr_server.notification_relay import NotificationRelay
+
+
+def _run_worker(config: ServerConfig, verbosity: int):
+    logger.configure_logger(verbosity)
+    # the supervisor decides when workers shut down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    from quadradiusr_server.server import QuadradiusRServer
+    server = QuadradiusRServer(config)
+    sys.exit(server.run())
+
+
+class WorkerSupervisor:
+    """
+    Runs the server in many worker processes.
+
+    All workers listen on the configured port (using ``SO_REUSEPORT``),
+    so that the kernel distributes connections between them.
+    Worker ``i`` additionally listens on ``port + 1 + i``,
+    which is used for connections to games and lobbies it owns
+    (see :class:`quadradiusr_server.routing.OwnerRouter`).
+    Notifications are exchanged through a :class:`NotificationRelay`
+    run by the supervisor.
+
+    Workers which exit are restarted until the supervisor is interrupted.
+    """
+
+    def __init__(
+            self, config: ServerConfig, workers: int, *,
+            verbosity: int = 0,
+            restart_delay: float = 1.0,
+            poll_interval: float = 0.5) -> None:
+        if workers < 1:
+            raise ValueError(f'Invalid number of workers: {workers}')
+        if not config.port:
+            raise ValueError('Workers require a fixed port')
+        if self._is_memory_database(config.database.url):
+            raise ValueError(
+                'Workers cannot share an in-memory database, '
+                'set server.database.url')
+
+        self.config = config
+        self.workers = workers
+        self.verbosity = verbosity
+        self.restart_delay = restart_delay
+        self.poll_interval = poll_interval
+
+        self._context = multiprocessing.get_context('spawn')
+        self._processes: List[Optional[BaseProcess]] = [None] * workers
+        self._stopping: Optional[asyncio.Event] = None
+        self._tmp_dir: Optional[str] = None
+
+    @staticmethod
+    def _is_memory_database(url: str) -> bool:
+        url = make_url(url)
+        return url.get_backend_name() == 'sqlite' and \
+            url.database in (None, '', ':memory:')
+
+    def _get_worker_host(self) -> str:
+        if self.config.href:
+            return urlsplit(f'//{self.config.href}').hostname
+        if self.config.host in ('', '0.0.0.0', '::'):
+            logging.warning(
+                'Workers are referenced as localhost, '
+                'set server.href to make them reachable from other hosts')
+            return 'localhost'
+        return self.config.host
+
+    def create_worker_configs(self, relay_path: str) -> List[ServerConfig]:
+        host = self._get_worker_host()
+        ports = [self.config.port + 1 + i for i in range(self.workers)]
+        hrefs = [f'{host}:{port}' for port in ports]
+
+        configs = []
+        for i in range(self.workers):
+            config = copy.deepcopy(self.config)
+            config.reuse_port = True
+            # the supervisor initializes the database
+            config.database.create_metadata = False
+            config.database.migrate = False
+            config.notification.backend = 'relay'
+            config.notification.relay_path = relay_path
+            config.cluster.workers = hrefs
+            config.cluster.worker_href = hrefs[i]
+            config.cluster.worker_port = ports[i]
+            config.cluster.primary = i == 0
+            configs.append(config)
+        return configs
+
+    async def _initialize_database(self):
+        database = DatabaseEngine(self.config.database)
+        try:
+            await database.initialize()
+            await SetupService(Repository(database)).run_setup_jobs()
+        finally:
+            await database.dispose()
+
+    def _start_worker(self, index: int, config: ServerConfig):
+        process = self._context.Process(
+            target=_run_worker,
+            args=(config, self.verbosity),
+            name=f'worker-{index}',
+            # daemonic processes cannot have children (auth.hash_executor),
+            # workers are terminated and joined in _stop_workers anyway
+            daemon=False)
+        process.start()
+        self._processes[index] = process
+        logging.info(f'Started worker {index} (pid {process.pid})')
+
+    async def _supervise(self, configs: List[ServerConfig]):
+        while not self._stopping.is_set():
+            for index, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+                logging.error(
+                    f'Worker {index} (pid {process.pid}) exited '
+                    f'with code {process.exitcode}, restarting')
+                process.close()
+                self._processes[index] = None
+                await asyncio.sleep(self.restart_delay)
+                if self._stopping.is_set():
+                    return
+                self._start_worker(index, configs[index])
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _stop_workers(self):
+        logging.info('Stopping workers')
+        loop = asyncio.get_running_loop()
+        processes = [p for p in self._processes if p is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        # each worker has its own shutdown timeout
+        timeout = self.config.shutdown_timeout + 5
+        for process in processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logging.warning(f'Worker {process.name} did not stop, killing it')
+                process.kill()
+                await loop.run_in_executor(None, process.join)
+        logging.info('Workers stopped')
+
+    def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def run_async(self):
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        self._tmp_dir = tempfile.mkdtemp(prefix='quadradiusr-')
+        relay = NotificationRelay(os.path.join(self._tmp_dir, 'relay.sock'))
+        try:
+            await self._initialize_database()
+            await relay.start()
+
+            configs = self.create_worker_configs(relay.path)
+            for index, config in enumerate(configs):
+                self._start_worker(index, config)
+            await self._supervise(configs)
+        finally:
+            await self._stop_workers()
+            await relay.stop()
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def run(self) -> int:
+        logging.info(f'Starting {self.workers} workers')
+        asyncio.run(self.run_async())
+        return 0
@@ -1,3 +1,4 @@
+import dataclasses
 import importlib
 import inspect
 import pkgutil
@@ -6,7 +7,6 @@ from typing import Optional, Type
 
 from aiohttp.abc import Request
 from isodate import parse_datetime
-from jsondiff import CompactJsonDiffSyntax, symbols
 
 
 def import_submodules(package, recursive=True):
@@ -32,6 +32,33 @@ def import_class(full_name: str, *, subtype_of: Type = None) -> Type:
     return clazz
 
 
+def add_slots(cls):
+    """
+    Recreates a dataclass with ``__slots__``, as ``@dataclass(slots=True)``
+    is not available before Python 3.10. Must be placed above ``@dataclass``.
+
+    Instances pickled before the class had slots can still be unpickled.
+    """
+    field_names = tuple(f.name for f in dataclasses.fields(cls))
+    cls_dict = dict(cls.__dict__)
+    cls_dict['__slots__'] = field_names
+    for name in field_names:
+        # remove default values, they are kept by __init__ anyway
+        cls_dict.pop(name, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            # (__dict__, slots)
+            state = {**(state[0] or {}), **(state[1] or {})}
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    cls_dict.setdefault('__setstate__', __setstate__)
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
 def can_pass_argument(f, name: str):
     f_signature = inspect.signature(f)
     for param in f_signature.parameters.values():
@@ -81,12 +108,29 @@ def parse_iso_datetime_tz(string: str):
     return dt
 
 
-class SimpleJsonDiffSyntax(CompactJsonDiffSyntax):
-    def emit_dict_diff(self, a, b, s, added, changed, removed):
-        if s == 1.0:
-            return {}
-        else:
-            changed.update(added)
-            if removed:
-                changed[symbols.delete] = list(removed.keys())
-            return changed
+DIFF_DELETE = '$delete'
+
+
+def diff_dicts(a: dict, b: dict) -> dict:
+    """
+    Computes the difference between two JSON objects.
+
+    Nested objects are compared recursively, other values
+    are replaced as a whole. Removed keys are listed under ``$delete``.
+    """
+    diff = {}
+    for key, b_value in b.items():
+        if key not in a:
+            diff[key] = b_value
+            continue
+        a_value = a[key]
+        if isinstance(a_value, dict) and isinstance(b_value, dict):
+            nested_diff = diff_dicts(a_value, b_value)
+            if nested_diff:
+                diff[key] = nested_diff
+        elif a_value != b_value:
+            diff[key] = b_value
+    removed = [key for key in a.keys() if key not in b]
+    if removed:
+        diff[DIFF_DELETE] = removed
+    return diff
@@ -0,0 +1,164 @@
+import pickle
+from datetime import datetime, timezone
+from unittest import IsolatedAsyncioTestCase
+
+from sqlalchemy import insert, select, type_coerce, LargeBinary, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+
+from quadradiusr_server.config import DatabaseConfig
+from quadradiusr_server.db.base import Game, GameMove, User
+from quadradiusr_server.db.database_engine import DatabaseEngine
+from quadradiusr_server.db.game_repository import GameRepository, GamePlayers
+from quadradiusr_server.db.transactions import transaction_context
+from quadradiusr_server.game_journal import ActionJournal
+from quadradiusr_server.game_state import GameState
+from quadradiusr_server.game_state_codec import is_encoded_game_state, encode_changes
+
+
+class TestGameRepository(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.database = DatabaseEngine(DatabaseConfig(
+            create_metadata=True,
+            hide_parameters=False,
+        ))
+        await self.database.initialize()
+        self.repo = GameRepository(self.database)
+
+    async def asyncTearDown(self) -> None:
+        await self.database.dispose()
+
+    def _move(self, game_state: GameState, rev: int, xy_from, xy_to) -> GameMove:
+        board = game_state.board
+        piece = board.get_piece_on(board.get_tile_at(*xy_from).id)
+        tile = board.get_tile_at(*xy_to)
+        journal = ActionJournal()
+        with game_state.journaled(journal):
+            game_state.move_piece(piece.id, tile.id)
+        return GameMove(
+            game_id_='game',
+            rev_=rev,
+            player_id_=piece.owner_id,
+            action_='move',
+            piece_id_=piece.id,
+            tile_id_=tile.id,
+            changes_=encode_changes(journal.changes),
+            made_at_=datetime.now(timezone.utc),
+        )
+
+    async def test_replay(self):
+        game_state = GameState.initial('player_a', 'player_b')
+        async with transaction_context(self.database):
+            await self.repo.add(Game(
+                id_='game',
+                player_a_id_='player_a',
+                player_b_id_='player_b',
+                expires_at_=datetime.now(timezone.utc),
+                game_state_=game_state,
+            ))
+        async with transaction_context(self.database):
+            initial_rev = await self.repo.get_rev('game')
+
+        move1 = self._move(game_state, initial_rev + 1, (0, 1), (0, 2))
+        move2 = self._move(game_state, initial_rev + 2, (1, 6), (1, 5))
+        async with transaction_context(self.database):
+            await self.repo.add_moves([move1, move2])
+
+        async with transaction_context(self.database):
+            self.assertEqual(initial_rev + 2, await self.repo.get_rev('game'))
+            stored = await self.repo.get_state('game')
+            self.assertEqual(initial_rev + 2, stored.rev)
+            self.assertEqual(initial_rev, stored.snapshot_rev)
+            self.assertEqual(game_state.serialize_for('player_a'),
+                             stored.game_state.serialize_for('player_a'))
+            self.assertEqual(
+                ['move', 'move'],
+                [move.action_ for move in await self.repo.get_moves('game')])
+
+        # moves cannot be stored twice
+        with self.assertRaises(StaleDataError):
+            async with transaction_context(self.database):
+                await self.repo.add_moves([move2])
+
+        # other integrity errors are not conflicts
+        with self.assertRaises(IntegrityError):
+            async with transaction_context(self.database):
+                await self.repo.add_moves([GameMove(
+                    game_id_='game',
+                    rev_=initial_rev + 3,
+                    player_id_='player_a',
+                    action_=None,
+                    changes_=encode_changes([]),
+                    made_at_=datetime.now(timezone.utc),
+                )])
+
+        # only the moves after the snapshot are replayed
+        move3 = self._move(game_state, initial_rev + 3, (0, 2), (0, 3))
+        async with transaction_context(self.database):
+            await self.repo.add_moves([move3])
+            await self.repo.save_state(
+                'game', game_state,
+                expected_rev=initial_rev,
+                rev=initial_rev + 3)
+        async with transaction_context(self.database):
+            stored = await self.repo.get_state('game')
+            self.assertEqual(initial_rev + 3, stored.rev)
+            self.assertEqual(initial_rev + 3, stored.snapshot_rev)
+            self.assertEqual(game_state.serialize_for('player_a'),
+                             stored.game_state.serialize_for('player_a'))
+
+    async def test_legacy_state(self):
+        game_state = GameState.initial('player_a', 'player_b')
+        async with transaction_context(self.database) as db_session:
+            await db_session.execute(insert(Game).values(
+                id_='game',
+                rev_=3,
+                player_a_id_='player_a',
+                player_b_id_='player_b',
+                expires_at_=datetime.now(timezone.utc),
+                game_state_=type_coerce(pickle.dumps(game_state), LargeBinary),
+            ))
+
+        async def get_raw_state():
+            async with transaction_context(self.database) as db_session:
+                return (await db_session.execute(
+                    select(type_coerce(Game.game_state_, LargeBinary)))).scalar_one()
+
+        # pickled states are still loaded before they are migrated
+        async with transaction_context(self.database):
+            stored = await self.repo.get_state('game')
+        self.assertEqual(3, stored.rev)
+        self.assertEqual(game_state.serialize_for('player_a'),
+                         stored.game_state.serialize_for('player_a'))
+        self.assertFalse(is_encoded_game_state(await get_raw_state()))
+
+    async def test_projections(self):
+        async with transaction_context(self.database) as db_session:
+            for user_id in ['player_a', 'player_b']:
+                db_session.add(User(id_=user_id, username_=user_id, password_=''))
+            await self.repo.add(Game(
+                id_='game',
+                player_a_id_='player_a',
+                player_b_id_='player_b',
+                expires_at_=datetime.now(timezone.utc),
+                game_state_=GameState.initial('player_a', 'player_b'),
+            ))
+
+        async with transaction_context(self.database):
+            players = await self.repo.get_players('game')
+            self.assertEqual(GamePlayers(
+                game_id='game',
+                player_a_id='player_a',
+                player_b_id='player_b',
+            ), players)
+            self.assertTrue(players.is_player('player_b'))
+            self.assertFalse(players.is_player('player_c'))
+            self.assertIsNone(await self.repo.get_players('no_game'))
+
+        async with transaction_context(self.database):
+            game = await self.repo.get_metadata('game')
+            self.assertEqual('player_a', game.player_a_.username_)
+            self.assertEqual('player_b', game.player_b_.username_)
+            self.assertIn('game_state_', inspect(game).unloaded)
+            self.assertIsNone(await self.repo.get_metadata('no_game'))
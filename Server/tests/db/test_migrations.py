@@ -0,0 +1,118 @@
+import pickle
+from datetime import datetime, timezone
+from unittest import IsolatedAsyncioTestCase
+
+from sqlalchemy import inspect, text, insert, select, type_coerce, LargeBinary
+
+from quadradiusr_server.config import DatabaseConfig
+from quadradiusr_server.db.base import Base, Game, GameMove
+from quadradiusr_server.db.database_engine import DatabaseEngine
+from quadradiusr_server.db.game_repository import GameRepository
+from quadradiusr_server.db.migrations import migrate, get_schema_version, LATEST_VERSION, \
+    MigrationError
+from quadradiusr_server.db.transactions import transaction_context
+from quadradiusr_server.game_journal import ActionJournal
+from quadradiusr_server.game_state import GameState
+from quadradiusr_server.game_state_codec import is_encoded_game_state, is_encoded_changes
+
+
+def _get_schema(conn):
+    inspector = inspect(conn)
+    return {
+        table: sorted(index['name'] for index in inspector.get_indexes(table))
+        for table in inspector.get_table_names()
+    }
+
+
+class TestMigrations(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.database = DatabaseEngine(DatabaseConfig(
+            create_metadata=True,
+            migrate=False,
+        ))
+        await self.database.initialize()
+
+    async def asyncTearDown(self) -> None:
+        await self.database.dispose()
+
+    async def test_migrate(self):
+        async with self.database.engine.begin() as conn:
+            latest_schema = await conn.run_sync(_get_schema)
+
+            # recreate the schema of the first release
+            await conn.execute(text('DROP TABLE game_move'))
+            await conn.execute(text('DROP TABLE revoked_token'))
+            for table in Base.metadata.tables.values():
+                for index in table.indexes:
+                    if index.table.name not in ('game_move', 'revoked_token'):
+                        await conn.execute(text(f'DROP INDEX {index.name}'))
+            await conn.execute(insert(Base.metadata.tables['lobby']).values(
+                id_='lobby', name_='Lobby'))
+            self.assertEqual(0, await conn.run_sync(get_schema_version))
+
+        self.assertEqual(LATEST_VERSION, await self.database.migrate())
+        self.assertEqual(0, await self.database.migrate())
+
+        async with self.database.engine.begin() as conn:
+            self.assertEqual(LATEST_VERSION, await conn.run_sync(get_schema_version))
+            schema = await conn.run_sync(_get_schema)
+            del schema['schema_version']
+            self.assertEqual(latest_schema, schema)
+            self.assertIn('ix_access_token_token_', schema['access_token'])
+            lobbies = await conn.execute(text('SELECT id_ FROM lobby'))
+            self.assertEqual(['lobby'], list(lobbies.scalars()))
+
+    async def test_legacy_game_data(self):
+        game_state = GameState.initial('player_a', 'player_b')
+        pickled_state = pickle.dumps(game_state)
+        board = game_state.board
+        journal = ActionJournal()
+        with game_state.journaled(journal):
+            game_state.move_piece(board.get_piece_at(0, 1).id, board.get_tile_at(0, 2).id)
+
+        async with self.database.engine.begin() as conn:
+            await conn.execute(insert(Game).values(
+                id_='game',
+                rev_=3,
+                player_a_id_='player_a',
+                player_b_id_='player_b',
+                expires_at_=datetime.now(timezone.utc),
+                game_state_=type_coerce(pickled_state, LargeBinary),
+            ))
+            await conn.execute(insert(GameMove).values(
+                game_id_='game',
+                rev_=4,
+                player_id_='player_a',
+                action_='move',
+                changes_=pickle.dumps(journal.changes),
+                made_at_=datetime.now(timezone.utc),
+            ))
+
+        self.assertEqual(LATEST_VERSION, await self.database.migrate())
+
+        async with self.database.engine.begin() as conn:
+            raw_state = (await conn.execute(
+                select(type_coerce(Game.game_state_, LargeBinary)))).scalar_one()
+            raw_changes = (await conn.execute(select(GameMove.changes_))).scalar_one()
+        self.assertTrue(is_encoded_game_state(raw_state))
+        self.assertTrue(is_encoded_changes(raw_changes))
+
+        async with transaction_context(self.database):
+            stored = await GameRepository(self.database).get_state('game')
+        self.assertEqual(4, stored.rev)
+        self.assertEqual(3, stored.snapshot_rev)
+        self.assertEqual(game_state.serialize_for('player_a'),
+                         stored.game_state.serialize_for('player_a'))
+
+    async def test_created_metadata(self):
+        # migrations do not fail on the latest schema
+        self.assertEqual(LATEST_VERSION, await self.database.migrate())
+
+    async def test_newer_version(self):
+        await self.database.migrate()
+        async with self.database.engine.begin() as conn:
+            await conn.execute(text('UPDATE schema_version SET version = version + 1'))
+        with self.assertRaises(MigrationError):
+            async with self.database.engine.begin() as conn:
+                await conn.run_sync(migrate)
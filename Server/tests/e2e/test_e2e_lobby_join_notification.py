@@ -5,6 +5,7 @@ import aiohttp
 from async_timeout import timeout
 
 from harness import TestUserHarness, RestTestHarness, WebsocketHarness
+from quadradiusr_server.config import LobbyConfig
 from quadradiusr_server.constants import QrwsOpcode
 
 
@@ -103,3 +104,50 @@ class E2eLobbyJoinNotificationTest(
                         raise AssertionError(f'Received unexpected message: {msg}')
                     except asyncio.TimeoutError:
                         pass
+
+    async def test_lobby_presence_coalesced(self):
+        await asyncio.gather(
+            self.create_test_user(0),
+            self.create_test_user(1),
+            self.create_test_user(2),
+        )
+        lobby_ws = self.server_url('/lobby/@main/connect', protocol='ws')
+        self.server.config.lobby = LobbyConfig(presence_window=0.5)
+
+        user0 = await self.get_test_user(0)
+        user2 = await self.get_test_user(2)
+
+        async with timeout(3), aiohttp.ClientSession() as session:
+            async with session.ws_connect(lobby_ws + '?presence=coalesced') as ws0:
+                await self.authorize_ws(0, ws0)
+                await self.ws_subscribe(ws0, 'lobby.*')
+
+                data = await self.ws_receive_notification(ws0)
+                self.assertEqual('lobby.presence', data['topic'])
+                self.assertEqual([user0['id']], [u['id'] for u in data['data']['joined']])
+
+                async with session.ws_connect(lobby_ws) as ws1:
+                    await self.authorize_ws(1, ws1)
+                async with session.ws_connect(lobby_ws) as ws2:
+                    await self.authorize_ws(2, ws2)
+
+                    # user1 has joined and left within the window
+                    data = await self.ws_receive_notification(ws0)
+                    self.assertEqual({
+                        'topic': 'lobby.presence',
+                        'data': {
+                            'lobby_id': '@main',
+                            'joined': [{
+                                'id': user2['id'],
+                                'username': user2['username'],
+                            }],
+                            'left': [],
+                        },
+                    }, data)
+
+                data = await self.ws_receive_notification(ws0)
+                self.assertEqual({
+                    'lobby_id': '@main',
+                    'joined': [],
+                    'left': [user2['id']],
+                }, data['data'])
@@ -156,11 +156,14 @@ class TestUserHarness(RestTestHarness, TestCase, metaclass=ABCMeta):
 
 
 class GameHarness(TestUserHarness, metaclass=ABCMeta):
-    async def create_game(self, player_a_id: str, player_b_id: str) -> str:
+    async def create_game(
+            self, player_a_id: str, player_b_id: str,
+            game_id: str = None) -> str:
         assert player_a_id != player_b_id
         async with transaction_context(self.server.database):
-            game_state = GameState.initial(player_a_id, player_b_id)
-            game_id = str(uuid.uuid4())
+            game_state = GameState.initial(
+                player_a_id, player_b_id, compact=self.config.game.compact_board)
+            game_id = game_id if game_id is not None else str(uuid.uuid4())
             game = Game(
                 id_=game_id,
                 player_a_id_=player_a_id,
@@ -173,8 +176,8 @@ class GameHarness(TestUserHarness, metaclass=ABCMeta):
 
     async def get_game_state(self, game_id: str) -> GameState:
         async with transaction_context(self.server.database):
-            game = await self.server.repository.game_repository.get_by_id(game_id)
-            return game.game_state_
+            stored = await self.server.repository.game_repository.get_state(game_id)
+            return stored.game_state
 
     async def set_game_state(self, game_id: str, game_state: GameState):
         async with transaction_context(self.server.database):
@@ -255,10 +258,10 @@ class PowerRandomizerForTests(PowerRandomizer):
             game_state: GameState,
             power_definitions: List[PowerDefinition]) -> None:
         if self.power_to_spawn:
-            game_state.board.powers[self.power_to_spawn.id] = self.power_to_spawn
+            game_state.spawn_power(self.power_to_spawn)
             self.power_to_spawn = None
         if self.next_spawn_info:
-            game_state.next_power_spawn = self.next_spawn_info
+            game_state.set_next_power_spawn(self.next_spawn_info)
             self.next_spawn_info = None
 
     @classmethod
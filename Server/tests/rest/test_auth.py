@@ -3,6 +3,7 @@ from unittest import IsolatedAsyncioTestCase
 import aiohttp
 
 from harness import RestTestHarness, TestUserHarness
+from quadradiusr_server.config import ServerConfig, AuthConfig
 
 
 class TestAuth(IsolatedAsyncioTestCase, TestUserHarness, RestTestHarness):
@@ -33,3 +34,26 @@ class TestAuth(IsolatedAsyncioTestCase, TestUserHarness, RestTestHarness):
                 self.assertEqual(200, response.status)
                 body = await response.json()
                 self.assertEqual(username, body['username'])
+
+    async def test_revoke(self):
+        await self.create_test_user(0)
+        token = await self.authorize_test_user(0)
+
+        async with aiohttp.ClientSession() as session:
+            headers = {'authorization': token}
+            async with session.get(self.server_url('/user/@me'), headers=headers) as response:
+                self.assertEqual(200, response.status)
+            async with session.delete(self.server_url('/authorize'), headers=headers) as response:
+                self.assertEqual(204, response.status)
+            async with session.get(self.server_url('/user/@me'), headers=headers) as response:
+                self.assertEqual(401, response.status)
+            async with session.delete(self.server_url('/authorize'), headers=headers) as response:
+                self.assertEqual(401, response.status)
+
+
+class TestSignedAuth(TestAuth):
+
+    async def asyncSetUp(self) -> None:
+        await self.setup_server(config=ServerConfig(
+            host='', port=0,
+            auth=AuthConfig(token_format='signed', token_secret='secret')))
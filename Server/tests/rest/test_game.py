@@ -4,6 +4,7 @@ from unittest import IsolatedAsyncioTestCase
 import aiohttp
 
 from harness import RestTestHarness, TestUserHarness, GameHarness
+from quadradiusr_server.config import ServerConfig, ClusterConfig
 
 
 class TestGame(IsolatedAsyncioTestCase, GameHarness, TestUserHarness, RestTestHarness):
@@ -46,6 +47,12 @@ class TestGame(IsolatedAsyncioTestCase, GameHarness, TestUserHarness, RestTestHa
                     '403: You are not a part of this game, sorry',
                     await response.text())
 
+            async with session.get(self.server_url('/game/unknown'), headers={
+                'authorization': await self.authorize_test_user(0)
+            }) as response:
+                self.assertEqual(404, response.status)
+                self.assertEqual('404: Game not found', await response.text())
+
     async def test_get_game_state(self):
         await asyncio.gather(
             self.create_test_user(0),
@@ -121,6 +128,14 @@ class TestGame(IsolatedAsyncioTestCase, GameHarness, TestUserHarness, RestTestHa
                 body = await response.text()
                 self.assertEqual('', body)
 
+            # the state is seen differently by each player
+            async with session.get(self.server_url(f'/game/{game_id}/state'), headers={
+                'authorization': await self.authorize_test_user(1),
+                'if-none-match': etag,
+            }) as response:
+                self.assertEqual(200, response.status)
+                self.assertNotEqual(etag, response.headers['etag'])
+
             game_state = await self.get_game_state(game_id)
             game_state.settings.board_size = (20, 20)
             await self.set_game_state(game_id, game_state)
@@ -132,3 +147,98 @@ class TestGame(IsolatedAsyncioTestCase, GameHarness, TestUserHarness, RestTestHa
                 self.assertEqual(200, response.status)
                 body = await response.json()
                 self.assertIsNotNone(body)
+
+
+class TestGameRouting(IsolatedAsyncioTestCase, GameHarness, TestUserHarness, RestTestHarness):
+
+    async def asyncSetUp(self) -> None:
+        await self.setup_server(config=ServerConfig(
+            host='', port=0,
+            cluster=ClusterConfig(workers=['example.com', 'other.example.com']),
+        ))
+
+    async def asyncTearDown(self) -> None:
+        await self.shutdown_server()
+
+    async def test_game_owner(self):
+        await asyncio.gather(
+            self.create_test_user(0),
+            self.create_test_user(1),
+        )
+
+        user0 = await self.get_test_user(0)
+        user1 = await self.get_test_user(1)
+
+        # game0 is owned by this server, game2 by the other one
+        await self.create_game(user0['id'], user1['id'], game_id='game0')
+        await self.create_game(user0['id'], user1['id'], game_id='game2')
+
+        async with aiohttp.ClientSession() as session:
+            for game_id, href in [('game0', 'example.com'), ('game2', 'other.example.com')]:
+                async with session.get(self.server_url(f'/game/{game_id}'), headers={
+                    'authorization': await self.authorize_test_user(0)
+                }) as response:
+                    self.assertEqual(200, response.status)
+                    body = await response.json()
+                    self.assertEqual(f'ws://{href}/game/{game_id}/connect', body['ws_url'])
+
+            async with session.get(
+                    self.server_url('/game/game2/connect?force=1'),
+                    allow_redirects=False) as response:
+                self.assertEqual(307, response.status)
+                self.assertEqual(
+                    'ws://other.example.com/game/game2/connect?force=1',
+                    response.headers['location'])
+
+            # only the owner knows the latest state
+            async with session.get(self.server_url('/game/game2/state'), headers={
+                'authorization': await self.authorize_test_user(0)
+            }, allow_redirects=False) as response:
+                self.assertEqual(307, response.status)
+                self.assertEqual(
+                    'http://other.example.com/game/game2/state',
+                    response.headers['location'])
+            async with session.get(self.server_url('/game/game0/state'), headers={
+                'authorization': await self.authorize_test_user(0)
+            }, allow_redirects=False) as response:
+                self.assertEqual(200, response.status)
+
+
+class TestGameWorkerRouting(
+        IsolatedAsyncioTestCase, GameHarness, TestUserHarness, RestTestHarness):
+
+    async def asyncSetUp(self) -> None:
+        # server.href (example.com) is shared by both workers
+        await self.setup_server(config=ServerConfig(
+            host='', port=0,
+            cluster=ClusterConfig(
+                workers=['worker0.example.com', 'worker1.example.com'],
+                worker_href='worker0.example.com'),
+        ))
+
+    async def asyncTearDown(self) -> None:
+        await self.shutdown_server()
+
+    async def test_local_owner(self):
+        await asyncio.gather(
+            self.create_test_user(0),
+            self.create_test_user(1),
+        )
+
+        user0 = await self.get_test_user(0)
+        user1 = await self.get_test_user(1)
+
+        # game0 is owned by this worker, game2 by the other one
+        await self.create_game(user0['id'], user1['id'], game_id='game0')
+        await self.create_game(user0['id'], user1['id'], game_id='game2')
+
+        async with aiohttp.ClientSession() as session:
+            for game_id, href in [
+                    ('game0', 'worker0.example.com'),
+                    ('game2', 'worker1.example.com')]:
+                async with session.get(self.server_url(f'/game/{game_id}'), headers={
+                    'authorization': await self.authorize_test_user(0)
+                }) as response:
+                    self.assertEqual(200, response.status)
+                    body = await response.json()
+                    self.assertEqual(f'ws://{href}/game/{game_id}/connect', body['ws_url'])
@@ -20,3 +20,4 @@ class TestHealth(IsolatedAsyncioTestCase, RestTestHarness):
 
                 body = await response.json()
                 self.assertEqual(body['status'], 'up')
+                self.assertEqual(body['password_hashing']['queue_depth'], 0)
@@ -5,6 +5,7 @@ import aiohttp
 from isodate import parse_datetime
 
 from harness import RestTestHarness, TestUserHarness
+from quadradiusr_server.config import ServerConfig, ClusterConfig
 from quadradiusr_server.db.base import LobbyMessage
 from quadradiusr_server.db.transactions import transaction_context
 
@@ -119,3 +120,31 @@ class TestLobby(IsolatedAsyncioTestCase, TestUserHarness, RestTestHarness):
                     self.assertEqual(400, response.status)
                     body = await response.text()
                     self.assertEqual('400: Malformed query params', body)
+
+
+class TestLobbyRouting(IsolatedAsyncioTestCase, TestUserHarness, RestTestHarness):
+
+    async def asyncSetUp(self) -> None:
+        await self.setup_server(config=ServerConfig(
+            host='', port=0,
+            cluster=ClusterConfig(workers=['example.com', 'other.example.com']),
+        ))
+
+    async def asyncTearDown(self) -> None:
+        await self.shutdown_server()
+
+    async def test_lobby_owner(self):
+        await self.create_test_user(0)
+
+        # @main is owned by the other server
+        async with aiohttp.ClientSession() as session:
+            for path in ['/lobby/@main', '/lobby/@main/message']:
+                async with session.get(self.server_url(path), headers={
+                    'authorization': await self.authorize_test_user(0)
+                }, allow_redirects=False) as response:
+                    self.assertEqual(307, response.status)
+                    self.assertEqual(
+                        f'http://other.example.com{path}',
+                        response.headers['location'])
+
+        self.assertEqual({}, self.server.lobbies)
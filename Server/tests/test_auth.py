@@ -1,15 +1,17 @@
+import asyncio
 from unittest import IsolatedAsyncioTestCase
 from unittest.mock import Mock
 
-from sqlalchemy import insert
+from sqlalchemy import insert, event, select
 from sqlalchemy.ext.asyncio import AsyncConnection
 
 from quadradiusr_server.auth import Auth
 from quadradiusr_server.config import DatabaseConfig, AuthConfig
-from quadradiusr_server.db.base import User
+from quadradiusr_server.db.base import User, AccessToken
 from quadradiusr_server.db.database_engine import DatabaseEngine
 from quadradiusr_server.db.repository import Repository
 from quadradiusr_server.db.transactions import transaction_context
+from quadradiusr_server.notification import NotificationService, Handler, Notification
 
 
 class AuthTest(IsolatedAsyncioTestCase):
@@ -20,6 +22,25 @@ class AuthTest(IsolatedAsyncioTestCase):
         self.assertTrue(auth.is_password_valid(b'asdf', h))
         self.assertFalse(auth.is_password_valid(b'asdf2', h))
 
+    async def test_async_hashing(self):
+        for executor in ['thread', 'process']:
+            auth = Auth(AuthConfig(hash_executor=executor), Mock())
+            h = await auth.hash_password_async(b'asdf')
+
+            self.assertTrue(auth.is_password_valid(b'asdf', h))
+            results = await asyncio.gather(
+                auth.is_password_valid_async(b'asdf', h),
+                auth.is_password_valid_async(b'asdf2', h),
+                auth.is_password_valid_async(b'asdf', auth.hash_password(b'asdf')))
+            self.assertEqual([True, False, True], results)
+            self.assertEqual(0, auth.hashing_stats.queue_depth)
+            self.assertEqual(3, auth.hashing_stats.max_queue_depth)
+            self.assertEqual(4, auth.hashing_stats.hashed_passwords)
+            auth.shutdown()
+
+        with self.assertRaises(ValueError):
+            Auth(AuthConfig(hash_executor='gpu'), Mock())
+
     async def test_login(self):
         database = DatabaseEngine(DatabaseConfig(
             create_metadata=True,
@@ -38,3 +59,179 @@ class AuthTest(IsolatedAsyncioTestCase):
             user = await auth.login('cushy_moconut', b'okon')
             self.assertIsNotNone(user)
             self.assertEqual('696969', user.id_)
+
+    async def test_token_cache(self):
+        database = DatabaseEngine(DatabaseConfig(
+            create_metadata=True,
+        ))
+        auth = Auth(AuthConfig(), Repository(database))
+        await database.initialize()
+
+        statements = []
+        event.listen(
+            database.engine.sync_engine, 'before_cursor_execute',
+            lambda conn, cursor, statement, *args: statements.append(statement))
+
+        async with transaction_context(database) as session:
+            await session.execute(insert(User), [{
+                'id_': '696969',
+                'username_': 'cushy_moconut',
+                'password_': 'hash',
+            }])
+            user = await session.get(User, '696969')
+            token = await auth.issue_token(user)
+
+        async def get_accessed_at():
+            async with transaction_context(database) as session:
+                result = await session.execute(select(AccessToken))
+                return result.scalar_one().accessed_at_
+
+        created_at = await get_accessed_at()
+
+        # cached tokens are authenticated without accessing the database
+        statements.clear()
+        for _ in range(3):
+            async with transaction_context(database):
+                user = await auth.authenticate(token)
+                self.assertEqual('696969', user.id_)
+                self.assertEqual('cushy_moconut', user.username_)
+        self.assertEqual([], statements)
+        self.assertEqual(created_at, await get_accessed_at())
+
+        self.assertEqual(1, await auth.flush_token_accesses())
+        self.assertEqual(0, await auth.flush_token_accesses())
+        self.assertLess(created_at, await get_accessed_at())
+
+        # invalidated tokens are looked up again
+        async with transaction_context(database) as session:
+            await session.execute(AccessToken.__table__.delete())
+        async with transaction_context(database):
+            self.assertIsNotNone(await auth.authenticate(token))
+            auth.invalidate_tokens([token])
+            self.assertIsNone(await auth.authenticate(token))
+            self.assertIsNone(await auth.authenticate(None))
+            self.assertIsNone(await auth.authenticate(123))
+            self.assertIsNone(await auth.authenticate({'token': token}))
+
+        await database.dispose()
+
+    async def test_broadcast_invalidated_tokens(self):
+        database = DatabaseEngine(DatabaseConfig(
+            create_metadata=True,
+        ))
+        # both processes receive notifications published by either of them
+        ns = NotificationService()
+        published = []
+
+        class RecordingHandler(Handler):
+            async def handle(self, notification: Notification):
+                published.append(notification)
+
+        ns.register_handler('@auth', '*', RecordingHandler())
+        auth = Auth(AuthConfig(), Repository(database), ns)
+        other_auth = Auth(AuthConfig(), Repository(database), ns)
+        await database.initialize()
+
+        async with transaction_context(database) as session:
+            await session.execute(insert(User), [{
+                'id_': '696969',
+                'username_': 'cushy_moconut',
+                'password_': 'hash',
+            }])
+            token = await auth.issue_token(await session.get(User, '696969'))
+            self.assertIsNotNone(await other_auth.authenticate(token))
+            self.assertTrue(await auth.revoke_token(token))
+            # invalidations are published after the removal is committed
+            await asyncio.sleep(0.01)
+            self.assertEqual([], published)
+        await asyncio.sleep(0.01)
+
+        async with transaction_context(database):
+            self.assertIsNone(await other_auth.authenticate(token))
+        self.assertEqual(1, len(published))
+        self.assertNotIn(token, str(published[0].data))
+
+        # nothing is published when the removal is rolled back
+        async with transaction_context(database) as session:
+            token = await auth.issue_token(await session.get(User, '696969'))
+        with self.assertRaises(RuntimeError):
+            async with transaction_context(database):
+                self.assertTrue(await auth.revoke_token(token))
+                raise RuntimeError()
+        await asyncio.sleep(0.01)
+
+        async with transaction_context(database):
+            self.assertIsNotNone(await other_auth.authenticate(token))
+        self.assertEqual(1, len(published))
+
+        await database.dispose()
+
+    async def test_token_cache_ttl(self):
+        database = DatabaseEngine(DatabaseConfig(
+            create_metadata=True,
+        ))
+        auth = Auth(AuthConfig(token_cache_ttl=0), Repository(database))
+        await database.initialize()
+
+        async with transaction_context(database) as session:
+            await session.execute(insert(User), [{
+                'id_': '696969',
+                'username_': 'cushy_moconut',
+                'password_': 'hash',
+            }])
+            token = await auth.issue_token(await session.get(User, '696969'))
+            self.assertIsNotNone(await auth.authenticate(token))
+
+            await session.execute(AccessToken.__table__.delete())
+            self.assertIsNone(await auth.authenticate(token))
+
+        await database.dispose()
+
+    async def test_signed_tokens(self):
+        database = DatabaseEngine(DatabaseConfig(
+            create_metadata=True,
+        ))
+        config = AuthConfig(token_format='signed', token_secret='secret')
+        auth = Auth(config, Repository(database))
+        # another process sharing the database
+        other_auth = Auth(config, Repository(database))
+        await database.initialize()
+
+        statements = []
+        event.listen(
+            database.engine.sync_engine, 'before_cursor_execute',
+            lambda conn, cursor, statement, *args: statements.append(statement))
+
+        async with transaction_context(database):
+            user = User(id_='696969', username_='cushy_moconut', password_='hash')
+            token = await auth.issue_token(user)
+            self.assertEqual([], statements)
+
+            user = await other_auth.authenticate(token)
+            self.assertEqual('696969', user.id_)
+            self.assertEqual('cushy_moconut', user.username_)
+            self.assertIsNone(await other_auth.authenticate(token[:-1]))
+            self.assertEqual([], statements)
+
+        async with transaction_context(database):
+            self.assertTrue(await auth.revoke_token(token))
+            self.assertIsNone(await auth.authenticate(token))
+        async with transaction_context(database):
+            self.assertIsNotNone(await other_auth.authenticate(token))
+        await other_auth.sync_revoked_tokens()
+        async with transaction_context(database):
+            self.assertIsNone(await other_auth.authenticate(token))
+            self.assertFalse(await other_auth.revoke_token(token[:-1]))
+
+        await database.dispose()
+
+    def test_invalid_token_config(self):
+        with self.assertRaises(ValueError):
+            Auth(AuthConfig(token_format='signed'), Mock())
+        with self.assertRaises(ValueError):
+            Auth(AuthConfig(token_format='jwt'), Mock())
+
+    async def test_malformed_signed_token(self):
+        auth = Auth(AuthConfig(token_format='signed', token_secret='secret'), Mock())
+        self.assertIsNone(await auth.authenticate('v1.abc.é'))
+        self.assertFalse(await auth.revoke_token('v1.abc.é'))
@@ -0,0 +1,118 @@
+import copy
+from unittest import TestCase
+
+from quadradiusr_server.game_journal import ActionJournal, PieceMoved
+from quadradiusr_server.game_state import GameState, Power, NextPowerSpawnInfo
+
+
+class TestActionJournal(TestCase):
+    def _make_changes(self, game_state: GameState):
+        board = game_state.board
+        piece = board.get_piece_at(0, 1)
+        game_state.play_move()
+        game_state.capture_piece(board.get_piece_at(0, 6).id)
+        game_state.move_piece(piece.id, board.get_tile_at(0, 6).id)
+        game_state.spawn_power(Power(
+            id='power',
+            power_definition_id='raise_tile',
+            tile_id=board.get_tile_at(5, 5).id,
+        ))
+        game_state.capture_power('power', piece.id)
+        game_state.set_tile_elevation(board.get_tile_at(0, 6).id, 2)
+        game_state.switch_turn('player_b')
+        game_state.set_next_power_spawn(NextPowerSpawnInfo(rounds=3, count=1))
+        game_state.finish('player_a')
+
+    def test_record(self):
+        game_state = GameState.initial('player_a', 'player_b')
+        piece = game_state.board.get_piece_at(0, 1)
+        tile = game_state.board.get_tile_at(0, 2)
+
+        journal = ActionJournal()
+        with game_state.journaled(journal):
+            game_state.move_piece(piece.id, tile.id)
+        # changes outside of the context are not recorded
+        game_state.move_piece(piece.id, game_state.board.get_tile_at(0, 3).id)
+
+        self.assertEqual([PieceMoved(
+            piece_id=piece.id,
+            from_tile_id=game_state.board.get_tile_at(0, 1).id,
+            to_tile_id=tile.id,
+        )], journal.changes)
+
+    def test_revert(self):
+        game_state = GameState.initial('player_a', 'player_b')
+        original = copy.deepcopy(game_state)
+
+        journal = ActionJournal()
+        with game_state.journaled(journal):
+            self._make_changes(game_state)
+        modified = copy.deepcopy(game_state)
+        self.assertNotEqual(original, modified)
+
+        with journal.reverted(game_state):
+            self.assertEqual(original, game_state)
+        self.assertEqual(modified, game_state)
+
+        journal.revert(game_state)
+        self.assertEqual(original, game_state)
+
+    def test_revert_compact(self):
+        game_state = GameState.initial('player_a', 'player_b', compact=True)
+        original = copy.deepcopy(game_state)
+
+        journal = ActionJournal()
+        with game_state.journaled(journal):
+            self._make_changes(game_state)
+        self.assertEqual(2, game_state.board.get_tile_at(0, 6).elevation)
+
+        journal.revert(game_state)
+        self.assertEqual(original, game_state)
+        self.assertEqual(0, game_state.board.get_tile_at(0, 6).elevation)
+
+    def test_serialize_diff(self):
+        game_state = GameState.initial('player_a', 'player_b')
+        board = game_state.board
+        piece = board.get_piece_at(0, 1)
+        captured_piece = board.get_piece_at(0, 6)
+        tile = board.get_tile_at(0, 6)
+
+        journal = ActionJournal()
+        with game_state.journaled(journal):
+            self._make_changes(game_state)
+
+        self.assertEqual({
+            'board': {
+                'pieces': {
+                    '$delete': [captured_piece.id],
+                    piece.id: {
+                        'tile_id': tile.id,
+                    },
+                },
+                'powers': {
+                    'power': {
+                        'power_definition_id': 'raise_tile',
+                        'tile_id': None,
+                        'piece_id': piece.id,
+                        'authorized_player_ids': ['player_a'],
+                    },
+                },
+                'tiles': {
+                    tile.id: {
+                        'elevation': 2,
+                    },
+                },
+            },
+            'current_player_id': 'player_b',
+            'moves_played': 1,
+            'next_power_spawn': {
+                'rounds': 3,
+                'count': 1,
+            },
+            'finished': True,
+            'winner_id': 'player_a',
+        }, game_state.serialize_diff_for(journal, 'player_a'))
+
+        # the power definition is hidden from the other player
+        diff = game_state.serialize_diff_for(journal, 'player_b')
+        self.assertIsNone(diff['board']['powers']['power']['power_definition_id'])
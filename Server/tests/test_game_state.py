@@ -1,10 +1,24 @@
+import copy
+import pickle
+import uuid
 from unittest import TestCase
 
 from harness import GameHarness
-from quadradiusr_server.game_state import GameState, Tile, Piece, GameBoard, Power
+from quadradiusr_server.game_state import GameState, Tile, Piece, GameBoard, Power, \
+    CompactGameBoard, game_state_etag
 
 
 class TestGameState(GameHarness, TestCase):
+    def test_etag(self):
+        # ETags must not depend on the process, e.g. on hash randomization
+        self.assertEqual('MH8hk6s9doxLjVmc', game_state_etag('game', 1, 'player_a'))
+        self.assertNotEqual(
+            game_state_etag('game', 1, 'player_a'),
+            game_state_etag('game', 1, 'player_b'))
+        self.assertNotEqual(
+            game_state_etag('game', 1, 'player_a'),
+            game_state_etag('game', 2, 'player_a'))
+
     def test_initial(self):
         initial = GameState.initial('player_a', 'player_b')
 
@@ -62,3 +76,75 @@ class TestGameBoard(GameHarness, TestCase):
         self.assertSetEqual(
             {'1', '3'},
             set(board.get_empty_tiles().keys()))
+
+    def test_indexes(self):
+        board = GameState.initial('player_a', 'player_b').board
+        piece = board.get_piece_at(0, 1)
+        tile = board.get_tile_at(4, 4)
+
+        board.place_piece(piece.id, tile.id)
+        self.assertIsNone(board.get_piece_at(0, 1))
+        self.assertIs(piece, board.get_piece_at(4, 4))
+
+        board.add_power(Power(
+            id='power',
+            power_definition_id='raise_tile',
+            tile_id=board.get_tile_at(5, 5).id,
+        ))
+        self.assertEqual('power', board.get_power_on(board.get_tile_at(5, 5).id).id)
+        board.place_power('power', None)
+        self.assertIsNone(board.get_power_on(board.get_tile_at(5, 5).id))
+
+        board.remove_piece(piece.id)
+        self.assertIsNone(board.get_piece_at(4, 4))
+
+        # indexes are rebuilt when unpickling
+        board = pickle.loads(pickle.dumps(board))
+        self.assertIsNone(board.get_piece_at(4, 4))
+        self.assertEqual('player_b', board.get_piece_at(3, 7).owner_id)
+        self.assertEqual((3, 7), board.get_tile_at(3, 7).position)
+
+    def test_compact_board(self):
+        self.assertIsInstance(
+            GameState.initial('player_a', 'player_b', compact=True).board,
+            CompactGameBoard)
+
+        game_state = GameState.initial('player_a', 'player_b')
+        board = game_state.board
+        compact_state = copy.deepcopy(game_state)
+        compact_state.board = CompactGameBoard.from_board(board)
+        compact_board = compact_state.board
+
+        self.assertEqual(board.tiles, compact_board.tiles)
+        self.assertEqual(
+            game_state.serialize_for('player_a'),
+            compact_state.serialize_for('player_a'))
+        self.assertEqual(board.get_tile_at(3, 5), compact_board.get_tile_at(3, 5))
+        self.assertIsNone(compact_board.get_tile_at(10, 0))
+        self.assertEqual(board.get_piece_at(0, 1), compact_board.get_piece_at(0, 1))
+
+        tile = compact_board.get_tile_at(2, 4)
+        compact_board.set_elevation(tile.id, -3)
+        self.assertEqual(-3, compact_board.tiles[tile.id].elevation)
+        self.assertEqual(-3, compact_board.get_tile_at(2, 4).elevation)
+        self.assertNotIn('not-a-tile', compact_board.tiles)
+
+        unpickled = pickle.loads(pickle.dumps(compact_board))
+        self.assertEqual(compact_board, unpickled)
+        # the index of tile IDs is not pickled, but rebuilt
+        self.assertNotIn('_handles_by_tile_id', compact_board.__getstate__())
+        self.assertEqual(-3, unpickled.tiles[tile.id].elevation)
+        unpickled.set_elevation(tile.id, 2)
+        self.assertEqual(2, unpickled.get_tile_at(2, 4).elevation)
+        self.assertIs(unpickled.get_piece_at(3, 7), unpickled.pieces[board.get_piece_at(3, 7).id])
+        self.assertLess(len(pickle.dumps(compact_board)), len(pickle.dumps(board)))
+
+    def test_compact_board_invalid(self):
+        with self.assertRaises(ValueError):
+            CompactGameBoard.from_board(GameBoard(tiles={
+                '1': Tile(id='1', position=(0, 0)),
+            }, pieces={}))
+        with self.assertRaises(ValueError):
+            CompactGameBoard.from_board(GameBoard(tiles={
+                str(uuid.UUID(int=0)): Tile(id=str(uuid.UUID(int=0)), position=(1, 1)),
+            }, pieces={}))
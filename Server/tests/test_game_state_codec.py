@@ -0,0 +1,92 @@
+import pickle
+import uuid
+from unittest import TestCase
+
+from quadradiusr_server.game_journal import PieceMoved, PieceCaptured, PowerSpawned, \
+    PowerCaptured, TileElevationChanged, TurnSwitched, MovePlayed, GameFinished, \
+    NextPowerSpawnChanged
+from quadradiusr_server.game_state import GameState, GameBoard, CompactGameBoard, Tile, Power, \
+    Piece, NextPowerSpawnInfo
+from quadradiusr_server.game_state_codec import encode_game_state, decode_game_state, \
+    GameStateFormatError, MAGIC, encode_changes, decode_changes
+
+
+class TestGameStateCodec(TestCase):
+    def _assert_round_trip(self, game_state: GameState):
+        decoded = decode_game_state(encode_game_state(game_state))
+        self.assertIs(type(game_state.board), type(decoded.board))
+        self.assertEqual(game_state.board.tiles, decoded.board.tiles)
+        self.assertEqual(game_state.board.pieces, decoded.board.pieces)
+        self.assertEqual(game_state.board.powers, decoded.board.powers)
+        for player_id in ['player_a', 'player_b']:
+            self.assertEqual(
+                game_state.serialize_for(player_id),
+                decoded.serialize_for(player_id))
+        return decoded
+
+    def test_round_trip(self):
+        for compact in [False, True]:
+            game_state = GameState.initial('player_a', 'player_b', compact=compact)
+            board = game_state.board
+            game_state.spawn_power(Power(
+                id=str(uuid.uuid4()),
+                power_definition_id='raise_tile',
+                tile_id=board.get_tile_at(4, 4).id,
+                authorized_player_ids=['player_a'],
+            ))
+            game_state.move_piece(board.get_piece_at(0, 1).id, board.get_tile_at(0, 2).id)
+            decoded = self._assert_round_trip(game_state)
+            self.assertEqual(game_state.current_player_id, decoded.current_player_id)
+            self.assertEqual(game_state.moves_played, decoded.moves_played)
+            self.assertLess(len(encode_game_state(game_state)), len(pickle.dumps(game_state)))
+
+    def test_incomplete_board(self):
+        game_state = GameState.initial('player_a', 'player_b')
+        game_state.board = GameBoard(tiles={
+            'tile': Tile(id='tile', position=(0, 0), elevation=2),
+        }, pieces={}, powers={})
+        self._assert_round_trip(game_state)
+
+        game_state.board = CompactGameBoard.from_board(
+            GameState.initial('player_a', 'player_b').board)
+        self._assert_round_trip(game_state)
+
+    def test_invalid_data(self):
+        game_state = GameState.initial('player_a', 'player_b')
+        with self.assertRaises(GameStateFormatError):
+            decode_game_state(pickle.dumps(game_state))
+        with self.assertRaises(GameStateFormatError):
+            decode_game_state(MAGIC + b'\xff' + encode_game_state(game_state)[len(MAGIC) + 1:])
+        with self.assertRaises(GameStateFormatError):
+            decode_game_state(encode_game_state(game_state)[:-10])
+
+    def test_changes(self):
+        ids = [str(uuid.uuid4()) for _ in range(4)]
+        changes = [
+            PieceMoved(ids[0], ids[1], ids[2]),
+            PieceCaptured(Piece(id=ids[0], owner_id='player_a', tile_id=ids[1])),
+            PowerSpawned(Power(
+                id=ids[3],
+                power_definition_id='raise_tile',
+                tile_id=ids[1],
+                authorized_player_ids=['player_a'],
+            )),
+            PowerCaptured(ids[3], ids[1], None, ids[0], 'player_b'),
+            TileElevationChanged(ids[2], 0, -1),
+            TurnSwitched('player_a', 'player_b'),
+            MovePlayed(),
+            GameFinished(None),
+            GameFinished('player_a'),
+            NextPowerSpawnChanged(NextPowerSpawnInfo(rounds=1, count=2),
+                                  NextPowerSpawnInfo(rounds=3, count=1)),
+        ]
+        encoded = encode_changes(changes)
+        self.assertEqual(changes, decode_changes(encoded))
+        self.assertLess(len(encoded), len(pickle.dumps(changes)))
+
+        with self.assertRaises(GameStateFormatError):
+            decode_changes(pickle.dumps(changes))
+        with self.assertRaises(GameStateFormatError):
+            decode_changes(encode_game_state(GameState.initial('player_a', 'player_b')))
+        with self.assertRaises(GameStateFormatError):
+            decode_changes(encoded[:-10])
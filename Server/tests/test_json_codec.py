@@ -0,0 +1,23 @@
+import json
+from unittest import TestCase
+
+from quadradiusr_server.game_state import GameState
+from quadradiusr_server.json_codec import create_codec, StdlibJsonCodec, OrjsonCodec
+
+
+class TestJsonCodec(TestCase):
+    def test_codecs(self):
+        serialized = GameState.initial('player_a', 'player_b').serialize_for('player_a')
+        for name in ['json', 'orjson']:
+            codec = create_codec(name)
+            self.assertEqual(serialized, codec.loads(codec.dumps(serialized)))
+            self.assertEqual(serialized, codec.loads(codec.dumps_bytes(serialized)))
+            self.assertEqual(codec.dumps(serialized).encode(), codec.dumps_bytes(serialized))
+            with self.assertRaises(json.JSONDecodeError):
+                codec.loads('{"a": ')
+
+    def test_create_codec(self):
+        self.assertIsInstance(create_codec('json'), StdlibJsonCodec)
+        self.assertIsInstance(create_codec('orjson'), OrjsonCodec)
+        with self.assertRaises(ValueError):
+            create_codec('yaml')
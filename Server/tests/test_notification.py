@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+
+from async_timeout import timeout
+
+from harness import NotificationHandlerForTests
+from quadradiusr_server.notification import NotificationService, Notification
+from quadradiusr_server.notification_relay import NotificationRelay, RelayNotificationBackend
+
+
+class TestNotificationService(IsolatedAsyncioTestCase):
+    async def test_notify_all(self):
+        ns = NotificationService()
+        nh0 = NotificationHandlerForTests()
+        nh1 = NotificationHandlerForTests()
+        ns.register_handler('user0', 'lobby.*', nh0)
+        ns.register_handler('user1', '*', nh1)
+
+        ns.notify_all(['user0', 'user1'], topic='lobby.joined', data={'a': 1})
+        await asyncio.sleep(0.05)
+
+        self.assertEqual([Notification(
+            topic='lobby.joined',
+            subject_id='user0',
+            data={'a': 1},
+        )], nh0.notifications)
+        self.assertEqual('user1', nh1.notifications[0].subject_id)
+
+        # the message is encoded once for all subjects
+        message = nh0.notifications[0].to_message()
+        self.assertIs(message, nh1.notifications[0].to_message())
+        self.assertIs(message.encode(), nh1.notifications[0].to_message().encode())
+        self.assertEqual({
+            'op': 4,
+            'd': {
+                'topic': 'lobby.joined',
+                'data': {'a': 1},
+            },
+        }, json.loads(message.encode()))
+
+    async def test_routing(self):
+        ns = NotificationService()
+        nh_exact = NotificationHandlerForTests()
+        nh_pattern = NotificationHandlerForTests()
+        nh_all = NotificationHandlerForTests()
+        nh_other = NotificationHandlerForTests()
+        ns.register_handler('user0', 'lobby.joined', nh_exact)
+        ns.register_handler('user0', 'lobby.*', nh_pattern)
+        ns.register_handler('*', '*', nh_all)
+        ns.register_handler('user1', '*', nh_other)
+        # handlers registered multiple times are notified once
+        ns.register_handler('user0', 'lobby.j?ined', nh_exact)
+
+        await ns.notify_now(Notification(topic='lobby.joined', subject_id='user0', data={}))
+        await ns.notify_now(Notification(topic='lobby.left', subject_id='user0', data={}))
+        await ns.notify_now(Notification(topic='game.invite', subject_id='user2', data={}))
+
+        self.assertEqual(['lobby.joined'], [n.topic for n in nh_exact.notifications])
+        self.assertEqual(
+            ['lobby.joined', 'lobby.left'],
+            [n.topic for n in nh_pattern.notifications])
+        self.assertEqual(
+            ['lobby.joined', 'lobby.left', 'game.invite'],
+            [n.topic for n in nh_all.notifications])
+        self.assertEqual([], nh_other.notifications)
+
+        ns.unregister_handler('user0', 'lobby.*', nh_pattern)
+        ns.unregister_handler('*', '*', nh_all)
+        with self.assertRaises(ValueError):
+            ns.unregister_handler('user0', 'lobby.*', nh_pattern)
+
+        await ns.notify_now(Notification(topic='lobby.left', subject_id='user0', data={}))
+        self.assertEqual(2, len(nh_pattern.notifications))
+        self.assertEqual(3, len(nh_all.notifications))
+
+
+class TestNotificationRelay(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'relay.sock')
+        self.relay = NotificationRelay(self.path)
+        await self.relay.start()
+
+    async def asyncTearDown(self) -> None:
+        await self.relay.stop()
+        self.tmp_dir.cleanup()
+
+    async def test_relay(self):
+        ns0 = NotificationService(RelayNotificationBackend(self.path))
+        ns1 = NotificationService(RelayNotificationBackend(self.path))
+        await ns0.start()
+        await ns1.start()
+        try:
+            nh0 = NotificationHandlerForTests()
+            nh1 = NotificationHandlerForTests()
+            ns0.register_handler('user0', '*', nh0)
+            ns1.register_handler('user0', '*', nh1)
+
+            notification = Notification(
+                topic='game.invite.received',
+                subject_id='user0',
+                data={'game_invite': {'id': 'invite'}},
+            )
+            await ns0.notify_now(notification)
+            async with timeout(2):
+                while not nh1.notifications:
+                    await asyncio.sleep(0.01)
+
+            self.assertEqual([notification], nh1.notifications)
+            # notifications are not relayed back to the publisher
+            await asyncio.sleep(0.05)
+            self.assertEqual([notification], nh0.notifications)
+        finally:
+            await ns0.stop()
+            await ns1.stop()
+
+    async def test_slow_client_disconnected(self):
+        self.relay.queue_size = 2
+        _, publisher = await asyncio.open_unix_connection(self.path)
+        # the slow client never reads relayed notifications
+        slow_reader, slow_writer = await asyncio.open_unix_connection(self.path)
+        try:
+            async with timeout(2):
+                while len(self.relay._peers) < 2:
+                    await asyncio.sleep(0.01)
+
+            line = b'x' * 1024 * 1024 + b'\n'
+            with self.assertLogs(level='WARNING'):
+                async with timeout(5):
+                    while len(self.relay._peers) > 1:
+                        publisher.write(line)
+                        await publisher.drain()
+                        await asyncio.sleep(0.01)
+
+            # the connection of the slow client is aborted
+            async with timeout(2):
+                try:
+                    while await slow_reader.read(1024 * 1024):
+                        pass
+                except ConnectionError:
+                    pass
+        finally:
+            publisher.close()
+            slow_writer.close()
@@ -0,0 +1,177 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from quadradiusr_server.config import QrwsConfig
+from quadradiusr_server.constants import QrwsCloseCode, QrwsOpcode
+from quadradiusr_server.qrws_connection import QrwsConnection, QrwsStats, OutboundQueue
+from quadradiusr_server.qrws_messages import NotificationMessage, GameStateMessage, \
+    GameStateDiffMessage
+
+
+class WebSocketForTests:
+    def __init__(self) -> None:
+        self.closed = False
+        self.close_code = None
+        self.sent = []
+        self.blocked = asyncio.Event()
+
+    async def send_str(self, data: str):
+        await self.blocked.wait()
+        self.sent.append(data)
+
+    async def close(self, *, code: int, message: bytes = None):
+        self.closed = True
+        self.close_code = code
+        return True
+
+
+def _notification(n: int):
+    return NotificationMessage(topic='test', data={'n': n})
+
+
+def _game_state(etag: str):
+    return GameStateMessage(recipient_id='user', game_state={}, etag=etag)
+
+
+def _game_state_diff(etag_from: str, etag_to: str):
+    return GameStateDiffMessage(
+        recipient_id='user', game_state_diff={},
+        etag_from=etag_from, etag_to=etag_to)
+
+
+class TestQrwsConnection(IsolatedAsyncioTestCase):
+    async def test_post_message(self):
+        ws = WebSocketForTests()
+        qrws = QrwsConnection(ws, config=QrwsConfig(outbound_queue_size=2))
+        qrws.post_message(_notification(0))
+        qrws.post_message(_notification(1))
+        # the sender does not wait for the client
+        self.assertEqual([], ws.sent)
+
+        ws.blocked.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual([_notification(0).encode(), _notification(1).encode()], ws.sent)
+        self.assertEqual(0, len(qrws.outbound_queue))
+
+    async def test_disconnect(self):
+        ws = WebSocketForTests()
+        stats = QrwsStats()
+        qrws = QrwsConnection(ws, config=QrwsConfig(
+            outbound_queue_size=2,
+            outbound_queue_policy='disconnect',
+        ), stats=stats)
+        for n in range(4):
+            qrws.post_message(_notification(n))
+        await asyncio.sleep(0.01)
+
+        self.assertTrue(ws.closed)
+        self.assertEqual(QrwsCloseCode.SLOW_CONSUMER, ws.close_code)
+        self.assertEqual(1, stats.evicted_connections)
+        self.assertEqual(0, stats.queued_messages)
+
+    async def test_drop_oldest_diffs(self):
+        ws = WebSocketForTests()
+        stats = QrwsStats()
+        qrws = QrwsConnection(ws, config=QrwsConfig(
+            outbound_queue_size=2,
+            outbound_queue_policy='drop_oldest',
+        ), stats=stats)
+        resyncs = []
+
+        async def resync(key):
+            resyncs.append(key)
+            return _game_state('e3')
+
+        qrws.outbound_queue.resync = resync
+        qrws.post_message(_game_state_diff('e0', 'e1'))
+        qrws.post_message(_game_state_diff('e1', 'e2'))
+        # dropping a diff would break the chain, so the state is resent
+        qrws.post_message(_game_state_diff('e2', 'e3'))
+        self.assertEqual(1, stats.dropped_messages)
+        qrws.post_message(_game_state_diff('e3', 'e4'))
+
+        ws.blocked.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual([(QrwsOpcode.GAME_STATE, 'user')], resyncs)
+        # the diff included in the resent state is skipped
+        self.assertEqual([
+            _game_state('e3').encode(),
+            _game_state_diff('e3', 'e4').encode(),
+        ], ws.sent)
+        self.assertFalse(ws.closed)
+        self.assertEqual(0, stats.queued_messages)
+
+    async def test_coalesce_diffs(self):
+        ws = WebSocketForTests()
+        stats = QrwsStats()
+        qrws = QrwsConnection(ws, config=QrwsConfig(
+            outbound_queue_size=2,
+            outbound_queue_policy='coalesce',
+        ), stats=stats)
+
+        async def resync(key):
+            return _game_state('e2')
+
+        qrws.outbound_queue.resync = resync
+        qrws.post_message(_notification(0))
+        qrws.post_message(_game_state_diff('e0', 'e1'))
+        qrws.post_message(_game_state_diff('e1', 'e2'))
+        self.assertEqual(1, stats.coalesced_messages)
+        self.assertEqual(0, stats.dropped_messages)
+
+        ws.blocked.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual([
+            _game_state('e2').encode(),
+            _notification(0).encode(),
+        ], ws.sent)
+        self.assertEqual(0, stats.queued_messages)
+
+    async def test_drop_diffs_without_resync(self):
+        ws = WebSocketForTests()
+        stats = QrwsStats()
+        qrws = QrwsConnection(ws, config=QrwsConfig(
+            outbound_queue_size=2,
+            outbound_queue_policy='drop_oldest',
+        ), stats=stats)
+        for n in range(3):
+            qrws.post_message(_game_state_diff(f'e{n}', f'e{n + 1}'))
+        await asyncio.sleep(0.01)
+
+        self.assertTrue(ws.closed)
+        self.assertEqual(QrwsCloseCode.SLOW_CONSUMER, ws.close_code)
+        self.assertEqual(1, stats.evicted_connections)
+
+    def test_drop_oldest(self):
+        stats = QrwsStats()
+        queue = OutboundQueue(2, 'drop_oldest', stats)
+        for n in range(4):
+            self.assertTrue(queue.put(_notification(n)))
+
+        self.assertEqual(2, queue.dropped_messages)
+        self.assertEqual(2, stats.queued_messages)
+        self.assertEqual(2, stats.max_queue_depth)
+        self.assertEqual({'n': 2}, queue.pop().data)
+        self.assertEqual(1, stats.queued_messages)
+
+    def test_coalesce(self):
+        stats = QrwsStats()
+        queue = OutboundQueue(2, 'coalesce', stats)
+        queue.put(_game_state('a'))
+        queue.put(_notification(0))
+        # the older game state is superseded
+        queue.put(_game_state('b'))
+        self.assertEqual(1, stats.coalesced_messages)
+        self.assertEqual({'n': 0}, queue.pop().data)
+        self.assertEqual('b', queue.pop().etag)
+
+        # messages which cannot be coalesced push out the oldest ones
+        queue.put(_notification(1))
+        queue.put(_notification(2))
+        queue.put(_notification(3))
+        self.assertEqual(1, stats.dropped_messages)
+        self.assertEqual({'n': 2}, queue.pop().data)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            OutboundQueue(2, 'ignore', QrwsStats())
@@ -0,0 +1,32 @@
+from unittest import TestCase
+
+from quadradiusr_server.routing import ConsistentHashRing, OwnerRouter
+
+
+class TestRouting(TestCase):
+    def test_ring(self):
+        keys = [f'game{i}' for i in range(3000)]
+        ring = ConsistentHashRing(['a', 'b', 'c'])
+        owners = {key: ring.get_node(key) for key in keys}
+        for node in ['a', 'b', 'c']:
+            self.assertGreater(list(owners.values()).count(node), 700)
+
+        # removing a node reassigns only its keys
+        smaller_ring = ConsistentHashRing(['a', 'b'])
+        for key in keys:
+            if owners[key] != 'c':
+                self.assertEqual(owners[key], smaller_ring.get_node(key))
+
+        self.assertIsNone(ConsistentHashRing([]).get_node('game'))
+
+    def test_router(self):
+        router = OwnerRouter([], 'example.com')
+        self.assertTrue(router.is_local('game0'))
+
+        router = OwnerRouter(['example.com', 'other.example.com'], 'example.com')
+        self.assertIsNone(router.get_owner('game0'))
+        self.assertEqual('other.example.com', router.get_owner('game2'))
+        self.assertFalse(router.is_local('game2'))
+
+        with self.assertRaises(ValueError):
+            OwnerRouter(['other.example.com'], 'example.com')
@@ -0,0 +1,20 @@
+from unittest import TestCase
+
+from quadradiusr_server.server import create_event_loop
+
+
+class TestServer(TestCase):
+    def test_create_event_loop(self):
+        for name in ['asyncio', 'uvloop']:
+            loop = create_event_loop(name)
+            try:
+                self.assertEqual(3, loop.run_until_complete(self._add(1, 2)))
+            finally:
+                loop.close()
+
+        with self.assertRaises(ValueError):
+            create_event_loop('unknown')
+
+    @staticmethod
+    async def _add(a, b):
+        return a + b
@@ -0,0 +1,49 @@
+import base64
+from datetime import datetime, timezone
+from unittest import TestCase
+
+from quadradiusr_server.signed_tokens import TokenSigner, TokenClaims
+
+
+class TestTokenSigner(TestCase):
+    def test_sign(self):
+        signer = TokenSigner(b'secret')
+        claims = TokenClaims(
+            token_id='token',
+            user_id='user',
+            username='ząbek',
+            expires_at=datetime(2030, 1, 1, tzinfo=timezone.utc),
+        )
+        token = signer.sign(claims)
+        self.assertTrue(TokenSigner.is_signed_token(token))
+        self.assertEqual(claims, signer.verify(token))
+
+        self.assertIsNone(TokenSigner(b'other').verify(token))
+        message, _, signature = token.rpartition('.')
+        self.assertIsNone(signer.verify(message + 'x.' + signature))
+        self.assertIsNone(signer.verify(message))
+        self.assertIsNone(signer.verify('v1.' + signer._sign('v1')))
+        self.assertIsNone(signer.verify('1ce8f1c1-0bd3-4c87-8d40-f2b3de3c1e7a'))
+        self.assertFalse(TokenSigner.is_signed_token('1ce8f1c1-0bd3-4c87-8d40-f2b3de3c1e7a'))
+
+    def test_malformed(self):
+        signer = TokenSigner(b'secret')
+        token = signer.sign(TokenClaims(
+            token_id='token',
+            user_id='user',
+            username='user',
+            expires_at=datetime(2030, 1, 1, tzinfo=timezone.utc),
+        ))
+        self.assertIsNone(signer.verify('v1.abc.é'))
+        self.assertIsNone(signer.verify('v1.é.' + token.rpartition('.')[2]))
+        self.assertIsNone(signer.verify(token + '\ud800'))
+        self.assertIsNone(signer.verify('v1.'))
+
+        # a validly signed message with malformed claims
+        for claims in ['{"t":"t","u":"u","n":"n","e":1e300}', '[]', 'not json']:
+            message = 'v1.' + base64.urlsafe_b64encode(claims.encode()).decode().rstrip('=')
+            self.assertIsNone(signer.verify(f'{message}.{signer._sign(message)}'))
+
+    def test_empty_secret(self):
+        with self.assertRaises(ValueError):
+            TokenSigner(b'')
@@ -0,0 +1,60 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from quadradiusr_server.config import ServerConfig, DatabaseConfig
+from quadradiusr_server.supervisor import WorkerSupervisor
+
+
+class TestWorkerSupervisor(TestCase):
+    def test_worker_configs(self):
+        config = ServerConfig(
+            host='0.0.0.0', port=8000, href='example.com:8000',
+            database=DatabaseConfig(url='sqlite+aiosqlite:///db.sqlite'))
+        supervisor = WorkerSupervisor(config, 3)
+        configs = supervisor.create_worker_configs('/tmp/relay.sock')
+
+        workers = ['example.com:8001', 'example.com:8002', 'example.com:8003']
+        self.assertEqual(3, len(configs))
+        for i, worker_config in enumerate(configs):
+            self.assertEqual(8000, worker_config.port)
+            self.assertTrue(worker_config.reuse_port)
+            self.assertEqual(8001 + i, worker_config.cluster.worker_port)
+            self.assertEqual(workers, worker_config.cluster.workers)
+            self.assertEqual(workers[i], worker_config.cluster.worker_href)
+            self.assertEqual(i == 0, worker_config.cluster.primary)
+            self.assertEqual('relay', worker_config.notification.backend)
+            self.assertEqual('/tmp/relay.sock', worker_config.notification.relay_path)
+            self.assertFalse(worker_config.database.create_metadata)
+            self.assertFalse(worker_config.database.migrate)
+
+        # the original config is not modified
+        self.assertEqual([], config.cluster.workers)
+        self.assertEqual('local', config.notification.backend)
+
+    def test_workers_not_daemonic(self):
+        config = ServerConfig(
+            host='0.0.0.0', port=8000,
+            database=DatabaseConfig(url='sqlite+aiosqlite:///db.sqlite'))
+        supervisor = WorkerSupervisor(config, 1)
+        supervisor._context = MagicMock()
+        supervisor._start_worker(0, config)
+
+        # workers may start their own processes for password hashing
+        _, kwargs = supervisor._context.Process.call_args
+        self.assertFalse(kwargs['daemon'])
+
+    def test_invalid_config(self):
+        database = DatabaseConfig(url='sqlite+aiosqlite:///db.sqlite')
+        with self.assertRaises(ValueError):
+            WorkerSupervisor(ServerConfig(
+                host='', port=8000), 2)
+        with self.assertRaises(ValueError):
+            WorkerSupervisor(ServerConfig(
+                host='', port=8000,
+                database=DatabaseConfig(url='sqlite+aiosqlite:///:memory:')), 2)
+        with self.assertRaises(ValueError):
+            WorkerSupervisor(ServerConfig(
+                host='', port=0, database=database), 2)
+        with self.assertRaises(ValueError):
+            WorkerSupervisor(ServerConfig(
+                host='', port=8000, database=database), 0)
@@ -1,7 +1,7 @@
 from unittest import TestCase
 from unittest.mock import MagicMock
 
-from quadradiusr_server.utils import can_pass_argument, import_class
+from quadradiusr_server.utils import can_pass_argument, import_class, diff_dicts
 
 
 class UtilsTest(TestCase):
@@ -45,3 +45,23 @@ class UtilsTest(TestCase):
         self.assertEqual(MagicMock, import_class('unittest.mock.MagicMock'))
         with self.assertRaises(ValueError):
             import_class('unittest.TestCase', subtype_of=str)
+
+    def test_diff_dicts(self):
+        self.assertEqual({}, diff_dicts({'a': 1, 'b': {'c': 2}}, {'a': 1, 'b': {'c': 2}}))
+        self.assertEqual({
+            'a': 2,
+            'b': {'c': 3},
+            'd': [1],
+            'e': 'added',
+            '$delete': ['f'],
+        }, diff_dicts({
+            'a': 1,
+            'b': {'c': 2, 'x': 0},
+            'd': [],
+            'f': 'removed',
+        }, {
+            'a': 2,
+            'b': {'c': 3, 'x': 0},
+            'd': [1],
+            'e': 'added',
+        }))
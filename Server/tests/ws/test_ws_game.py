@@ -1,12 +1,15 @@
 import asyncio
 from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, patch
 
 import aiohttp
 from async_timeout import timeout
 
 from harness import RestTestHarness, TestUserHarness, WebsocketHarness, GameHarness, \
     PowerRandomizerForTests
+from quadradiusr_server.config import ServerConfig, GameConfig
 from quadradiusr_server.constants import QrwsOpcode
+from quadradiusr_server.db.transactions import transaction_context
 from quadradiusr_server.game_state import Piece, Power, NextPowerSpawnInfo
 
 
@@ -80,6 +83,7 @@ class TestWsGame(
                 msg0 = await ws0.receive_json()
                 self.assertEqual(QrwsOpcode.GAME_STATE, msg0['op'])
                 game_state = msg0['d']['game_state']
+                etag = msg0['d']['etag']
 
                 self.assertEqual(user0['id'], game_state['current_player_id'])
 
@@ -108,6 +112,8 @@ class TestWsGame(
                     },
                 }, gs_diff['board']['pieces'])
                 self.assertEqual(user1['id'], gs_diff['current_player_id'])
+                self.assertEqual(etag, gs_diff_msg['d']['etag_from'])
+                self.assertNotEqual(etag, gs_diff_msg['d']['etag_to'])
 
                 game_state = await self.query_game_state(1, game_id)
 
@@ -458,3 +464,325 @@ class TestWsGame(
                     'rounds': 5,
                     'count': 2,
                 }, gs_diff_msg['d']['game_state_diff']['next_power_spawn'])
+
+    async def test_state_persisted(self):
+        await asyncio.gather(
+            self.create_test_user(0),
+            self.create_test_user(1),
+        )
+
+        user0 = await self.get_test_user(0)
+        user1 = await self.get_test_user(1)
+
+        game_id = await self.create_game(user0['id'], user1['id'])
+        game_ws = self.server_url(f'/game/{game_id}/connect', protocol='ws')
+
+        async with timeout(2), aiohttp.ClientSession() as session:
+            async with session.ws_connect(game_ws) as ws0:
+                await self.authorize_ws(0, ws0)
+
+                msg0 = await ws0.receive_json()
+                game_state = msg0['d']['game_state']
+                piece_id = self.get_game_piece_id_at(game_state, (0, 1))
+                tile_id = self.get_game_tile_id_at(game_state, (0, 2))
+
+                await self.ws_move(ws0, piece_id, tile_id)
+                move_result_msg = await self.ws_receive(ws0, QrwsOpcode.ACTION_RESULT)
+                self.assertTrue(move_result_msg['d']['is_legal'])
+
+                persisted = await self.get_game_state(game_id)
+                self.assertEqual(tile_id, persisted.board.pieces[piece_id].tile_id)
+                self.assertEqual(user1['id'], persisted.current_player_id)
+
+        # the game is reloaded from the database after everybody leaves
+        async with timeout(2):
+            while self.server.games[game_id].game_state is not None:
+                await asyncio.sleep(0.01)
+
+    async def test_serialized_state_cached(self):
+        await asyncio.gather(
+            self.create_test_user(0),
+            self.create_test_user(1),
+        )
+
+        user0 = await self.get_test_user(0)
+        user1 = await self.get_test_user(1)
+
+        game_id = await self.create_game(user0['id'], user1['id'])
+        game_ws = self.server_url(f'/game/{game_id}/connect', protocol='ws')
+
+        async with timeout(2), aiohttp.ClientSession() as session:
+            async with session.ws_connect(game_ws) as ws0:
+                await self.authorize_ws(0, ws0)
+
+                msg0 = await ws0.receive_json()
+                game_state = msg0['d']['game_state']
+                game_in_progress = self.server.games[game_id]
+
+                serialized0 = await game_in_progress.get_serialized_state_for(user0['id'])
+                self.assertEqual(msg0['d']['etag'], serialized0.etag)
+                self.assertIs(
+                    serialized0,
+                    await game_in_progress.get_serialized_state_for(user0['id']))
+                serialized1 = await game_in_progress.get_serialized_state_for(user1['id'])
+                self.assertNotEqual(serialized0.etag, serialized1.etag)
+
+                piece_id = self.get_game_piece_id_at(game_state, (0, 1))
+                tile_id = self.get_game_tile_id_at(game_state, (0, 2))
+                await self.ws_move(ws0, piece_id, tile_id)
+                move_result_msg = await self.ws_receive(ws0, QrwsOpcode.ACTION_RESULT)
+                self.assertTrue(move_result_msg['d']['is_legal'])
+
+                # the cache is invalidated by the action
+                serialized0_after = await game_in_progress.get_serialized_state_for(user0['id'])
+                self.assertNotEqual(serialized0.etag, serialized0_after.etag)
+                self.assertEqual(
+                    tile_id,
+                    serialized0_after.game_state['board']['pieces'][piece_id]['tile_id'])
+
+                # the REST endpoint serves the cached state
+                async with session.get(self.server_url(f'/game/{game_id}/state'), headers={
+                    'authorization': await self.authorize_test_user(0),
+                }) as response:
+                    self.assertEqual(200, response.status)
+                    self.assertEqual(f'"{serialized0_after.etag}"', response.headers['etag'])
+                    self.assertEqual(game_id, (await response.json())['game_id'])
+
+                # a matching ETag is answered without serializing the state
+                async with session.get(self.server_url(f'/game/{game_id}/state'), headers={
+                    'authorization': await self.authorize_test_user(1),
+                    'if-none-match': f'"{game_in_progress.etag_for(user1["id"])}"',
+                }) as response:
+                    self.assertEqual(304, response.status)
+                self.assertNotIn(user1['id'], game_in_progress._serialized)
+
+    async def test_save_on_commit(self):
+        await asyncio.gather(
+            self.create_test_user(0),
+            self.create_test_user(1),
+        )
+
+        user0 = await self.get_test_user(0)
+        user1 = await self.get_test_user(1)
+
+        game_id = await self.create_game(user0['id'], user1['id'])
+        async with transaction_context(self.server.database):
+            players = await self.server.repository.game_repository.get_players(game_id)
+            player0 = await self.server.repository.user_repository.get_by_id(user0['id'])
+            game_in_progress = self.server.start_game(players)
+
+            game_state = await game_in_progress.get_game_state()
+            rev = game_in_progress.rev
+            piece = game_state.board.get_piece_on(game_state.board.get_tile_at(0, 1).id)
+            tile = game_state.board.get_tile_at(0, 2)
+            result = await game_in_progress.make_move(player0, piece.id, tile.id)
+            self.assertTrue(result.is_legal)
+            # the move is saved only when the transaction is committed
+            self.assertTrue(game_in_progress.has_unsaved_changes)
+        self.assertFalse(game_in_progress.has_unsaved_changes)
+        self.assertEqual(rev + 1, await self.get_persisted_rev(game_id))
+
+        # a move which has not been saved is discarded
+        with self.assertRaises(RuntimeError), self.assertLogs(level='ERROR'):
+            async with transaction_context(self.server.database):
+                player1 = await self.server.repository.user_repository.get_by_id(user1['id'])
+                piece = game_state.board.get_piece_on(game_state.board.get_tile_at(1, 6).id)
+                tile = game_state.board.get_tile_at(1, 5)
+                result = await game_in_progress.make_move(player1, piece.id, tile.id)
+                self.assertTrue(result.is_legal)
+                raise RuntimeError()
+        self.assertIsNone(game_in_progress.game_state)
+        self.assertEqual(rev + 1, await self.get_persisted_rev(game_id))
+        async with transaction_context(self.server.database):
+            game_state = await game_in_progress.get_game_state()
+        self.assertEqual(rev + 1, game_in_progress.rev)
+        self.assertEqual(piece.id, game_state.board.get_piece_at(1, 6).id)
+
+    async def get_persisted_rev(self, game_id: str) -> int:
+        async with transaction_context(self.server.database):
+            return await self.server.repository.game_repository.get_rev(game_id)
+
+
+class TestWsGameWriteBehind(
+    IsolatedAsyncioTestCase,
+    WebsocketHarness,
+    GameHarness,
+    TestUserHarness,
+    RestTestHarness,
+):
+
+    async def asyncSetUp(self) -> None:
+        await self.setup_server(config=ServerConfig(
+            host='', port=0,
+            game=GameConfig(
+                persistence='write_behind',
+                checkpoint_actions=2,
+                checkpoint_interval_ms=60 * 1000,
+                snapshot_interval=2,
+            ),
+        ))
+
+    async def asyncTearDown(self) -> None:
+        await self.shutdown_server()
+
+    async def get_persisted_rev(self, game_id: str) -> int:
+        async with transaction_context(self.server.database):
+            return await self.server.repository.game_repository.get_rev(game_id)
+
+    async def test_checkpoints(self):
+        await asyncio.gather(
+            self.create_test_user(0),
+            self.create_test_user(1),
+        )
+
+        user0 = await self.get_test_user(0)
+        user1 = await self.get_test_user(1)
+
+        game_id = await self.create_game(user0['id'], user1['id'])
+        game_ws = self.server_url(f'/game/{game_id}/connect', protocol='ws')
+
+        async with timeout(2), aiohttp.ClientSession() as session:
+            async with session.ws_connect(game_ws) as ws0, \
+                    session.ws_connect(game_ws) as ws1:
+                await asyncio.gather(
+                    self.authorize_ws(0, ws0),
+                    self.authorize_ws(1, ws1),
+                )
+
+                game_state = (await ws0.receive_json())['d']['game_state']
+                game_in_progress = self.server.games[game_id]
+                rev = game_in_progress.rev
+                piece0_id = self.get_game_piece_id_at(game_state, (0, 1))
+                piece1_id = self.get_game_piece_id_at(game_state, (1, 6))
+
+                await self.ws_move(ws0, piece0_id, self.get_game_tile_id_at(game_state, (0, 2)))
+                move_result_msg = await self.ws_receive(ws0, QrwsOpcode.ACTION_RESULT)
+                self.assertTrue(move_result_msg['d']['is_legal'])
+                await self.ws_receive(ws1, QrwsOpcode.GAME_STATE_DIFF)
+
+                # the move is not persisted until a checkpoint
+                self.assertEqual(rev, await self.get_persisted_rev(game_id))
+                self.assertEqual(rev + 1, game_in_progress.rev)
+                self.assertTrue(game_in_progress.has_unsaved_changes)
+
+                await self.ws_move(ws1, piece1_id, self.get_game_tile_id_at(game_state, (1, 5)))
+                move_result_msg = await self.ws_receive(ws1, QrwsOpcode.ACTION_RESULT)
+                self.assertTrue(move_result_msg['d']['is_legal'])
+
+                while await self.get_persisted_rev(game_id) != rev + 2:
+                    await asyncio.sleep(0.01)
+                self.assertFalse(game_in_progress.has_unsaved_changes)
+                async with transaction_context(self.server.database):
+                    stored = await self.server.repository.game_repository.get_state(game_id)
+                    self.assertEqual(rev + 2, stored.snapshot_rev)
+
+                await self.ws_move(ws0, piece0_id, self.get_game_tile_id_at(game_state, (0, 3)))
+                move_result_msg = await self.ws_receive(ws0, QrwsOpcode.ACTION_RESULT)
+                self.assertTrue(move_result_msg['d']['is_legal'])
+                self.assertEqual(rev + 2, await self.get_persisted_rev(game_id))
+
+        # the state is persisted after everybody leaves
+        async with timeout(2):
+            while self.server.games[game_id].game_state is not None:
+                await asyncio.sleep(0.01)
+        self.assertEqual(rev + 3, await self.get_persisted_rev(game_id))
+        persisted = await self.get_game_state(game_id)
+        self.assertEqual(
+            self.get_game_tile_id_at(game_state, (0, 3)),
+            persisted.board.pieces[piece0_id].tile_id)
+
+    async def test_flush(self):
+        await asyncio.gather(
+            self.create_test_user(0),
+            self.create_test_user(1),
+        )
+
+        user0 = await self.get_test_user(0)
+        user1 = await self.get_test_user(1)
+
+        game_id = await self.create_game(user0['id'], user1['id'])
+        async with transaction_context(self.server.database):
+            players = await self.server.repository.game_repository.get_players(game_id)
+            player0 = await self.server.repository.user_repository.get_by_id(user0['id'])
+            game_in_progress = self.server.start_game(players)
+
+            game_state = await game_in_progress.get_game_state()
+            rev = game_in_progress.rev
+            piece = game_state.board.get_piece_on(game_state.board.get_tile_at(0, 1).id)
+            tile = game_state.board.get_tile_at(0, 2)
+            result = await game_in_progress.make_move(player0, piece.id, tile.id)
+            self.assertTrue(result.is_legal)
+        self.assertEqual(rev, await self.get_persisted_rev(game_id))
+
+        # the server flushes all games this way on shutdown
+        await game_in_progress.flush()
+        self.assertEqual(rev + 1, await self.get_persisted_rev(game_id))
+        self.assertEqual(
+            tile.id,
+            (await self.get_game_state(game_id)).board.pieces[piece.id].tile_id)
+
+
+class TestWsGameCheckpointFailures(
+    IsolatedAsyncioTestCase,
+    WebsocketHarness,
+    GameHarness,
+    TestUserHarness,
+    RestTestHarness,
+):
+
+    async def asyncSetUp(self) -> None:
+        await self.setup_server(config=ServerConfig(
+            host='', port=0,
+            game=GameConfig(
+                persistence='write_behind',
+                checkpoint_actions=1,
+                checkpoint_interval_ms=20,
+                checkpoint_max_retry_interval_ms=80,
+            ),
+        ))
+
+    async def asyncTearDown(self) -> None:
+        await self.shutdown_server()
+
+    async def get_persisted_rev(self, game_id: str) -> int:
+        async with transaction_context(self.server.database):
+            return await self.server.repository.game_repository.get_rev(game_id)
+
+    async def test_retry_backoff(self):
+        await asyncio.gather(
+            self.create_test_user(0),
+            self.create_test_user(1),
+        )
+
+        user0 = await self.get_test_user(0)
+        user1 = await self.get_test_user(1)
+
+        game_id = await self.create_game(user0['id'], user1['id'])
+        game_repo = self.server.repository.game_repository
+        add_moves = AsyncMock(side_effect=RuntimeError('database is down'))
+
+        with patch.object(game_repo, 'add_moves', add_moves), \
+                self.assertLogs(level='ERROR'):
+            async with transaction_context(self.server.database):
+                players = await game_repo.get_players(game_id)
+                player0 = await self.server.repository.user_repository.get_by_id(user0['id'])
+                game_in_progress = self.server.start_game(players)
+
+                game_state = await game_in_progress.get_game_state()
+                rev = game_in_progress.rev
+                piece = game_state.board.get_piece_on(game_state.board.get_tile_at(0, 1).id)
+                tile = game_state.board.get_tile_at(0, 2)
+                result = await game_in_progress.make_move(player0, piece.id, tile.id)
+                self.assertTrue(result.is_legal)
+
+            # retries after 20, 40, 80, 80, ... milliseconds
+            await asyncio.sleep(0.5)
+            self.assertGreaterEqual(add_moves.await_count, 3)
+            self.assertLessEqual(add_moves.await_count, 10)
+            self.assertTrue(game_in_progress.has_unsaved_changes)
+
+        # the game is saved as soon as the database is back
+        async with timeout(2):
+            while game_in_progress.has_unsaved_changes:
+                await asyncio.sleep(0.01)
+        self.assertEqual(rev + 1, await self.get_persisted_rev(game_id))
@@ -1,6 +1,7 @@
 from unittest import IsolatedAsyncioTestCase
 
 import aiohttp
+import msgpack
 from aiohttp import WSMsgType
 from async_timeout import timeout
 
@@ -72,3 +73,37 @@ class TestWsGateway(IsolatedAsyncioTestCase, TestUserHarness, RestTestHarness):
             })
             data = await ws.receive_json()
             self.assertEqual(QrwsOpcode.SERVER_READY, data['op'])
+
+    async def test_gateway_msgpack(self):
+        await self.create_test_user(0)
+        async with timeout(2), \
+                aiohttp.ClientSession() as session, \
+                session.ws_connect(self.server_url(
+                    '/gateway?encoding=msgpack', protocol='ws')) as ws:
+            # text frames are not accepted
+            await ws.send_json({
+                'op': QrwsOpcode.HEARTBEAT,
+                'd': {},
+            })
+            received = await ws.receive()
+            self.assertEqual(WSMsgType.BINARY, received.type)
+            data = msgpack.unpackb(received.data)
+            self.assertEqual(QrwsOpcode.ERROR, data['op'])
+            self.assertEqual('Unexpected message type', data['d']['message'])
+
+            await ws.send_bytes(msgpack.packb({
+                'op': QrwsOpcode.IDENTIFY,
+                'd': {
+                    'token': await self.authorize_test_user(0),
+                },
+            }))
+            received = await ws.receive()
+            self.assertEqual(WSMsgType.BINARY, received.type)
+            self.assertEqual(QrwsOpcode.SERVER_READY, msgpack.unpackb(received.data)['op'])
+
+    async def test_gateway_unsupported_encoding(self):
+        async with timeout(2), aiohttp.ClientSession() as session:
+            with self.assertRaises(aiohttp.WSServerHandshakeError) as cm:
+                await session.ws_connect(self.server_url(
+                    '/gateway?encoding=xml', protocol='ws'))
+            self.assertEqual(400, cm.exception.status)